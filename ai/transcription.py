@@ -1,28 +1,33 @@
 import asyncio
+from collections import deque
 import os
 import time
-from typing import Awaitable, Callable
+from typing import Awaitable, Callable, Deque, Optional
 
-from deepgram import DeepgramClient, LiveTranscriptionEvents, LiveOptions
+from deepgram import DeepgramClient, DeepgramClientOptions, LiveTranscriptionEvents, LiveOptions
 from deepgram.clients.live.v1.client import LiveClient
 from deepgram.clients.live.v1.async_client import AsyncLiveClient
 from deepgram.clients.live.v1.response import OpenResponse, SpeechStartedResponse, LiveResultResponse, MetadataResponse, UtteranceEndResponse, ErrorResponse, CloseResponse
 import openai
 
+from server.transcription import WhisperBackend, audio_filename
+
 
 ####################################################################################################
 # Whisper
 ####################################################################################################
 
-client = openai.OpenAI()
+whisper: Optional[WhisperBackend] = None
 
 def transcribe(filepath: str) -> str:
+    # Transcribes a file directly, without the speech server. The client is created on first use so
+    # that importing this module does not require an OpenAI key.
+    global whisper
+    if whisper is None:
+        whisper = WhisperBackend(client=openai.OpenAI())
+    audio_filename(filename=filepath)       # rejects formats Whisper cannot infer from the extension
     with open(filepath, mode="rb") as fp:
-        transcript = client.audio.translations.create(
-            model="whisper-1", 
-            file=fp
-        )
-        return transcript.text
+        return whisper.transcribe(audio=fp)
 
 
 ####################################################################################################
@@ -30,47 +35,129 @@ def transcribe(filepath: str) -> str:
 ####################################################################################################
 
 class DeepgramTranscriber:
-    def __init__(self, on_sentence_received: Callable[[str], Awaitable[None]]):
-        deepgram_client = DeepgramClient(api_key=os.getenv("DEEPGRAM_API_KEY"))
+    # Streams live linear16 audio to Deepgram and invokes on_sentence_received for each final sentence.
+    # If the connection errors out or closes unexpectedly, it is torn down and re-established with
+    # exponential backoff. Audio sent while disconnected is buffered (up to max_buffered_seconds) and
+    # flushed once the connection is back. The endpoint may be overridden with DEEPGRAM_URL, e.g. to
+    # point at local/fake_deepgram.py.
+    def __init__(
+        self,
+        on_sentence_received: Callable[[str], Awaitable[None]],
+        sample_rate: int = 16000,
+        url: Optional[str] = None,
+        max_buffered_seconds: float = 5
+    ):
+        config = DeepgramClientOptions(url=url or os.getenv("DEEPGRAM_URL", "api.deepgram.com"), options={ "keepalive": "true" })
+        self._deepgram_client = DeepgramClient(api_key=os.getenv("DEEPGRAM_API_KEY", ""), config=config)
+        self._sample_rate = sample_rate
         self._is_open = False
         self._on_sentence_received = on_sentence_received
-        self._deepgram_connection: AsyncLiveClient = deepgram_client.listen.asynclive.v(version="1")
-        self._deepgram_connection.on(LiveTranscriptionEvents.Open, self._on_open)
-        self._deepgram_connection.on(LiveTranscriptionEvents.Transcript, self._on_message)
-        self._deepgram_connection.on(LiveTranscriptionEvents.Metadata, self._on_metadata)
-        self._deepgram_connection.on(LiveTranscriptionEvents.SpeechStarted, self._on_speech_started)
-        self._deepgram_connection.on(LiveTranscriptionEvents.UtteranceEnd, self._on_utterance_end)
-        self._deepgram_connection.on(LiveTranscriptionEvents.Error, self._on_error)
-        self._deepgram_connection.on(LiveTranscriptionEvents.Close, self._on_close)
+        self._deepgram_connection: Optional[AsyncLiveClient] = None
+        self._finishing = False
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._max_buffered_bytes = int(max_buffered_seconds * sample_rate * 2)
+        self._buffered_audio: Deque[bytes] = deque()
+        self._buffered_bytes = 0
         print("DeepgramTranscriber created")
 
     async def start(self):
+        self._finishing = False
+        await self._connect()
+
+    async def send_audio(self, audio: bytes):
+        if not self._is_open or self._reconnect_task is not None:
+            self._buffer_audio(audio)
+            return
+        sent = await self._deepgram_connection.send(audio)
+        if sent is False:
+            # A clean close by the server is not reported as an event; it only shows up as failed sends
+            self._buffer_audio(audio)
+            self._schedule_reconnect(self._deepgram_connection)
+
+    async def finish(self):
+        self._finishing = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self._deepgram_connection is not None:
+            await self._deepgram_connection.finish()
+
+    def _create_connection(self) -> AsyncLiveClient:
+        deepgram_connection: AsyncLiveClient = self._deepgram_client.listen.asynclive.v(version="1")
+        deepgram_connection.on(LiveTranscriptionEvents.Open, self._on_open)
+        deepgram_connection.on(LiveTranscriptionEvents.Transcript, self._on_message)
+        deepgram_connection.on(LiveTranscriptionEvents.Metadata, self._on_metadata)
+        deepgram_connection.on(LiveTranscriptionEvents.SpeechStarted, self._on_speech_started)
+        deepgram_connection.on(LiveTranscriptionEvents.UtteranceEnd, self._on_utterance_end)
+        deepgram_connection.on(LiveTranscriptionEvents.Error, self._on_error)
+        deepgram_connection.on(LiveTranscriptionEvents.Close, self._on_close)
+        return deepgram_connection
+
+    async def _connect(self, timeout: float = 10):
         options: LiveOptions = LiveOptions(
             model="nova-2",
             punctuate=True,
             language="en-US",
             encoding="linear16",
             channels=1,
-            sample_rate=16000,
+            sample_rate=self._sample_rate,
             diarize=False,
             # To get UtteranceEnd, the following must be set:
             interim_results=True,
             #utterance_end_ms="1000",
             vad_events=True
         )
+        self._is_open = False
+        self._deepgram_connection = self._create_connection()
         await self._deepgram_connection.start(options)
+        start_time = time.time()
         while not self._is_open:
+            if time.time() - start_time > timeout:
+                raise TimeoutError("Timed out connecting to Deepgram")
             await asyncio.sleep(0.1)
 
-    async def send_audio(self, audio: bytes):
-        await self._deepgram_connection.send(audio)
+    async def _reconnect(self):
+        # Tear down the failed connection and retry with exponential backoff until connected
+        try:
+            stale_connection = self._deepgram_connection
+            self._is_open = False
+            try:
+                await stale_connection.finish()
+            except Exception:
+                pass
+            delay = 0.5
+            while not self._finishing:
+                try:
+                    await self._connect()
+                    print("Reconnected to Deepgram")
+                    break
+                except Exception as e:
+                    print(f"Failed to reconnect to Deepgram ({e}), retrying in {delay:.1f} s")
+                    await asyncio.sleep(delay)
+                    delay = min(2 * delay, 10)
+            while len(self._buffered_audio) > 0 and self._is_open:
+                audio = self._buffered_audio.popleft()
+                self._buffered_bytes -= len(audio)
+                await self._deepgram_connection.send(audio)
+        finally:
+            self._reconnect_task = None
+
+    def _schedule_reconnect(self, deepgram_connection: AsyncLiveClient):
+        # Ignore events from connections we have already abandoned, and coalesce repeated errors
+        if self._finishing or deepgram_connection is not self._deepgram_connection or self._reconnect_task is not None:
+            return
+        self._reconnect_task = asyncio.ensure_future(self._reconnect())
 
-    async def finish(self):
-        await self._deepgram_connection.finish()
+    def _buffer_audio(self, audio: bytes):
+        self._buffered_audio.append(audio)
+        self._buffered_bytes += len(audio)
+        while self._buffered_bytes > self._max_buffered_bytes:
+            self._buffered_bytes -= len(self._buffered_audio.popleft())
 
     async def _on_open(self, deepgram_connection: AsyncLiveClient, open: OpenResponse, **kwargs):
         print("Connection to Deepgram opened")
-        self._is_open = True
+        if deepgram_connection is self._deepgram_connection:
+            self._is_open = True
 
     async def _on_message(self, deepgram_connection: LiveClient, result: LiveResultResponse, **kwargs):
         sentence = result.channel.alternatives[0].transcript
@@ -89,11 +176,12 @@ class DeepgramTranscriber:
         pass
 
     async def _on_error(self, deepgram_connection: AsyncLiveClient, error: ErrorResponse, **kwargs):
-        #TODO: with AsyncLiveClient, this gets called repeatedly. Need to find a way to terminate
-        #      the client and then attempt to restart it, or we should just always kill socket when
-        #      not transmitting audio data.
+        # With AsyncLiveClient, this gets called repeatedly, so the connection is abandoned and replaced
         print(f"ERROR: {type(error)}: {error}")
+        self._schedule_reconnect(deepgram_connection)
 
     async def _on_close(self, deepgram_connection: AsyncLiveClient, close: CloseResponse, **kwargs):
         print("Connection to Deepgram closed")
-        self._is_open = False
\ No newline at end of file
+        if deepgram_connection is self._deepgram_connection:
+            self._is_open = False
+            self._schedule_reconnect(deepgram_connection)
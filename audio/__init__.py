@@ -0,0 +1,3 @@
+from .capture import RingBuffer, AudioSource, ArecordSource, PyAudioSource, AudioCapture
+from .vad import VoiceActivityDetector, UtteranceSegmenter, utterances
+from .encoding import EncodedAudio, StreamingResampler, downmix, resample, encode, to_wav_bytes
@@ -0,0 +1,206 @@
+import asyncio
+import subprocess
+import threading
+from typing import AsyncIterator, Optional
+
+import numpy as np
+
+
+####################################################################################################
+# Ring Buffer
+####################################################################################################
+
+# Fixed-capacity buffer of int16 mono samples. Samples are addressed by their absolute index in the
+# stream (the number of samples captured before them), which lets any number of readers keep their
+# own cursors. Written from the capture thread, read from the asyncio loop.
+class RingBuffer:
+    def __init__(self, capacity: int):
+        self._buffer = np.zeros(capacity, dtype=np.int16)
+        self._capacity = capacity
+        self._total_written = 0
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def total_written(self) -> int:
+        with self._lock:
+            return self._total_written
+
+    @property
+    def oldest_index(self) -> int:
+        with self._lock:
+            return max(0, self._total_written - self._capacity)
+
+    def write(self, samples: np.ndarray):
+        samples = samples[-self._capacity:]
+        with self._lock:
+            start = self._total_written % self._capacity
+            end = start + len(samples)
+            if end <= self._capacity:
+                self._buffer[start:end] = samples
+            else:
+                split = self._capacity - start
+                self._buffer[start:] = samples[:split]
+                self._buffer[:end - self._capacity] = samples[split:]
+            self._total_written += len(samples)
+
+    def read(self, start: int, count: int) -> np.ndarray:
+        with self._lock:
+            if start < max(0, self._total_written - self._capacity) or start + count > self._total_written:
+                raise IndexError(f"Samples [{start}, {start + count}) are not in the buffer")
+            begin = start % self._capacity
+            end = begin + count
+            if end <= self._capacity:
+                return self._buffer[begin:end].copy()
+            return np.concatenate([ self._buffer[begin:], self._buffer[:end - self._capacity] ])
+
+
+####################################################################################################
+# Audio Capture
+####################################################################################################
+
+class AudioSource:
+    def open(self):
+        pass
+
+    def read(self) -> bytes:
+        # Blocking read of the next chunk of little-endian int16 mono PCM. Returns b"" at end of stream.
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class ArecordSource(AudioSource):
+    def __init__(self, device: str, sample_rate: int, chunk_frames: int = 1024):
+        self._device = device
+        self._sample_rate = sample_rate
+        self._chunk_bytes = chunk_frames * 2
+        self._process: Optional[subprocess.Popen] = None
+
+    def open(self):
+        cmd = [ "arecord", "-q", "--format=S16_LE", f"--device={self._device}", "-r", str(self._sample_rate), "-c", "1", "-t", "raw" ]
+        self._process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+
+    def read(self) -> bytes:
+        return self._process.stdout.read(self._chunk_bytes)
+
+    def close(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+class PyAudioSource(AudioSource):
+    def __init__(self, sample_rate: int, chunk_frames: int = 1024):
+        self._sample_rate = sample_rate
+        self._chunk_frames = chunk_frames
+        self._audio = None
+        self._stream = None
+
+    def open(self):
+        import pyaudio
+        self._audio = pyaudio.PyAudio()
+        self._stream = self._audio.open(rate=self._sample_rate, channels=1, format=pyaudio.paInt16, input=True, frames_per_buffer=self._chunk_frames)
+
+    def read(self) -> bytes:
+        return self._stream.read(self._chunk_frames, exception_on_overflow=False)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._audio.terminate()
+            self._stream = None
+
+# Continuously reads PCM from an AudioSource on a dedicated thread into a RingBuffer. Capture keeps
+# running even while the asyncio loop is busy (e.g., blocked in a robot call), and consumers on the
+# loop are woken whenever new samples arrive.
+class AudioCapture:
+    def __init__(self, source: AudioSource, sample_rate: int, buffer_seconds: float = 30):
+        self.sample_rate = sample_rate
+        self.buffer = RingBuffer(capacity=int(buffer_seconds * sample_rate))
+        self._source = source
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._data_available: Optional[asyncio.Event] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._data_available = asyncio.Event()
+        self._source.open()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="AudioCapture", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._running = False
+        if self._thread is not None:
+            await self._loop.run_in_executor(None, self._thread.join)
+            self._thread = None
+        self._source.close()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    async def wait_for_samples(self, end_index: int):
+        while self.buffer.total_written < end_index:
+            if not self._running:
+                raise EOFError("Audio capture stopped")
+            self._data_available.clear()
+            if self.buffer.total_written >= end_index:
+                break
+            await self._data_available.wait()
+
+    async def windows(self, window_seconds: float, hop_seconds: float) -> AsyncIterator[np.ndarray]:
+        # Yields windows of window_seconds, each starting hop_seconds after the previous one. With
+        # hop < window, consecutive windows overlap so an utterance straddling one window boundary is
+        # fully contained in the next. A consumer that falls behind the ring buffer skips ahead to the
+        # most recent complete window rather than reading overwritten samples.
+        window = int(window_seconds * self.sample_rate)
+        hop = int(hop_seconds * self.sample_rate)
+        assert 0 < hop and 0 < window <= self.buffer.capacity
+        cursor = self.buffer.total_written
+        while True:
+            await self.wait_for_samples(end_index=cursor + window)
+            if cursor < self.buffer.oldest_index:
+                cursor = self.buffer.total_written - window
+            yield self.buffer.read(start=cursor, count=window)
+            cursor += hop
+
+    def blocks(self, block_seconds: float) -> AsyncIterator[np.ndarray]:
+        # Contiguous, non-overlapping blocks of the live stream
+        return self.windows(window_seconds=block_seconds, hop_seconds=block_seconds)
+
+    def _run(self):
+        remainder = b""
+        try:
+            while self._running:
+                chunk = self._source.read()
+                if len(chunk) == 0:
+                    break
+                # Pipe reads may split a sample; carry the odd byte over to the next chunk
+                chunk = remainder + chunk
+                usable = len(chunk) & ~1
+                remainder = chunk[usable:]
+                self.buffer.write(np.frombuffer(chunk[:usable], dtype="<i2"))
+                self._notify()
+        except Exception as e:
+            print(f"Audio capture failed: {e}")
+        finally:
+            self._running = False
+            self._notify()
+
+    def _notify(self):
+        try:
+            self._loop.call_soon_threadsafe(self._data_available.set)
+        except RuntimeError:
+            # Event loop already closed
+            pass
@@ -0,0 +1,114 @@
+from io import BytesIO
+from math import gcd
+from typing import NamedTuple
+import wave
+
+import numpy as np
+
+
+####################################################################################################
+# Resampling
+####################################################################################################
+
+UPLOAD_SAMPLE_RATE = 16000
+
+def downmix(samples: np.ndarray) -> np.ndarray:
+    # (num_frames, num_channels) -> (num_frames,)
+    if samples.ndim == 1:
+        return samples
+    return samples.mean(axis=1).astype(samples.dtype)
+
+def lowpass_filter(cutoff: float, num_taps: int) -> np.ndarray:
+    # Windowed-sinc FIR; cutoff is a fraction of the Nyquist frequency
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = cutoff * np.sinc(cutoff * n) * np.blackman(num_taps)
+    return taps / taps.sum()
+
+def resample(samples: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    # Band-limits the signal to the new Nyquist frequency, then decimates (integer ratios such as
+    # 48 kHz -> 16 kHz) or interpolates (e.g., 44.1 kHz -> 16 kHz). Returns int16.
+    if src_rate == dst_rate:
+        return samples.astype(np.int16, copy=False)
+    x = samples.astype(np.float32)
+    divisor = gcd(src_rate, dst_rate)
+    up, down = dst_rate // divisor, src_rate // divisor
+    if dst_rate < src_rate:
+        taps = lowpass_filter(cutoff=0.9 * dst_rate / src_rate, num_taps=16 * (src_rate // dst_rate + 1) + 1)
+        x = np.convolve(x, taps, mode="same")
+    if up == 1:
+        y = x[::down]
+    else:
+        num_output = int(len(x) * dst_rate / src_rate)
+        y = np.interp(np.arange(num_output) * (src_rate / dst_rate), np.arange(len(x)), x)
+    return np.clip(np.round(y), -32768, 32767).astype(np.int16)
+
+class StreamingResampler:
+    # Resamples a live stream block by block. The filter state is carried across blocks so there are
+    # no discontinuities at block boundaries. Supports integer decimation ratios (e.g., 48 kHz -> 16 kHz).
+    def __init__(self, src_rate: int, dst_rate: int):
+        if src_rate % dst_rate != 0:
+            raise ValueError(f"Cannot stream-resample {src_rate} Hz to {dst_rate} Hz: ratio is not an integer")
+        self._factor = src_rate // dst_rate
+        self._taps = lowpass_filter(cutoff=0.9 / self._factor, num_taps=16 * (self._factor + 1) + 1)
+        self._history = np.zeros(len(self._taps) - 1, dtype=np.float32)
+        self._phase = 0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        if self._factor == 1:
+            return samples.astype(np.int16, copy=False)
+        x = np.concatenate([ self._history, samples.astype(np.float32) ])
+        y = np.convolve(x, self._taps, mode="valid")
+        self._history = x[len(x) - len(self._history):]
+        output = y[self._phase::self._factor]
+        self._phase = (self._phase - len(y)) % self._factor
+        return np.clip(np.round(output), -32768, 32767).astype(np.int16)
+
+
+####################################################################################################
+# Encoding
+####################################################################################################
+
+class EncodedAudio(NamedTuple):
+    data: bytes
+    filename: str
+    content_type: str
+
+AUDIO_FORMATS = {
+    # format: (filename, content type)
+    "wav": ("voice.wav", "audio/wav"),
+    "flac": ("voice.flac", "audio/flac"),
+    "opus": ("voice.ogg", "audio/ogg")
+}
+
+def to_wav_bytes(samples: np.ndarray, sample_rate: int) -> bytes:
+    buffer = BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(samples.astype("<i2", copy=False).tobytes())
+    return buffer.getvalue()
+
+def encode(samples: np.ndarray, sample_rate: int, format: str = "wav", target_sample_rate: int = UPLOAD_SAMPLE_RATE) -> EncodedAudio:
+    # Prepares captured audio for upload: mono, resampled to target_sample_rate (speech recognition does
+    # not benefit from more), and optionally compressed with FLAC (lossless) or Opus (lossy)
+    if format not in AUDIO_FORMATS:
+        raise ValueError(f"Unsupported audio format: {format}")
+    samples = resample(downmix(samples), src_rate=sample_rate, dst_rate=target_sample_rate)
+    filename, content_type = AUDIO_FORMATS[format]
+    if format == "wav":
+        data = to_wav_bytes(samples=samples, sample_rate=target_sample_rate)
+    elif format == "flac":
+        data = _encode_soundfile(samples=samples, sample_rate=target_sample_rate, container="FLAC", subtype="PCM_16")
+    else:
+        data = _encode_soundfile(samples=samples, sample_rate=target_sample_rate, container="OGG", subtype="OPUS")
+    return EncodedAudio(data=data, filename=filename, content_type=content_type)
+
+def _encode_soundfile(samples: np.ndarray, sample_rate: int, container: str, subtype: str) -> bytes:
+    try:
+        import soundfile
+    except ImportError:
+        raise RuntimeError("FLAC and Opus encoding require the soundfile package (pip install soundfile)")
+    buffer = BytesIO()
+    soundfile.write(buffer, samples, sample_rate, format=container, subtype=subtype)
+    return buffer.getvalue()
@@ -0,0 +1,164 @@
+from typing import AsyncIterator, List, Optional
+
+import numpy as np
+
+
+####################################################################################################
+# Frame Features
+####################################################################################################
+
+def frame_features(samples: np.ndarray, frame_length: int):
+    # Splits samples into whole frames and returns (energy in dBFS, zero-crossing rate) per frame,
+    # computed for all frames at once
+    num_frames = len(samples) // frame_length
+    frames = samples[:num_frames * frame_length].reshape(num_frames, frame_length).astype(np.float32) / 32768.0
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    energy_db = 20 * np.log10(np.maximum(rms, 1e-10))
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / float(frame_length - 1)
+    return energy_db, zcr
+
+
+####################################################################################################
+# Voice Activity Detection
+####################################################################################################
+
+class VoiceActivityDetector:
+    # Classifies frames as speech when their energy is sufficiently above an adaptive noise floor.
+    # Frames whose zero-crossing rate is too high (hiss, fans, clicks) must clear a higher energy bar.
+    def __init__(
+        self,
+        sample_rate: int,
+        frame_ms: float = 30,
+        threshold_db: float = 12,
+        min_energy_db: float = -50,
+        max_zcr: float = 0.35,
+        high_zcr_margin_db: float = 10,
+        noise_adaptation: float = 0.05
+    ):
+        self.sample_rate = sample_rate
+        self.frame_length = int(sample_rate * frame_ms / 1000)
+        self._threshold_db = threshold_db
+        self._min_energy_db = min_energy_db
+        self._max_zcr = max_zcr
+        self._high_zcr_margin_db = high_zcr_margin_db
+        self._noise_adaptation = noise_adaptation
+        self._noise_floor_db: Optional[float] = None
+
+    @property
+    def noise_floor_db(self) -> Optional[float]:
+        return self._noise_floor_db
+
+    def classify(self, samples: np.ndarray) -> np.ndarray:
+        energy_db, zcr = frame_features(samples=samples, frame_length=self.frame_length)
+        if len(energy_db) == 0:
+            return np.zeros(0, dtype=bool)
+        if self._noise_floor_db is None:
+            self._noise_floor_db = float(np.percentile(energy_db, 10))
+
+        threshold = max(self._noise_floor_db + self._threshold_db, self._min_energy_db)
+        is_speech = (energy_db > threshold) & ((zcr <= self._max_zcr) | (energy_db > threshold + self._high_zcr_margin_db))
+
+        # Track the noise floor using only the non-speech frames of this block
+        silence = energy_db[~is_speech]
+        if len(silence) > 0:
+            alpha = 1 - (1 - self._noise_adaptation) ** len(silence)
+            self._noise_floor_db += alpha * (float(np.mean(silence)) - self._noise_floor_db)
+        return is_speech
+
+
+####################################################################################################
+# Utterance Segmentation
+####################################################################################################
+
+class UtteranceSegmenter:
+    # Turns a continuous stream into utterance segments. A segment opens on the first speech frame and
+    # closes once hangover_ms of silence has followed the last speech frame. The emitted audio runs from
+    # pre_roll_ms before the first speech frame to post_roll_ms after the last one, so leading and
+    # trailing silence is trimmed while word onsets and tails are kept.
+    def __init__(
+        self,
+        vad: VoiceActivityDetector,
+        pre_roll_ms: float = 300,
+        post_roll_ms: float = 200,
+        hangover_ms: float = 600,
+        min_speech_ms: float = 150,
+        max_segment_seconds: float = 15
+    ):
+        self._vad = vad
+        self._frame_length = vad.frame_length
+        self._pre_roll_frames = self._to_frames(pre_roll_ms, vad)
+        self._post_roll_frames = self._to_frames(post_roll_ms, vad)
+        self._hangover_frames = max(1, self._to_frames(hangover_ms, vad))
+        self._min_speech_frames = max(1, self._to_frames(min_speech_ms, vad))
+        self._max_segment_frames = self._to_frames(max_segment_seconds * 1000, vad)
+        self._pending = np.zeros(0, dtype=np.int16)     # samples not yet making up a whole frame
+        self._history = np.zeros(0, dtype=np.int16)     # recent silence, kept for pre-roll
+        self._segment: List[np.ndarray] = []            # frames of the open segment
+        self._last_speech = -1                          # index within segment of last speech frame
+        self._speech_frames = 0
+
+    @staticmethod
+    def _to_frames(ms: float, vad: VoiceActivityDetector) -> int:
+        return int(round(ms / (1000.0 * vad.frame_length / vad.sample_rate)))
+
+    @property
+    def in_speech(self) -> bool:
+        return len(self._segment) > 0
+
+    def process(self, samples: np.ndarray) -> List[np.ndarray]:
+        samples = np.concatenate([ self._pending, samples ])
+        num_frames = len(samples) // self._frame_length
+        self._pending = samples[num_frames * self._frame_length:]
+        if num_frames == 0:
+            return []
+        frames = samples[:num_frames * self._frame_length].reshape(num_frames, self._frame_length)
+        is_speech = self._vad.classify(frames.reshape(-1))
+
+        segments = []
+        for frame, speech in zip(frames, is_speech):
+            if not self.in_speech:
+                if not speech:
+                    self._history = self._keep_pre_roll([ self._history, frame ])
+                    continue
+                self._segment = list(self._history.reshape(-1, self._frame_length))
+                self._history = np.zeros(0, dtype=np.int16)
+                self._speech_frames = 0
+            self._segment.append(frame)
+            if speech:
+                self._last_speech = len(self._segment) - 1
+                self._speech_frames += 1
+            silent_frames = len(self._segment) - 1 - self._last_speech
+            if silent_frames >= self._hangover_frames or len(self._segment) >= self._max_segment_frames:
+                segment = self._close_segment()
+                if segment is not None:
+                    segments.append(segment)
+        return segments
+
+    def _keep_pre_roll(self, frames: List[np.ndarray]) -> np.ndarray:
+        keep = self._pre_roll_frames * self._frame_length
+        if keep == 0 or len(frames) == 0:
+            return np.zeros(0, dtype=np.int16)
+        return np.concatenate(frames)[-keep:]
+
+    def flush(self) -> Optional[np.ndarray]:
+        self._pending = np.zeros(0, dtype=np.int16)
+        return self._close_segment() if self.in_speech else None
+
+    def _close_segment(self) -> Optional[np.ndarray]:
+        end = min(len(self._segment), self._last_speech + 1 + self._post_roll_frames)
+        segment = self._segment[:end]
+        # Silence following the segment becomes pre-roll for the next one
+        self._history = self._keep_pre_roll(self._segment[end:])
+        self._segment = []
+        self._last_speech = -1
+        if self._speech_frames < self._min_speech_frames:
+            return None
+        return np.concatenate(segment)
+
+
+async def utterances(blocks: AsyncIterator[np.ndarray], segmenter: UtteranceSegmenter) -> AsyncIterator[np.ndarray]:
+    # Yields speech segments from a stream of contiguous audio blocks (e.g., AudioCapture.blocks())
+    async for block in blocks:
+        for segment in segmenter.process(block):
+            yield segment
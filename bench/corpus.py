@@ -0,0 +1,79 @@
+#
+# Benchmark corpus: spoken commands described by corpus/manifest.json. Each entry's audio is a
+# synthesized stand-in for a recording (a voiced tone with a syllable-rate envelope between stretches
+# of background noise) whose fundamental frequency, tone_hz, identifies the utterance. The fake
+# Whisper in bench/fake_openai.py recovers the transcript from it after encoding and resampling.
+# Real recordings can be added with their own manifest entries; they are then transcribed by order.
+#
+#   python -m bench.corpus          (writes any missing WAVs next to the manifest)
+#
+
+import json
+import os
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from audio import to_wav_bytes
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+MANIFEST_PATH = os.path.join(CORPUS_DIR, "manifest.json")
+
+LEADING_SILENCE_SECONDS = 0.5
+TRAILING_SILENCE_SECONDS = 1.0
+
+
+class Utterance(NamedTuple):
+    file: str
+    tone_hz: Optional[float]
+    speech_seconds: float
+    transcript: str
+    tool_calls: List[dict]
+
+    @property
+    def path(self) -> str:
+        return os.path.join(CORPUS_DIR, self.file)
+
+def load_manifest(path: str = MANIFEST_PATH):
+    # Returns (sample rate, utterances)
+    with open(path, "r") as fp:
+        manifest = json.load(fp)
+    return manifest["sample_rate"], [ Utterance(**entry) for entry in manifest["utterances"] ]
+
+def synthesize(utterance: Utterance, sample_rate: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(utterance.speech_seconds * sample_rate)) / sample_rate
+    voiced = sum(np.sin(2 * np.pi * utterance.tone_hz * harmonic * t) / harmonic for harmonic in (1, 2, 3))
+    syllables = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t) ** 2
+    fade = np.minimum(1.0, np.minimum(t, t[-1] - t) / 0.05)
+    speech = 8000 * voiced * syllables * fade
+    silence_before = np.zeros(int(LEADING_SILENCE_SECONDS * sample_rate))
+    silence_after = np.zeros(int(TRAILING_SILENCE_SECONDS * sample_rate))
+    samples = np.concatenate([ silence_before, speech, silence_after ])
+    samples += rng.normal(scale=30, size=len(samples))
+    return np.clip(np.round(samples), -32768, 32767).astype(np.int16)
+
+def read_wav(path: str) -> np.ndarray:
+    import wave
+    with wave.open(path, "rb") as wf:
+        return np.frombuffer(wf.readframes(wf.getnframes()), dtype="<i2")
+
+def ensure_corpus(path: str = MANIFEST_PATH) -> List[Utterance]:
+    # Writes the WAV for every synthesized manifest entry that does not have one yet
+    sample_rate, utterances = load_manifest(path)
+    for index, utterance in enumerate(utterances):
+        if os.path.exists(utterance.path) or utterance.tone_hz is None:
+            continue
+        with open(utterance.path, "wb") as fp:
+            fp.write(to_wav_bytes(samples=synthesize(utterance=utterance, sample_rate=sample_rate, seed=index), sample_rate=sample_rate))
+        print(f"Wrote {utterance.path}")
+    return utterances
+
+def dominant_frequency(samples: np.ndarray, sample_rate: int) -> float:
+    spectrum = np.abs(np.fft.rfft(samples.astype(np.float32) * np.hanning(len(samples))))
+    frequencies = np.fft.rfftfreq(len(samples), d=1 / sample_rate)
+    spectrum[frequencies < 50] = 0
+    return float(frequencies[np.argmax(spectrum)])
+
+if __name__ == "__main__":
+    ensure_corpus()
@@ -0,0 +1,154 @@
+#
+# Local stand-in for the parts of the OpenAI API used by the speech server: Whisper translations and
+# transcriptions, and chat completions with tool calls, optionally streamed. Responses are scripted from
+# the benchmark corpus manifest and delayed by a configurable latency, so the server can be load tested
+# offline:
+#
+#   python -m bench.fake_openai --port 8100 --whisper-latency 0.4 --chat-latency 0.8
+#   OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=fake python -m server.server
+#
+
+import argparse
+import asyncio
+from io import BytesIO
+import itertools
+import json
+import random
+import time
+from typing import List, Optional
+import uuid
+
+from aiohttp import web
+
+from bench.corpus import Utterance, dominant_frequency, load_manifest
+from server.text import normalize_text
+
+
+class FakeOpenAI:
+    # A streamed completion sends its first chunk after first_chunk_fraction of chat_latency, and the
+    # tool calls at even intervals over the remainder, the way generation spreads them out
+    def __init__(self, utterances: List[Utterance], whisper_latency: float = 0.4, chat_latency: float = 0.8, jitter: float = 0.1, first_chunk_fraction: float = 0.3):
+        self.whisper_latency = whisper_latency
+        self.chat_latency = chat_latency
+        self.first_chunk_fraction = first_chunk_fraction
+        self.jitter = jitter                # latencies vary uniformly by up to this fraction
+        self.whisper_requests = 0
+        self.chat_requests = 0
+        self._tones = [ utterance for utterance in utterances if utterance.tone_hz is not None ]
+        self._recordings = itertools.cycle([ utterance for utterance in utterances if utterance.tone_hz is None ] or utterances)
+        self._tool_calls = { normalize_text(utterance.transcript): utterance.tool_calls for utterance in utterances }
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_post("/v1/audio/translations", self._whisper)
+        app.router.add_post("/v1/audio/transcriptions", self._whisper)
+        app.router.add_post("/v1/chat/completions", self._chat)
+        return app
+
+    def transcript_for(self, audio: bytes) -> str:
+        # Identifies which corpus utterance was uploaded from its fundamental frequency
+        try:
+            import soundfile
+            samples, sample_rate = soundfile.read(BytesIO(audio), dtype="int16")
+            if samples.ndim > 1:
+                samples = samples.mean(axis=1)
+            frequency = dominant_frequency(samples=samples, sample_rate=sample_rate)
+            nearest = min(self._tones, key=lambda utterance: abs(utterance.tone_hz - frequency))
+            if abs(nearest.tone_hz - frequency) < 15:
+                return nearest.transcript
+        except Exception as e:
+            print(f"Could not identify uploaded audio: {e}")
+        return next(self._recordings).transcript
+
+    async def _delay(self, latency: float):
+        await asyncio.sleep(latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def _whisper(self, request: web.Request) -> web.Response:
+        self.whisper_requests += 1
+        audio: Optional[bytes] = None
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == "file":
+                audio = await part.read()
+        if audio is None:
+            return web.json_response({ "error": { "message": "No file uploaded", "type": "invalid_request_error" } }, status=400)
+        await self._delay(self.whisper_latency)
+        return web.json_response({ "text": self.transcript_for(audio) })
+
+    async def _chat(self, request: web.Request) -> web.StreamResponse:
+        self.chat_requests += 1
+        body = await request.json()
+        user_messages = [ message for message in body["messages"] if message.get("role") == "user" ]
+        text = user_messages[-1]["content"] if len(user_messages) > 0 else ""
+        tool_calls = [
+            {
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": { "name": call["name"], "arguments": json.dumps(call["arguments"]) }
+            }
+            for call in self._tool_calls.get(normalize_text(text), [])
+        ]
+        if body.get("stream"):
+            return await self._stream_chat(request=request, model=body.get("model", "fake"), tool_calls=tool_calls)
+        await self._delay(self.chat_latency)
+        message = { "role": "assistant", "content": None if len(tool_calls) > 0 else "", "tool_calls": tool_calls or None }
+        return web.json_response({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [ { "index": 0, "message": message, "finish_reason": "tool_calls" if len(tool_calls) > 0 else "stop" } ],
+            "usage": { "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0 }
+        })
+
+    async def _stream_chat(self, request: web.Request, model: str, tool_calls: List[dict]) -> web.StreamResponse:
+        # Server-sent events in the chat.completion.chunk format, each tool call's arguments split over
+        # several deltas
+        response = web.StreamResponse(headers={ "Content-Type": "text/event-stream" })
+        await response.prepare(request)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        async def send(delta: dict, finish_reason: Optional[str] = None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [ { "index": 0, "delta": delta, "finish_reason": finish_reason } ]
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        await self._delay(self.chat_latency * self.first_chunk_fraction)
+        await send({ "role": "assistant", "content": None if len(tool_calls) > 0 else "" })
+        for index, tool_call in enumerate(tool_calls):
+            await self._delay(self.chat_latency * (1 - self.first_chunk_fraction) / len(tool_calls))
+            arguments = tool_call["function"]["arguments"]
+            await send({ "tool_calls": [ { "index": index, "id": tool_call["id"], "type": "function", "function": { "name": tool_call["function"]["name"], "arguments": "" } } ] })
+            step = max(1, len(arguments) // 3)
+            for start in range(0, len(arguments), step):
+                await send({ "tool_calls": [ { "index": index, "function": { "arguments": arguments[start:start + step] } } ] })
+        if len(tool_calls) == 0:
+            await self._delay(self.chat_latency * (1 - self.first_chunk_fraction))
+        await send({}, finish_reason="tool_calls" if len(tool_calls) > 0 else "stop")
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+async def start_fake_openai(fake: FakeOpenAI, port: int = 0, host: str = "127.0.0.1"):
+    # Returns (runner, base URL for openai.OpenAI(base_url=...)). Port 0 picks a free port.
+    runner = web.AppRunner(fake.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}/v1"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--whisper-latency", type=float, default=0.4, help="Seconds per Whisper request")
+    parser.add_argument("--chat-latency", type=float, default=0.8, help="Seconds per chat completion")
+    options = parser.parse_args()
+    _, utterances = load_manifest()
+    fake = FakeOpenAI(utterances=utterances, whisper_latency=options.whisper_latency, chat_latency=options.chat_latency)
+    web.run_app(fake.create_app(), port=options.port)
@@ -0,0 +1,222 @@
+#
+# Local stand-ins for the Spot SDK clients used by SpotController, for exercising the command path
+# without a robot:
+#
+#   spot = FakeSpot()
+#   controller = SpotController.with_clients(robot=spot.robot, command_client=spot.command_client, state_client=spot.state_client)
+#
+# The body pose is simulated in the odom frame. Trajectories are followed at LINEAR_SPEED and
+# ANGULAR_SPEED (or at their points' times, when given) and then take settle_seconds to settle;
+# velocity commands move the body until their end time; a stop brings the body to rest over
+# stop_seconds. Every RPC costs rpc_latency seconds.
+#
+
+import logging
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+from bosdyn.api import geometry_pb2, robot_command_pb2, robot_state_pb2
+from bosdyn.api.basic_command_pb2 import RobotCommandFeedbackStatus, SE2TrajectoryCommand, SitCommand, StandCommand
+from bosdyn.client import math_helpers
+from bosdyn.client.frame_helpers import BODY_FRAME_NAME, GRAV_ALIGNED_BODY_FRAME_NAME, ODOM_FRAME_NAME, VISION_FRAME_NAME
+
+from trajectory import ANGULAR_SPEED, LINEAR_SPEED
+
+
+####################################################################################################
+# Motion Simulation
+####################################################################################################
+
+class _Motion:
+    # What the body is doing, started at started_at from start_pose. A trajectory is a list of
+    # (time since start, [x, y, heading]); a velocity is (v_x, v_y, v_rot) until end_time.
+    def __init__(self, cmd_id: int, kind: str, start_pose: np.ndarray, started_at: float):
+        self.cmd_id = cmd_id
+        self.kind = kind
+        self.start_pose = start_pose
+        self.started_at = started_at
+        self.waypoints: List[Tuple[float, np.ndarray]] = []
+        self.velocity = np.zeros(3)
+        self.end_time = started_at
+
+    @property
+    def duration(self) -> float:
+        if self.kind == "trajectory":
+            return self.waypoints[-1][0] if len(self.waypoints) > 0 else 0.0
+        return max(0.0, self.end_time - self.started_at)
+
+    def pose_at(self, now: float) -> np.ndarray:
+        elapsed = min(max(0.0, now - self.started_at), self.duration)
+        if self.kind == "trajectory":
+            previous_time, previous_pose = 0.0, self.start_pose
+            for point_time, pose in self.waypoints:
+                if elapsed <= point_time:
+                    fraction = (elapsed - previous_time) / (point_time - previous_time) if point_time > previous_time else 1.0
+                    return previous_pose + fraction * (pose - previous_pose)
+                previous_time, previous_pose = point_time, pose
+            return previous_pose
+        if self.kind == "velocity":
+            # Constant body-frame velocity: a straight line or a circular arc
+            v_x, v_y, v_rot = self.velocity
+            heading = self.start_pose[2]
+            if abs(v_rot) < 1e-6:
+                dx, dy = v_x * elapsed, v_y * elapsed
+            else:
+                dx = (v_x * np.sin(v_rot * elapsed) - v_y * (1 - np.cos(v_rot * elapsed))) / v_rot
+                dy = (v_x * (1 - np.cos(v_rot * elapsed)) + v_y * np.sin(v_rot * elapsed)) / v_rot
+            c, s = np.cos(heading), np.sin(heading)
+            return self.start_pose + np.array([ c * dx - s * dy, s * dx + c * dy, v_rot * elapsed ])
+        return self.start_pose
+
+class FakeSpot:
+    def __init__(self, rpc_latency: float = 0.005, settle_seconds: float = 0.3, stop_seconds: float = 0.0, logger: Optional[logging.Logger] = None):
+        self.rpc_latency = rpc_latency
+        self.settle_seconds = settle_seconds
+        self.stop_seconds = stop_seconds
+        self.command_log: List[Tuple[float, str]] = []     # (time received, request type)
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._commands = {}                 # cmd_id -> (kind, _Motion or None, time received)
+        self._motion = _Motion(cmd_id=0, kind="idle", start_pose=np.zeros(3), started_at=time.time())
+        self.robot = FakeRobot(spot=self, logger=logger or logging.getLogger("FakeSpot"))
+        self.command_client = FakeRobotCommandClient(spot=self)
+        self.state_client = FakeRobotStateClient(spot=self)
+
+    def pose(self) -> np.ndarray:
+        with self._lock:
+            return self._motion.pose_at(time.time())
+
+    def frame_tree_snapshot(self) -> geometry_pb2.FrameTreeSnapshot:
+        x, y, heading = self.pose()
+        body = math_helpers.SE2Pose(x=x, y=y, angle=heading).get_closest_se3_transform().to_proto()
+        snapshot = geometry_pb2.FrameTreeSnapshot()
+        snapshot.child_to_parent_edge_map[ODOM_FRAME_NAME].parent_frame_name = ""
+        for frame_name in (BODY_FRAME_NAME, GRAV_ALIGNED_BODY_FRAME_NAME):
+            edge = snapshot.child_to_parent_edge_map[frame_name]
+            edge.parent_frame_name = ODOM_FRAME_NAME
+            edge.parent_tform_child.CopyFrom(body)
+        vision = snapshot.child_to_parent_edge_map[VISION_FRAME_NAME]
+        vision.parent_frame_name = ODOM_FRAME_NAME
+        vision.parent_tform_child.rotation.w = 1
+        return snapshot
+
+    def execute(self, command: robot_command_pb2.RobotCommand, end_time_secs: Optional[float]) -> int:
+        now = time.time()
+        with self._lock:
+            cmd_id = self._next_id
+            self._next_id += 1
+            pose = self._motion.pose_at(now)
+            if command.HasField("full_body_command"):
+                self.command_log.append((now, "stop"))
+                # Stop (or any other full body command) halts the body stop_seconds later, at about where
+                # its current motion would have taken it by then
+                stopped = _Motion(cmd_id=cmd_id, kind="trajectory", start_pose=pose, started_at=now)
+                stopped.waypoints.append((self.stop_seconds, self._motion.pose_at(now + self.stop_seconds)))
+                self._motion = stopped
+                self._commands[cmd_id] = ("stop", self._motion, now)
+                return cmd_id
+            mobility = command.synchronized_command.mobility_command
+            request = mobility.WhichOneof("command")
+            self.command_log.append((now, request))
+            motion = _Motion(cmd_id=cmd_id, kind="idle", start_pose=pose, started_at=now)
+            if request == "se2_trajectory_request":
+                motion.kind = "trajectory"
+                elapsed, previous = 0.0, pose
+                for point in mobility.se2_trajectory_request.trajectory.points:
+                    target = np.array([ point.pose.position.x, point.pose.position.y, point.pose.angle ])
+                    # Turn the short way round, as the robot would
+                    target[2] = previous[2] + np.arctan2(np.sin(target[2] - previous[2]), np.cos(target[2] - previous[2]))
+                    travel = np.linalg.norm(target[:2] - previous[:2]) / LINEAR_SPEED + abs(target[2] - previous[2]) / ANGULAR_SPEED
+                    reference = point.time_since_reference.seconds + point.time_since_reference.nanos * 1e-9
+                    elapsed = reference if reference > 0 else elapsed + travel
+                    motion.waypoints.append((elapsed, target))
+                    previous = target
+            elif request == "se2_velocity_request":
+                motion.kind = "velocity"
+                velocity = mobility.se2_velocity_request.velocity
+                motion.velocity = np.array([ velocity.linear.x, velocity.linear.y, velocity.angular ])
+                motion.end_time = end_time_secs if end_time_secs is not None else now
+            else:
+                # Stand, stance and sit requests complete immediately and leave the body where it is
+                self._commands[cmd_id] = (request, None, now)
+                return cmd_id
+            self._motion = motion
+            self._commands[cmd_id] = (request, motion, now)
+            return cmd_id
+
+    def feedback(self, cmd_id: int) -> robot_command_pb2.RobotCommandFeedbackResponse:
+        now = time.time()
+        response = robot_command_pb2.RobotCommandFeedbackResponse()
+        mobility_feedback = response.feedback.synchronized_feedback.mobility_command_feedback
+        with self._lock:
+            request, motion, received_at = self._commands[cmd_id]
+            overridden = motion is not None and self._motion is not motion
+        mobility_feedback.status = RobotCommandFeedbackStatus.STATUS_COMMAND_OVERRIDDEN if overridden else RobotCommandFeedbackStatus.STATUS_PROCESSING
+        if request in ("stand_request", "stance_request"):
+            mobility_feedback.stand_feedback.status = StandCommand.Feedback.STATUS_IS_STANDING
+        elif request == "sit_request":
+            mobility_feedback.sit_feedback.status = SitCommand.Feedback.STATUS_IS_SITTING
+        elif request == "se2_trajectory_request":
+            feedback = mobility_feedback.se2_trajectory_feedback
+            elapsed = now - received_at
+            if elapsed >= motion.duration + self.settle_seconds:
+                feedback.status = SE2TrajectoryCommand.Feedback.STATUS_AT_GOAL
+                feedback.body_movement_status = SE2TrajectoryCommand.Feedback.BODY_STATUS_SETTLED
+            elif elapsed >= motion.duration:
+                feedback.status = SE2TrajectoryCommand.Feedback.STATUS_AT_GOAL
+                feedback.body_movement_status = SE2TrajectoryCommand.Feedback.BODY_STATUS_MOVING
+            elif elapsed >= 0.8 * motion.duration:
+                feedback.status = SE2TrajectoryCommand.Feedback.STATUS_NEAR_GOAL
+                feedback.body_movement_status = SE2TrajectoryCommand.Feedback.BODY_STATUS_MOVING
+            else:
+                feedback.status = SE2TrajectoryCommand.Feedback.STATUS_GOING_TO_GOAL
+                feedback.body_movement_status = SE2TrajectoryCommand.Feedback.BODY_STATUS_MOVING
+        return response
+
+
+####################################################################################################
+# SDK Client Stand-Ins
+####################################################################################################
+
+class FakeTimeSync:
+    # Robot and local clocks are the same
+    def wait_for_sync(self, timeout_sec: float = None):
+        pass
+
+    def robot_timestamp_from_local_secs(self, local_time_secs: float):
+        from bosdyn.util import seconds_to_timestamp
+        return seconds_to_timestamp(local_time_secs)
+
+class FakeRobot:
+    def __init__(self, spot: FakeSpot, logger: logging.Logger):
+        self.logger = logger
+        self.time_sync = FakeTimeSync()
+        self._spot = spot
+
+    def get_frame_tree_snapshot(self) -> geometry_pb2.FrameTreeSnapshot:
+        time.sleep(self._spot.rpc_latency)
+        return self._spot.frame_tree_snapshot()
+
+class FakeRobotCommandClient:
+    def __init__(self, spot: FakeSpot):
+        self._spot = spot
+
+    def robot_command(self, command, lease=None, end_time_secs=None, **kwargs) -> int:
+        time.sleep(self._spot.rpc_latency)
+        return self._spot.execute(command=command, end_time_secs=end_time_secs)
+
+    def robot_command_feedback(self, robot_command_id: int, **kwargs) -> robot_command_pb2.RobotCommandFeedbackResponse:
+        time.sleep(self._spot.rpc_latency)
+        return self._spot.feedback(cmd_id=robot_command_id)
+
+class FakeRobotStateClient:
+    def __init__(self, spot: FakeSpot):
+        self._spot = spot
+
+    def get_robot_state(self, **kwargs) -> robot_state_pb2.RobotState:
+        time.sleep(self._spot.rpc_latency)
+        state = robot_state_pb2.RobotState()
+        state.kinematic_state.transforms_snapshot.CopyFrom(self._spot.frame_tree_snapshot())
+        return state
@@ -0,0 +1,318 @@
+#
+# Offline benchmark: runs the speech server in-process against a fake OpenAI, and the robot-side
+# pipeline against a simulated Spot, then writes machine-readable results:
+#
+#   python -m bench.run --whisper-latency 0.4 --chat-latency 0.8 --output bench/results/latest.json
+#
+# Scenarios:
+#   server_throughput     concurrent /voice_command uploads at each --concurrency level
+#   client_round_trip     sequential /transcribe, /process_speech and /voice_command calls
+#   utterance_to_motion   corpus audio through VAD, upload, parsing and execution on the fake robot,
+#                         timed from the end of speech being detected; with --stream-commands, parsing
+#                         is streamed and execution starts on the first command
+#   stop_to_halt          a long walk on the fake robot interrupted by STOP, timed from the STOP being
+#                         submitted to the executor until the stop command is sent and until the robot
+#                         is confirmed at rest (--stop-seconds simulates the robot's deceleration)
+#
+# Results include the configuration, the git commit, and the quantiles of every traced span, so runs
+# from different commits can be compared directly.
+#
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from audio import UtteranceSegmenter, VoiceActivityDetector, encode
+from bench.corpus import Utterance, ensure_corpus, load_manifest, read_wav
+from bench.fake_openai import FakeOpenAI, start_fake_openai
+from bench.fake_spot import FakeSpot
+from server.client import SpeechClient
+from server.tracing import correlation_id, histograms, new_correlation_id
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    if len(seconds) == 0:
+        return { "count": 0 }
+    ms = np.array(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2)
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output([ "git", "rev-parse", "--short", "HEAD" ], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+####################################################################################################
+# Harness
+####################################################################################################
+
+async def start_speech_server(openai_base_url: str, port: int, whisper_concurrency: int, chat_concurrency: int, use_cache: bool):
+    # Returns (uvicorn server, serving task)
+    import openai
+    import uvicorn
+    from server import server
+    from server.command_cache import CommandCache
+
+    server.configure(
+        openai_client=openai.OpenAI(base_url=openai_base_url, api_key="bench"),
+        whisper_concurrency=whisper_concurrency,
+        chat_concurrency=chat_concurrency,
+        command_cache=CommandCache() if use_cache else CommandCache(max_entries=0)
+    )
+    uvicorn_server = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    task = asyncio.ensure_future(uvicorn_server.serve())
+    while not uvicorn_server.started:
+        await asyncio.sleep(0.01)
+    return uvicorn_server, task
+
+def encode_corpus(utterances: List[Utterance], sample_rate: int, format: str):
+    return [ encode(samples=read_wav(utterance.path), sample_rate=sample_rate, format=format) for utterance in utterances ]
+
+
+####################################################################################################
+# Scenarios
+####################################################################################################
+
+async def server_throughput(url: str, uploads: list, requests: int, concurrency: int) -> dict:
+    # Each worker is a robot of its own, as in a fleet; sharing one robot ID would measure the
+    # scheduler's per-robot cap and queue limit rather than the server
+    latencies = []
+    errors = 0
+    pending = iter(range(requests))
+
+    async def worker(robot_id: str):
+        nonlocal errors
+        async with SpeechClient(url=url, robot_id=robot_id, max_connections=1, max_concurrency=1, max_retries=0) as client:
+            for index in pending:
+                upload = uploads[index % len(uploads)]
+                started_at = time.perf_counter()
+                try:
+                    await client.voice_command(audio=upload.data, filename=upload.filename, content_type=upload.content_type)
+                    latencies.append(time.perf_counter() - started_at)
+                except Exception as e:
+                    errors += 1
+                    print(f"Request failed: {e}")
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*[ worker(robot_id=f"bench-{i}") for i in range(concurrency) ])
+    elapsed = time.perf_counter() - started_at
+    return { "concurrency": concurrency, "requests": requests, "errors": errors, "seconds": round(elapsed, 3), "requests_per_second": round(len(latencies) / elapsed, 2), "latency": summarize(latencies) }
+
+async def client_round_trip(url: str, uploads: list, utterances: List[Utterance], iterations: int) -> dict:
+    results = { "transcribe": [], "process_speech": [], "voice_command": [] }
+    async with SpeechClient(url=url) as client:
+        for index in range(iterations):
+            upload = uploads[index % len(uploads)]
+            started_at = time.perf_counter()
+            await client.transcribe(audio=upload.data, filename=upload.filename, content_type=upload.content_type)
+            results["transcribe"].append(time.perf_counter() - started_at)
+            started_at = time.perf_counter()
+            await client.process_speech(text=utterances[index % len(utterances)].transcript)
+            results["process_speech"].append(time.perf_counter() - started_at)
+            started_at = time.perf_counter()
+            await client.voice_command(audio=upload.data, filename=upload.filename, content_type=upload.content_type)
+            results["voice_command"].append(time.perf_counter() - started_at)
+    return { name: summarize(latencies) for name, latencies in results.items() }
+
+async def utterance_to_motion(utterances: List[Utterance], sample_rate: int, rpc_latency: float, settle_seconds: float, stream_commands: bool = False) -> dict:
+    # Uses the same stage functions as main.py, with the simulated robot behind SpotController
+    import main
+    from executor import CommandExecutor
+    from spot_controller import SpotController
+
+    spot = FakeSpot(rpc_latency=rpc_latency, settle_seconds=settle_seconds)
+    controller = SpotController.with_clients(robot=spot.robot, command_client=spot.command_client, state_client=spot.state_client)
+    executor = CommandExecutor(spot=controller)
+    await executor.start()
+    block = int(0.1 * sample_rate)
+    runs = []
+    try:
+        for utterance in utterances:
+            segmenter = UtteranceSegmenter(vad=VoiceActivityDetector(sample_rate=sample_rate))
+            samples = read_wav(utterance.path)
+            segments = []
+            for start in range(0, len(samples), block):
+                segments += segmenter.process(samples[start:start + block])
+            segments += [ segment for segment in [ segmenter.flush() ] if segment is not None ]
+            if len(segments) == 0:
+                print(f"No speech detected in {utterance.file}")
+                continue
+            token = correlation_id.set(new_correlation_id())
+            try:
+                commands_before = len(spot.command_log)
+                started_at = time.time()
+                text = await main.transcribe_segment(segments[0])
+                transcribed_at = time.time()
+                if stream_commands:
+                    # parse_ms is then the time to the first command
+                    stream = await main.parse_sentence_stream(text) if text is not None else None
+                    parsed_at = time.time()
+                    commands = []
+
+                    async def collect():
+                        async for command in stream:
+                            commands.append(command)
+                            yield command
+                    if stream is not None:
+                        await main.execute_command_stream(executor=executor, commands=collect())
+                        await executor.join()
+                else:
+                    commands = await main.parse_sentence(text) if text is not None else None
+                    parsed_at = time.time()
+                    if commands is not None:
+                        await main.execute_commands(executor=executor, commands=commands)
+                        await executor.join()
+                finished_at = time.time()
+            finally:
+                correlation_id.reset(token)
+            sent = spot.command_log[commands_before:]
+            runs.append({
+                "file": utterance.file,
+                "transcript": text,
+                "commands": len(commands) if commands is not None else 0,
+                "transcribe_ms": round((transcribed_at - started_at) * 1000, 2),
+                "parse_ms": round((parsed_at - transcribed_at) * 1000, 2),
+                "to_motion_start_ms": round((sent[0][0] - started_at) * 1000, 2) if len(sent) > 0 else None,
+                "to_motion_complete_ms": round((finished_at - started_at) * 1000, 2)
+            })
+    finally:
+        await executor.close()
+        controller.close()
+    return {
+        "utterances": runs,
+        "to_motion_start": summarize([ run["to_motion_start_ms"] / 1000 for run in runs if run["to_motion_start_ms"] is not None ]),
+        "to_motion_complete": summarize([ run["to_motion_complete_ms"] / 1000 for run in runs ])
+    }
+
+async def stop_to_halt(rpc_latency: float, settle_seconds: float, stop_seconds: float, iterations: int) -> dict:
+    # Starts a 3 m walk, lets the robot get moving, then says stop
+    from executor import CommandExecutor
+    from server.models import CommandType, Direction, SpotCommand
+    from spot_controller import SpotController
+
+    spot = FakeSpot(rpc_latency=rpc_latency, settle_seconds=settle_seconds, stop_seconds=stop_seconds)
+    controller = SpotController.with_clients(robot=spot.robot, command_client=spot.command_client, state_client=spot.state_client)
+    executor = CommandExecutor(spot=controller)
+    await executor.start()
+    walk = SpotCommand(command=CommandType.WALK, dir=Direction.FORWARD, amount=3.0, duration=0.0)
+    stop = SpotCommand(command=CommandType.STOP, dir=Direction.UNKNOWN, amount=0.0, duration=0.0)
+    sent, halted = [], []
+    try:
+        for _ in range(iterations):
+            executor.submit(walk)
+            await asyncio.sleep(0.5)
+            commands_before = len(spot.command_log)
+            stopped_at = time.time()
+            executor.submit(stop)
+            await executor.join()
+            stops = [ received_at for received_at, request in spot.command_log[commands_before:] if request == "stop" ]
+            if len(stops) > 0:
+                sent.append(stops[0] - stopped_at)
+            if executor.last_halt_seconds is not None:
+                halted.append(executor.last_halt_seconds)
+    finally:
+        await executor.close()
+        controller.close()
+    return { "stop_sent": summarize(sent), "halted": summarize(halted), "executor": executor.report() }
+
+####################################################################################################
+# Program Entry Point
+####################################################################################################
+
+async def run(options) -> dict:
+    utterances = ensure_corpus()
+    sample_rate, _ = load_manifest()
+    uploads = encode_corpus(utterances=utterances, sample_rate=sample_rate, format=options.format)
+    fake = FakeOpenAI(utterances=utterances, whisper_latency=options.whisper_latency, chat_latency=options.chat_latency)
+    fake_runner, openai_base_url = await start_fake_openai(fake)
+    uvicorn_server, server_task = await start_speech_server(
+        openai_base_url=openai_base_url,
+        port=options.port,
+        whisper_concurrency=options.whisper_concurrency,
+        chat_concurrency=options.chat_concurrency,
+        use_cache=options.cache
+    )
+    url = f"http://127.0.0.1:{options.port}"
+    results = {}
+    try:
+        if "server_throughput" in options.scenarios:
+            results["server_throughput"] = [
+                await server_throughput(url=url, uploads=uploads, requests=options.requests, concurrency=concurrency)
+                for concurrency in options.concurrency
+            ]
+        if "client_round_trip" in options.scenarios:
+            results["client_round_trip"] = await client_round_trip(url=url, uploads=uploads, utterances=utterances, iterations=options.iterations)
+        if "utterance_to_motion" in options.scenarios:
+            # main.py uploads through the module-level client
+            import server.client
+            server.client.URL = url
+            results["utterance_to_motion"] = await utterance_to_motion(utterances=utterances, sample_rate=sample_rate, rpc_latency=options.rpc_latency, settle_seconds=options.settle_seconds, stream_commands=options.stream_commands)
+        if "stop_to_halt" in options.scenarios:
+            results["stop_to_halt"] = await stop_to_halt(rpc_latency=options.rpc_latency, settle_seconds=options.settle_seconds, stop_seconds=options.stop_seconds, iterations=options.iterations)
+    finally:
+        uvicorn_server.should_exit = True
+        await server_task
+        await fake_runner.cleanup()
+        from server.client import get_client
+        await get_client().close()
+
+    spans = {}
+    for h in histograms():
+        _, count, _ = h.snapshot()
+        spans[h.name] = { "count": count, **{ f"p{int(q * 100)}_ms": round(value * 1000, 2) for q, value in h.quantiles().items() } }
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": { key: value for key, value in vars(options).items() if key != "output" },
+        "fake_openai": { "whisper_requests": fake.whisper_requests, "chat_requests": fake.chat_requests },
+        "results": results,
+        "spans": spans
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", default=[ "server_throughput", "client_round_trip", "utterance_to_motion", "stop_to_halt" ])
+    parser.add_argument("--whisper-latency", type=float, default=0.4, help="Fake Whisper seconds per request")
+    parser.add_argument("--chat-latency", type=float, default=0.8, help="Fake chat completion seconds per request")
+    parser.add_argument("--whisper-concurrency", type=int, default=8)
+    parser.add_argument("--chat-concurrency", type=int, default=8)
+    parser.add_argument("--cache", action="store_true", help="Enable the server's command cache")
+    parser.add_argument("--stream-commands", action="store_true", help="Stream parsed commands to the robot as the LLM generates them")
+    parser.add_argument("--format", default="flac", choices=[ "wav", "flac", "opus" ], help="Upload encoding")
+    parser.add_argument("--requests", type=int, default=48, help="Requests per throughput level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[ 1, 4, 16 ])
+    parser.add_argument("--iterations", type=int, default=12, help="Round trips per client call")
+    parser.add_argument("--rpc-latency", type=float, default=0.005, help="Fake robot seconds per RPC")
+    parser.add_argument("--settle-seconds", type=float, default=0.3, help="Fake robot settling time after a trajectory")
+    parser.add_argument("--stop-seconds", type=float, default=0.3, help="Fake robot time to come to rest after a stop")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Results file (default: bench/results/<commit>-<time>.json)")
+    options = parser.parse_args()
+
+    results = asyncio.run(run(options))
+    output = options.output or os.path.join(RESULTS_DIR, f"{results['git_commit']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fp:
+        json.dump(results, fp, indent=2)
+    print(json.dumps(results["results"], indent=2))
+    print(f"Wrote {output}")
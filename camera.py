@@ -0,0 +1,148 @@
+import asyncio
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+
+class Frame(NamedTuple):
+    timestamp: float                # time.monotonic() at which the frame was read
+    image: np.ndarray
+
+
+####################################################################################################
+# Camera Service
+####################################################################################################
+
+# Keeps the camera open and continuously reads frames on a background thread into a small ring buffer,
+# so taking a picture is a lookup rather than a device open plus a read (which also tends to return an
+# unexposed frame). JPEG encoding and disk writes run on a worker pool, off the control path. OpenCV is
+# imported by the capture thread, so its import cost does not delay startup.
+class CameraService:
+    # While reads keep failing, retries back off from READ_RETRY_SECONDS to MAX_READ_RETRY_SECONDS
+    READ_RETRY_SECONDS = 0.1
+    MAX_READ_RETRY_SECONDS = 2.0
+    REPORT_EVERY_FAILURES = 30      # once backed off fully, about once a minute
+
+    def __init__(
+        self,
+        device: int = 0,
+        buffer_size: int = 8,
+        output_dir: str = "/merklebot/job_data",
+        jpeg_quality: int = 90,
+        writer_threads: int = 2,
+        warmup_frames: int = 5
+    ):
+        self.output_dir = output_dir
+        self._device = device
+        self._jpeg_quality = jpeg_quality
+        self._warmup_frames = warmup_frames     # discarded after opening while exposure settles
+        self._frames = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._first_frame = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._writer = ThreadPoolExecutor(max_workers=writer_threads, thread_name_prefix="CameraWriter")
+
+    async def start(self, timeout: float = 5):
+        # Returns once the first usable frame is available
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="CameraCapture", daemon=True)
+        self._thread.start()
+        ready = await asyncio.get_running_loop().run_in_executor(None, self._first_frame.wait, timeout)
+        if not ready:
+            print(f"Camera {self._device} produced no frame within {timeout} s")
+
+    async def stop(self):
+        self._running = False
+        if self._thread is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+            self._thread = None
+        # Waits for pending writes without blocking the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self._writer.shutdown, True)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    def latest(self) -> Optional[Frame]:
+        with self._lock:
+            return self._frames[-1] if len(self._frames) > 0 else None
+
+    def nearest(self, timestamp: float) -> Optional[Frame]:
+        # Buffered frame read closest to the given time.monotonic() value
+        with self._lock:
+            frames = list(self._frames)
+        if len(frames) == 0:
+            return None
+        index = bisect_left([ frame.timestamp for frame in frames ], timestamp)
+        candidates = frames[max(0, index - 1):index + 1]
+        return min(candidates, key=lambda frame: abs(frame.timestamp - timestamp))
+
+    def save(self, frame: Optional[Frame] = None, path: Optional[str] = None) -> "Future[str]":
+        # Encodes and writes a frame (the latest by default) on the writer pool. Returns a future
+        # resolving to the written path.
+        frame = frame if frame is not None else self.latest()
+        if frame is None:
+            future = Future()
+            future.set_exception(RuntimeError("No camera frame available"))
+            return future
+        path = path or os.path.join(self.output_dir, f"camera_{time.time()}.jpg")
+        return self._writer.submit(self._write, frame, path)
+
+    def _write(self, frame: Frame, path: str) -> str:
+        import cv2
+        ok, jpeg = cv2.imencode(".jpg", frame.image, [ cv2.IMWRITE_JPEG_QUALITY, self._jpeg_quality ])
+        if not ok:
+            raise RuntimeError("JPEG encoding failed")
+        with open(path, "wb") as fp:
+            fp.write(jpeg.tobytes())
+        return path
+
+    def _run(self):
+        try:
+            import cv2
+            camera_capture = cv2.VideoCapture(self._device)
+        except Exception as e:
+            print(f"Could not open camera {self._device}: {e}")
+            self._running = False
+            return
+        try:
+            if not camera_capture.isOpened():
+                print(f"Could not open camera {self._device}")
+                return
+            frames_read = 0
+            failures = 0
+            while self._running:
+                rv, image = camera_capture.read()
+                if not rv:
+                    failures += 1
+                    delay = min(self.READ_RETRY_SECONDS * 2 ** min(failures - 1, 16), self.MAX_READ_RETRY_SECONDS)
+                    if delay < self.MAX_READ_RETRY_SECONDS or failures % self.REPORT_EVERY_FAILURES == 0:
+                        print(f"Camera read failed {failures} times in a row, retrying in {delay:.1f} s")
+                    time.sleep(delay)
+                    continue
+                if failures > 0:
+                    print(f"Camera read recovered after {failures} failures")
+                    failures = 0
+                frames_read += 1
+                if frames_read <= self._warmup_frames:
+                    continue
+                with self._lock:
+                    self._frames.append(Frame(timestamp=time.monotonic(), image=image))
+                if not self._first_frame.is_set():
+                    print(f"Image Dimensions: {image.shape}")
+                    self._first_frame.set()
+        except Exception as e:
+            print(f"Camera capture failed: {e}")
+        finally:
+            self._running = False
+            camera_capture.release()
@@ -0,0 +1,261 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from server.models import CommandType, Direction, SpotCommand
+from server.tracing import correlation_id, record, span
+from spot_controller import CommandHandle, SpotController
+from trajectory import LINEAR_SPEED, MAX_WALK_SECONDS, is_timed_walk, plan_trajectory
+
+
+# Lower runs first. Safety commands also take effect the moment they are submitted: the motion in
+# progress is interrupted with a stop command and the motions submitted before them are cancelled. A
+# safety command that follows motions of its own batch ("walk forward then stop") is queued behind
+# them at MOTION_PRIORITY instead.
+SAFETY_PRIORITY = 0
+MOTION_PRIORITY = 1
+
+SAFETY_COMMANDS = { CommandType.STOP, CommandType.SIT }
+
+def command_priority(command: SpotCommand) -> int:
+    return SAFETY_PRIORITY if command.command in SAFETY_COMMANDS else MOTION_PRIORITY
+
+class _Queued:
+    __slots__ = ("command", "submitted_at", "correlation_id", "batch")
+
+    def __init__(self, command: SpotCommand, correlation_id: Optional[str], batch: int):
+        self.command = command
+        self.submitted_at = time.perf_counter()
+        self.correlation_id = correlation_id    # of the utterance, current again while the command runs
+        self.batch = batch                      # commands submitted together, e.g. parsed from one utterance
+
+class CommandExecutor:
+    # Runs parsed commands on the robot, in front of SpotController. Commands are submitted in batches
+    # (one utterance's worth), wait in a priority queue and are taken in (priority, arrival) order.
+    # Motions of a batch queued back to back are coalesced into one trajectory, so the robot does not
+    # stop and settle between them. STOP and SIT preempt earlier batches: the moment one is submitted,
+    # their queued motions are cancelled, the motion in progress is abandoned, and a single stop command
+    # is sent on its own thread, without waiting for the worker. The time from then until odometry
+    # shows the robot at rest is recorded as robot.halt. Within a batch, order is kept, so "walk forward
+    # then sit down" walks first. Commands submitted after a STOP or SIT run once it has finished, and
+    # motions wait for the robot to come to rest; a sitting robot stands up again before its next motion.
+    def __init__(self, spot: SpotController, on_moved: Optional[Callable[[], None]] = None):
+        self.spot = spot
+        self.on_moved = on_moved        # called after each batch of motions that moved the robot
+        self.submitted = 0
+        self.executed = 0
+        self.coalesced = 0              # motions merged into an earlier one's trajectory, and repeated stops
+        self.superseded = 0             # queued motions cancelled by a later STOP or SIT
+        self.preempted = 0              # motions interrupted while executing
+        self.halts = 0
+        self.last_halt_seconds: Optional[float] = None
+        self._queue: List[Tuple[int, int, _Queued]] = []     # heap of (priority, sequence, command)
+        self._sequence = itertools.count()
+        self._batches = itertools.count()
+        self._motion: Optional[asyncio.Task] = None          # the motions in progress
+        self._motion_batch: Optional[int] = None             # and the batch they belong to
+        self._current: Optional[CommandHandle] = None        # the robot command in progress
+        self._halt: Optional[CommandHandle] = None           # the stop in progress
+        self._sitting = False
+        # Created in start() so that they bind to the running event loop
+        self._wakeup: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._worker = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        # Stops the worker, and the robot if it is moving, returning once it has come to rest
+        self._queue = []
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        if self._motion is not None and not self._motion.done():
+            if self._current is not None:
+                self._current.cancel(stop_robot=False)
+            self._motion.cancel()
+            self._motion = None
+            await self.spot.halt_async()
+
+    def submit(self, command: SpotCommand):
+        # A batch of its own. Never blocks, so a STOP takes effect however busy the robot is.
+        self._submit(command, batch=next(self._batches))
+
+    def submit_all(self, commands: List[SpotCommand]):
+        batch = next(self._batches)
+        for command in commands:
+            self._submit(command, batch=batch)
+
+    async def submit_stream(self, commands: AsyncIterator[SpotCommand]):
+        # Submits each command as it arrives, all as one batch; returns once the stream ends, not once
+        # they have run
+        batch = next(self._batches)
+        try:
+            async for command in commands:
+                self._submit(command, batch=batch)
+        except Exception as e:
+            print(f"Command stream failed: {e}")
+
+    async def join(self):
+        # Waits until every submitted command has run
+        await self._idle.wait()
+
+    def report(self) -> str:
+        halt = f" last_halt={self.last_halt_seconds * 1000:.0f}ms" if self.last_halt_seconds is not None else ""
+        return (
+            f"executor: submitted={self.submitted} executed={self.executed} queue={len(self._queue)} "
+            f"coalesced={self.coalesced} superseded={self.superseded} preempted={self.preempted} halts={self.halts}{halt}"
+        )
+
+    def _submit(self, command: SpotCommand, batch: int):
+        self.submitted += 1
+        priority = command_priority(command)
+        if command.command in SAFETY_COMMANDS:
+            priority = self._preempt(command, batch=batch)
+            if priority is None:
+                self.coalesced += 1
+                return
+        heapq.heappush(self._queue, (priority, next(self._sequence), _Queued(command=command, correlation_id=correlation_id.get(), batch=batch)))
+        self._idle.clear()
+        self._wakeup.set()
+
+    def _preempt(self, command: SpotCommand, batch: int) -> Optional[int]:
+        # Cancels the motions of earlier batches, queued or in progress. Returns the priority to queue
+        # the command at, or None if it need not run, being a repeat of a stop already under way.
+        motions = [ entry for entry in self._queue if entry[2].batch < batch and entry[2].command.command not in SAFETY_COMMANDS ]
+        if len(motions) > 0:
+            self._queue = [ entry for entry in self._queue if not (entry[2].batch < batch and entry[2].command.command not in SAFETY_COMMANDS) ]
+            heapq.heapify(self._queue)
+            self.superseded += len(motions)
+        interrupted = False
+        if self._motion is not None and not self._motion.done() and self._motion_batch < batch:
+            # The halt below stops the robot once, rather than each command stopping it as it is cancelled
+            if self._current is not None:
+                self._current.cancel(stop_robot=False)
+            self._motion.cancel()
+            self._motion = None
+            self.preempted += 1
+            interrupted = True
+        # Commands of its own batch that are still to run, or running, go first
+        behind = (self._motion is not None and not self._motion.done()) or any(entry[2].batch == batch for entry in self._queue)
+        halting = self._halt is not None and not self._halt.done()
+        if not behind:
+            if command.command == CommandType.STOP:
+                if self._sitting or halting or any(entry[0] == SAFETY_PRIORITY and entry[2].command.command == CommandType.STOP for entry in self._queue):
+                    return None
+            elif command.command == CommandType.SIT and self._sitting:
+                return None
+        if (interrupted or not behind) and not halting and not self._sitting:
+            self._halt = self.spot.halt_async()
+            self.halts += 1
+        return MOTION_PRIORITY if behind else SAFETY_PRIORITY
+
+    async def _run(self):
+        while True:
+            if len(self._queue) == 0:
+                self._idle.set()
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            if self._halt is not None and self._queue[0][2].command.command not in SAFETY_COMMANDS:
+                # An interrupted motion's halt is still under way; moving again would cut it short
+                await self._await_halt()
+                continue
+            priority, _, queued = heapq.heappop(self._queue)
+            token = correlation_id.set(queued.correlation_id)
+            try:
+                record("executor.queued", time.perf_counter() - queued.submitted_at)
+                if queued.command.command in SAFETY_COMMANDS:
+                    await self._execute_safety(queued.command, deferred=priority == MOTION_PRIORITY)
+                    continue
+                batch = [ queued.command ]
+                while len(self._queue) > 0 and self._queue[0][0] == MOTION_PRIORITY and self._queue[0][2].batch == queued.batch and self._queue[0][2].command.command not in SAFETY_COMMANDS:
+                    batch.append(heapq.heappop(self._queue)[2].command)
+                self.coalesced += len(batch) - 1
+                # Run as a task of its own, so that a preempting STOP can cancel it without cancelling
+                # the worker
+                motion = self._motion = asyncio.ensure_future(self._execute_motions(batch))
+                self._motion_batch = queued.batch
+                await asyncio.wait([ motion ])
+                if self._motion is motion:
+                    self._motion = None
+                if motion.cancelled():
+                    print(f"Preempted {len(batch)} commands")
+                elif motion.exception() is not None:
+                    print(f"Failed to execute commands: {motion.exception()}")
+                else:
+                    self.executed += len(batch)
+                    if motion.result() and self.on_moved is not None:
+                        self.on_moved()
+            finally:
+                correlation_id.reset(token)
+
+    async def _execute_safety(self, command: SpotCommand, deferred: bool):
+        if deferred and self._halt is None and not self._sitting:
+            # Queued behind the motions of its own batch, which have run by now, so nothing has stopped
+            # the robot yet
+            self._halt = self.spot.halt_async()
+            self.halts += 1
+        if self._halt is not None:
+            await self._await_halt()
+        if command.command == CommandType.SIT and not self._sitting:
+            # Counts as sitting from the start, so a STOP meanwhile does not interrupt it
+            self._sitting = True
+            self._sitting = await self._run_command(self.spot.sit_async())
+        self.executed += 1
+
+    async def _await_halt(self):
+        halt = self._halt
+        with span("executor.halt"):
+            await halt
+        if self._halt is halt:
+            self._halt = None
+        if halt.halt_latency is not None:
+            self.last_halt_seconds = halt.halt_latency
+            print(f"Halted {halt.halt_latency * 1000:.0f} ms after stop")
+        else:
+            print("Robot did not confirm that it had halted")
+
+    async def _execute_motions(self, commands: List[SpotCommand]) -> bool:
+        # Consecutive WALK/TURN commands are sent as one trajectory. Duration-only walks ("walk forward
+        # for 5 seconds") are streamed as velocity setpoints. Returns whether the robot moved.
+        if self._sitting:
+            if not await self._run_command(self.spot.stand_at_height_async(body_height=0)):
+                print("Failed to stand up")
+                return False
+            self._sitting = False
+        batch = []
+        moved = False
+        for command in commands + [ None ]:
+            if command is not None and not is_timed_walk(command):
+                batch.append(command)
+                continue
+            poses, times = plan_trajectory(commands=batch)
+            batch = []
+            if len(poses) > 0:
+                await self._run_command(self.spot.follow_trajectory_async(poses=poses, times=times))
+                moved = True
+            if command is not None:
+                dir = -1.0 if command.dir == Direction.BACKWARD else 1.0
+                duration = min(command.duration, MAX_WALK_SECONDS)
+                walk = self.spot.walk_for_duration_async(speed=dir * LINEAR_SPEED, duration=duration)
+                await self._run_command(walk)
+                if walk.distance_covered is not None:
+                    print(f"Walked {walk.distance_covered:.2f} m in {duration:.1f} s")
+                moved = True
+        return moved
+
+    async def _run_command(self, handle: CommandHandle) -> bool:
+        # Makes the handle the one a preempting STOP abandons
+        self._current = handle
+        try:
+            return await handle
+        finally:
+            self._current = None
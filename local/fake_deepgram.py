@@ -0,0 +1,100 @@
+#
+# Local stand-in for the Deepgram live transcription websocket, for exercising DeepgramTranscriber and
+# the streaming mode of main.py without a Deepgram account or network access:
+#
+#   python -m local.fake_deepgram --port 8765 "Spot, walk forward three feet" "Spot, turn left"
+#   DEEPGRAM_URL=http://localhost:8765 TRANSCRIPTION_MODE=streaming python main.py
+#
+# Incoming linear16 audio is segmented with the same VAD used on the robot, and each detected
+# utterance is answered with the next scripted transcript as a final result. --drop-after closes the
+# socket after that many utterances to exercise reconnection.
+#
+
+import argparse
+from datetime import datetime, timezone
+import itertools
+import json
+from typing import Iterator
+import uuid
+
+from aiohttp import web, WSMsgType
+import numpy as np
+
+from audio import VoiceActivityDetector, UtteranceSegmenter
+
+
+def result_message(transcript: str, start: float, duration: float, request_id: str) -> str:
+    return json.dumps({
+        "type": "Results",
+        "channel_index": [ 0, 1 ],
+        "duration": duration,
+        "start": start,
+        "is_final": True,
+        "speech_final": True,
+        "from_finalize": False,
+        "channel": {
+            "alternatives": [ { "transcript": transcript, "confidence": 0.99, "words": [] } ]
+        },
+        "metadata": {
+            "request_id": request_id,
+            "model_info": { "name": "fake", "version": "0", "arch": "fake" },
+            "model_uuid": str(uuid.uuid4())
+        }
+    })
+
+def metadata_message(duration: float, request_id: str) -> str:
+    return json.dumps({
+        "type": "Metadata",
+        "transaction_key": "deprecated",
+        "request_id": request_id,
+        "sha256": "",
+        "created": datetime.now(timezone.utc).isoformat(),
+        "duration": duration,
+        "channels": 1,
+        "models": [],
+        "model_info": {}
+    })
+
+def create_app(transcripts: Iterator[str], drop_after: int) -> web.Application:
+    async def listen(request: web.Request) -> web.WebSocketResponse:
+        sample_rate = int(request.query.get("sample_rate", 16000))
+        request_id = str(uuid.uuid4())
+        segmenter = UtteranceSegmenter(vad=VoiceActivityDetector(sample_rate=sample_rate))
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        print(f"Client connected: sample_rate={sample_rate}")
+
+        samples_received = 0
+        utterances_sent = 0
+        async for message in ws:
+            if message.type == WSMsgType.BINARY:
+                samples = np.frombuffer(message.data[:len(message.data) & ~1], dtype="<i2")
+                samples_received += len(samples)
+                for segment in segmenter.process(samples):
+                    duration = len(segment) / sample_rate
+                    transcript = next(transcripts)
+                    print(f"Utterance of {duration:.2f} s -> {transcript}")
+                    await ws.send_str(result_message(transcript=transcript, start=samples_received / sample_rate - duration, duration=duration, request_id=request_id))
+                    utterances_sent += 1
+                    if drop_after > 0 and utterances_sent >= drop_after:
+                        print("Dropping connection")
+                        await ws.close()
+                        return ws
+            elif message.type == WSMsgType.TEXT:
+                if json.loads(message.data).get("type") == "CloseStream":
+                    await ws.send_str(metadata_message(duration=samples_received / sample_rate, request_id=request_id))
+                    await ws.close()
+        print("Client disconnected")
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/v1/listen", listen)
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--drop-after", type=int, default=0, help="Close the socket after this many utterances")
+    parser.add_argument("transcripts", nargs="*", default=[ "Spot, walk forward three feet." ])
+    options = parser.parse_args()
+    web.run_app(create_app(transcripts=itertools.cycle(options.transcripts), drop_after=options.drop_after), port=options.port)
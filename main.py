@@ -1,85 +1,191 @@
 import asyncio
 import os
 import time
-from typing import List, Tuple
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional
+
+STARTED_AT = time.perf_counter()
 
-import openai
 from spot_controller import SpotController
-import cv2
 import numpy as np
 
-from server.client import transcribe, process_speech
+from camera import CameraService
+from executor import CommandExecutor
+from audio import AudioCapture, ArecordSource, VoiceActivityDetector, UtteranceSegmenter, StreamingResampler, utterances, encode
+from pipeline import Pipeline, Stage
+from server.client import get_client, transcribe, process_speech, process_speech_stream
 from server.models import SpotCommand
+from server.tracing import span, start_exporter
+
+IMPORTED_AT = time.perf_counter()
 
 
 ROBOT_IP = "10.0.0.3"#os.environ['ROBOT_IP']
 SPOT_USERNAME = "admin"#os.environ['SPOT_USERNAME']
 SPOT_PASSWORD = "2zqa8dgw7lor"#os.environ['SPOT_PASSWORD']
 
+SAMPLE_RATE = 48000
+BLOCK_SECONDS = 0.1
+UPLOAD_FORMAT = os.getenv("UPLOAD_FORMAT", "flac")
+TRANSCRIPTION_MODE = os.getenv("TRANSCRIPTION_MODE", "batch")     # "batch" (upload utterances) or "streaming" (Deepgram)
+STREAMING_SAMPLE_RATE = 16000
+STREAM_COMMANDS = os.getenv("STREAM_COMMANDS", "1") == "1"     # start executing each command as soon as the server has parsed it
+MAX_COMMAND_AGE_SECONDS = float(os.getenv("MAX_COMMAND_AGE_SECONDS", 10))     # older commands are dropped rather than executed late
+RUN_SECONDS = 60
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9464))     # Prometheus /metrics for robot-side spans, 0 to disable
+CAPTURE_AFTER_MOTION = os.getenv("CAPTURE_AFTER_MOTION", "0") == "1"     # save a photo after each batch of motions
+
+
+def capture_image(camera: CameraService):
+    # Returns immediately; the latest buffered frame is encoded and written in the background
+    def report(future):
+        if future.exception() is not None:
+            print(f"Failed to save image: {future.exception()}")
+    camera.save().add_done_callback(report)
+
+async def streaming_sentences(capture: AudioCapture) -> AsyncIterator[str]:
+    # Live audio is streamed to Deepgram as it is captured, and each final sentence is yielded as soon
+    # as it arrives, so commands are available moments after the speaker stops. The Deepgram SDK is
+    # only imported in this mode, as it is slow to import and batch mode does not need it.
+    from ai import DeepgramTranscriber
+    sentences = asyncio.Queue()
+    transcriber = DeepgramTranscriber(on_sentence_received=sentences.put, sample_rate=STREAMING_SAMPLE_RATE)
+    await transcriber.start()
+    resampler = StreamingResampler(src_rate=SAMPLE_RATE, dst_rate=STREAMING_SAMPLE_RATE)
+
+    async def stream_audio():
+        async for block in capture.blocks(block_seconds=BLOCK_SECONDS):
+            await transcriber.send_audio(resampler.process(block).tobytes())
+
+    streamer = asyncio.ensure_future(stream_audio())
+    try:
+        while True:
+            yield await sentences.get()
+    finally:
+        streamer.cancel()
+        await transcriber.finish()
+
+async def transcribe_segment(samples: np.ndarray) -> Optional[str]:
+    encoded = encode(samples=samples, sample_rate=SAMPLE_RATE, format=UPLOAD_FORMAT)
+    sentence = await transcribe(audio=encoded.data, filename=encoded.filename, content_type=encoded.content_type)
+    print(f"Transcription: {sentence}")
+    return sentence if len(sentence.strip()) > 0 else None
 
-def capture_image():
-    camera_capture = cv2.VideoCapture(0)
-    rv, image = camera_capture.read()
-    print(f"Image Dimensions: {image.shape}")
-    camera_capture.release()
-    cv2.imwrite(f'/merklebot/job_data/camera_{time.time()}.jpg', image)
-
-async def get_commands() -> List[SpotCommand]:
-    filepath="recording.wav"
-    chunk_duration = 5
-    cmd = f'arecord -vv --format=cd --device={os.environ["AUDIO_INPUT_DEVICE"]} -r 48000 --duration={chunk_duration} -c 1 {filepath}'
-    os.system(cmd)
-    sentence = await transcribe(filepath=filepath)
+async def parse_sentence(sentence: str) -> Optional[List[SpotCommand]]:
     commands = await process_speech(text=sentence)
-    print(f"Transcription: {sentence}")
     print(f"Commands: {commands}")
-    return commands
-
-def normalize(v):
-    norm = np.linalg.norm(v)
-    if norm == 0: 
-       return v
-    return v / norm
-
-def rotate(v: np.ndarray, degrees: float) -> np.ndarray:
-    angle = degrees * np.pi / 180
-    r = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
-    return np.matmul(r, v)
-
-def compute_trajectory(commands: List[SpotCommand], current_pos: np.ndarray, forward: np.ndarray) -> Tuple[List[np.ndarray], np.ndarray, np.ndarray]:
-    points = []
-    for command in commands:
-        if command.command == "WALK":
-            dir = -1.0 if command.dir == "backward" else 1.0
-            distance = min(command.amount, 3.0)
-            current_pos += normalize(dir * forward) * distance
-            points.append(current_pos.copy())
-        elif command.command == "TURN":
-            dir = -1.0 if command.dir == "right" else 1.0
-            degrees = abs(command.amount) * dir
-            forward = rotate(v=forward, degrees=degrees)
-    return (points, current_pos, forward)
+    return commands if len(commands) > 0 else None
+
+async def parse_sentence_stream(sentence: str) -> Optional[AsyncIterator[SpotCommand]]:
+    # Waits only for the first command; the rest keep arriving while the robot executes it
+    commands = process_speech_stream(text=sentence)
+    try:
+        first = await commands.__anext__()
+    except StopAsyncIteration:
+        print("Commands: []")
+        return None
+    print(f"First command: {first}")
+
+    async def all_commands():
+        yield first
+        async for command in commands:
+            print(f"Next command: {command}")
+            yield command
+    return all_commands()
+
+async def execute_commands(executor: CommandExecutor, commands: List[SpotCommand]):
+    # Returns as soon as the commands are queued, so a following "stop" reaches the executor while the
+    # robot is still moving
+    executor.submit_all(commands)
+
+async def execute_command_stream(executor: CommandExecutor, commands: AsyncIterator[SpotCommand]):
+    # Each command is queued as soon as it arrives; those that arrive while the robot is moving are
+    # coalesced into one trajectory once it is free
+    await executor.submit_stream(commands)
+
+async def timed(name: str, timings: Dict[str, float], awaitable: Awaitable) -> Any:
+    started_at = time.perf_counter()
+    try:
+        with span(f"startup.{name}"):
+            return await awaitable
+    finally:
+        timings[name] = time.perf_counter() - started_at
+
+def connect_spot() -> SpotController:
+    # Blocks through the whole SDK bootstrap, returning once the robot is standing
+    spot = SpotController(username=SPOT_USERNAME, password=SPOT_PASSWORD, robot_ip=ROBOT_IP)
+    return spot.__enter__()
 
 async def main():
-    with SpotController(username=SPOT_USERNAME, password=SPOT_PASSWORD, robot_ip=ROBOT_IP) as spot:
-        current_pos = np.array([0.0,0.0])   # x is forward, y is sideways
-        current_forward = np.array([1.0,0.0])
-        start_time = time.time()
-        while time.time() - start_time < 60:
-            commands = await get_commands()
-            # points, current_pos, current_forward = compute_trajectory(commands=commands, current_pos=current_pos, forward=current_forward)
-            # for point in points:
-            #     spot.move_to_goal(goal_x=point[0], goal_y=point[1])
-            for command in commands:
-                if command.command == "WALK":
-                    dir = -1.0 if command.dir == "backward" else 1.0
-                    distance = min(command.amount, 3.0)
-                    spot.move_to_goal(goal_x=distance * dir, goal_y=0)
-                elif command.command == "TURN":
-                    dir = -1.0 if command.dir == "right" else 1.0
-                    degrees = abs(command.amount) * dir
-                    radians = degrees * np.pi / 180.0
-                    spot.move_to_goal(goal_x=0, goal_y=0, rotation=radians)
+    timings = { "imports": IMPORTED_AT - STARTED_AT }
+    exporter = await start_exporter(port=METRICS_PORT) if METRICS_PORT > 0 else None
+    capture = AudioCapture(source=ArecordSource(device=os.environ["AUDIO_INPUT_DEVICE"], sample_rate=SAMPLE_RATE), sample_rate=SAMPLE_RATE)
+    camera = CameraService()
+    # Audio, the camera and the connection to the speech server come up while the robot boots and
+    # stands, so the first utterance finds everything ready
+    results = await asyncio.gather(
+        timed("spot", timings, asyncio.get_running_loop().run_in_executor(None, connect_spot)),
+        timed("audio", timings, capture.start()),
+        timed("camera", timings, camera.start()),
+        timed("speech_server", timings, get_client().warm_up()),
+        return_exceptions=True
+    )
+    spot = results[0]
+    failures = [ result for result in results if isinstance(result, BaseException) ]
+    if len(failures) > 0:
+        if not isinstance(spot, BaseException):
+            spot.__exit__(None, None, None)
+        await capture.stop()
+        await camera.stop()
+        await get_client().close()
+        raise failures[0]
+    timings["total"] = time.perf_counter() - STARTED_AT
+    print("Startup: " + ", ".join(f"{name} {seconds:.2f} s" for name, seconds in timings.items()))
+
+    # Commands run through the executor, so that a spoken "stop" or "sit" interrupts whatever the robot
+    # is doing instead of waiting for it to finish
+    executor = CommandExecutor(spot=spot, on_moved=(lambda: capture_image(camera)) if CAPTURE_AFTER_MOTION else None)
+    await executor.start()
+    try:
+        async def execute(commands):
+            if STREAM_COMMANDS:
+                await execute_command_stream(executor=executor, commands=commands)
+            else:
+                await execute_commands(executor=executor, commands=commands)
+        parse = parse_sentence_stream if STREAM_COMMANDS else parse_sentence
+
+        # Each stage overlaps the others, e.g. the next utterance is transcribed while the robot moves.
+        # The first stage drops its oldest item when full so that capture never waits on the network.
+        execute_stage = Stage(name="execute", handler=execute, queue_size=2)
+        if TRANSCRIPTION_MODE == "streaming":
+            source = streaming_sentences(capture=capture)
+            stages = [
+                Stage(name="parse", handler=parse, queue_size=4, drop_oldest=True),
+                execute_stage
+            ]
+        else:
+            segmenter = UtteranceSegmenter(vad=VoiceActivityDetector(sample_rate=SAMPLE_RATE))
+            source = utterances(blocks=capture.blocks(block_seconds=BLOCK_SECONDS), segmenter=segmenter)
+            stages = [
+                Stage(name="transcribe", handler=transcribe_segment, queue_size=4, drop_oldest=True),
+                Stage(name="parse", handler=parse, queue_size=4),
+                execute_stage
+            ]
+
+        pipeline = Pipeline(stages=stages, max_age_seconds=MAX_COMMAND_AGE_SECONDS)
+        try:
+            await asyncio.wait_for(pipeline.run(source=source), timeout=RUN_SECONDS)
+            await executor.join()
+        except asyncio.TimeoutError:
+            pass
+    finally:
+        await executor.close()
+        print(executor.report())
+        spot.__exit__(None, None, None)
+    await capture.stop()
+    await camera.stop()
+    await get_client().close()
+    if exporter is not None:
+        await exporter.cleanup()
 
     exit()
 
@@ -93,23 +199,23 @@ async def main():
     with SpotController(username=SPOT_USERNAME, password=SPOT_PASSWORD, robot_ip=ROBOT_IP) as spot:
 
         time.sleep(2)
-        capture_image()
+        capture_image(camera)
         # Move head to specified positions with intermediate time.sleep
         spot.move_head_in_points(yaws=[0.2, 0],
                                  pitches=[0.3, 0],
                                  rolls=[0.4, 0],
                                  sleep_after_point_reached=1)
-        capture_image()
+        capture_image(camera)
         time.sleep(3)
 
         # Make Spot to move by goal_x meters forward and goal_y meters left
         spot.move_to_goal(goal_x=0.5, goal_y=0)
         time.sleep(3)
-        capture_image()
+        capture_image(camera)
 
         # Control Spot by velocity in m/s (or in rad/s for rotation)
         spot.move_by_velocity_control(v_x=-0.3, v_y=0, v_rot=0, cmd_duration=2)
-        capture_image()
+        capture_image(camera)
         time.sleep(3)
 
 
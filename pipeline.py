@@ -0,0 +1,149 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
+
+from server.tracing import correlation_id, new_correlation_id, record, span
+
+
+####################################################################################################
+# Pipeline Stages
+####################################################################################################
+
+class WorkItem:
+    __slots__ = ("payload", "created_at", "correlation_id")
+
+    def __init__(self, payload: Any, created_at: float, correlation_id: str):
+        self.payload = payload
+        self.created_at = created_at    # time.monotonic() at which the originating audio was captured
+        self.correlation_id = correlation_id
+
+class Stage:
+    # A pipeline stage: a bounded input queue drained by one or more workers running handler. A handler
+    # returning None produces no output for the next stage. When the queue is full, upstream either
+    # waits (backpressure, the time spent waiting is recorded) or, with drop_oldest, the oldest queued
+    # item is discarded so that the producer never stalls.
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], Awaitable[Any]],
+        queue_size: int = 4,
+        workers: int = 1,
+        drop_oldest: bool = False,
+        max_age_seconds: Optional[float] = None
+    ):
+        self.name = name
+        self.handler = handler
+        self.queue_size = queue_size
+        self.workers = workers
+        self.drop_oldest = drop_oldest
+        self.max_age_seconds = max_age_seconds
+        self.queue: Optional[asyncio.Queue] = None
+        self.processed = 0
+        self.failed = 0
+        self.dropped_stale = 0
+        self.dropped_overflow = 0
+        self.peak_queue_depth = 0
+        self.blocked_seconds = 0.0      # time upstream spent waiting for room in this stage's queue
+        self.busy_seconds = 0.0
+
+    def report(self) -> str:
+        depth = self.queue.qsize() if self.queue is not None else 0
+        return (
+            f"{self.name}: processed={self.processed} failed={self.failed} queue={depth}/{self.queue_size} "
+            f"peak={self.peak_queue_depth} stale={self.dropped_stale} overflow={self.dropped_overflow} "
+            f"blocked={self.blocked_seconds:.2f}s busy={self.busy_seconds:.2f}s"
+        )
+
+
+####################################################################################################
+# Pipeline
+####################################################################################################
+
+class Pipeline:
+    # Runs a source and a chain of stages concurrently, connected by bounded queues, so that e.g. the
+    # next utterance is transcribed while the robot is still executing the previous one. Work older than
+    # the age budget (measured from capture) is dropped at the start of each stage instead of being
+    # acted on late.
+    def __init__(self, stages: List[Stage], max_age_seconds: float = 10, report_interval: float = 30):
+        self.stages = stages
+        self.max_age_seconds = max_age_seconds
+        self.report_interval = report_interval
+
+    async def run(self, source: AsyncIterator[Any]):
+        for stage in self.stages:
+            stage.queue = asyncio.Queue(maxsize=stage.queue_size)
+        tasks = [ asyncio.ensure_future(self._feed(source)) ]
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            tasks += [ asyncio.ensure_future(self._work(stage, next_stage)) for _ in range(stage.workers) ]
+        if self.report_interval > 0:
+            tasks.append(asyncio.ensure_future(self._report_periodically()))
+        try:
+            # Runs until the source is exhausted and all queued work has been processed
+            await tasks[0]
+            for stage in self.stages:
+                await stage.queue.join()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            print(self.report())
+
+    def report(self) -> str:
+        return "\n".join([ "Pipeline:" ] + [ f"  {stage.report()}" for stage in self.stages ])
+
+    async def _feed(self, source: AsyncIterator[Any]):
+        async for payload in source:
+            await self._put(self.stages[0], WorkItem(payload=payload, created_at=time.monotonic(), correlation_id=new_correlation_id()))
+
+    async def _put(self, stage: Stage, item: WorkItem):
+        if stage.drop_oldest:
+            if stage.queue.full():
+                stage.queue.get_nowait()
+                stage.queue.task_done()
+                stage.dropped_overflow += 1
+            stage.queue.put_nowait(item)
+        else:
+            started_at = time.perf_counter()
+            await stage.queue.put(item)
+            stage.blocked_seconds += time.perf_counter() - started_at
+        stage.peak_queue_depth = max(stage.peak_queue_depth, stage.queue.qsize())
+
+    async def _work(self, stage: Stage, next_stage: Optional[Stage]):
+        # Each item's correlation ID is current while its handler runs, so spans recorded downstream
+        # (including on the server) are attributed to the utterance
+        max_age = stage.max_age_seconds if stage.max_age_seconds is not None else self.max_age_seconds
+        while True:
+            item = await stage.queue.get()
+            token = correlation_id.set(item.correlation_id)
+            try:
+                age = time.monotonic() - item.created_at
+                if age > max_age:
+                    stage.dropped_stale += 1
+                    print(f"{stage.name}: dropping work captured {age:.1f} s ago")
+                    continue
+                record(f"pipeline.{stage.name}.age", age)
+                started_at = time.perf_counter()
+                try:
+                    with span(f"pipeline.{stage.name}"):
+                        output = await stage.handler(item.payload)
+                    stage.processed += 1
+                except Exception as e:
+                    stage.failed += 1
+                    print(f"{stage.name}: failed: {e}")
+                    continue
+                finally:
+                    stage.busy_seconds += time.perf_counter() - started_at
+                if next_stage is None:
+                    # From capture to the last stage finishing, e.g. the robot completing the motion
+                    record("pipeline.end_to_end", time.monotonic() - item.created_at)
+                elif output is not None:
+                    await self._put(next_stage, WorkItem(payload=output, created_at=item.created_at, correlation_id=item.correlation_id))
+            finally:
+                correlation_id.reset(token)
+                stage.queue.task_done()
+
+    async def _report_periodically(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            print(self.report())
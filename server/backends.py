@@ -0,0 +1,82 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import threading
+import time
+from typing import Callable, TypeVar
+
+from .models import BackendStats
+from .tracing import record
+
+T = TypeVar("T")
+
+
+# Runs blocking backend calls (the synchronous OpenAI client) on a dedicated, explicitly sized thread
+# pool so they never block the event loop. max_concurrency bounds the number of simultaneous calls to
+# the backend; calls beyond that wait in the pool's queue, and the queue depth is tracked.
+class BackendExecutor:
+    def __init__(self, name: str, max_concurrency: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._in_flight = 0
+        self._peak_queue_depth = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_wait_seconds = 0.0
+        self._total_run_seconds = 0.0
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        submitted_at = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+            self._peak_queue_depth = max(self._peak_queue_depth, self._queued)
+
+        def call():
+            started_at = time.perf_counter()
+            with self._lock:
+                self._queued -= 1
+                self._in_flight += 1
+                self._total_wait_seconds += started_at - submitted_at
+            record(f"backend.{self.name}.queued", started_at - submitted_at)
+            succeeded = False
+            try:
+                result = fn(*args, **kwargs)
+                succeeded = True
+                return result
+            finally:
+                run_seconds = time.perf_counter() - started_at
+                record(f"backend.{self.name}.run", run_seconds)
+                with self._lock:
+                    self._in_flight -= 1
+                    self._total_run_seconds += run_seconds
+                    if succeeded:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+
+        # Context variables (e.g., request-scoped state) are carried into the worker thread
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, call))
+
+    def stats(self) -> BackendStats:
+        with self._lock:
+            finished = self._completed + self._failed
+            return BackendStats(
+                name=self.name,
+                max_concurrency=self.max_concurrency,
+                queue_depth=self._queued,
+                peak_queue_depth=self._peak_queue_depth,
+                in_flight=self._in_flight,
+                completed=self._completed,
+                failed=self._failed,
+                mean_wait_seconds=self._total_wait_seconds / finished if finished > 0 else 0.0,
+                mean_run_seconds=self._total_run_seconds / finished if finished > 0 else 0.0
+            )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
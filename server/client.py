@@ -1,23 +1,302 @@
-from typing import List
+import asyncio
+import mimetypes
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Callable, List, Optional
 
 import aiohttp
 
-from .models import TranscriptionResponse, ProcessSpeechResponse, SpotCommand
+from .fleet import ROBOT_ID_HEADER
+from .tracing import CORRELATION_HEADER, current_correlation_id, span
+from .wire import COMMANDS_MEDIA_TYPE, decode_commands, is_encoded
+from .models import TranscriptionResponse, ProcessSpeechResponse, SpotCommand, VoiceCommandResponse, VoiceCommandEvent, VoiceCommandEventType
 
-URL = "http://192.168.2.172:8000"
+URL = os.getenv("SPEECH_SERVER_URL", "http://192.168.2.172:8000")
+ROBOT_ID = os.getenv("ROBOT_ID")            # identifies this robot to a server shared by a fleet
+ROBOT_TOKEN = os.getenv("ROBOT_TOKEN")      # alternatively, a token the server maps to a robot
 
-async def transcribe(filepath: str) -> str:
-    url = f"{URL}/transcribe"
-    async with aiohttp.ClientSession() as session:
-        form_data = aiohttp.FormData()
-        form_data.add_field('audio', open(filepath, 'rb'), filename="voice.wav")
-        async with session.post(url, data=form_data) as response:
-            return TranscriptionResponse.model_validate_json(json_data=await response.text()).text
+
+####################################################################################################
+# Pooled Client
+####################################################################################################
+
+RETRYABLE_STATUSES = { 429, 502, 503, 504 }
+
+ACCEPT_COMMANDS = f"{COMMANDS_MEDIA_TYPE}, application/json;q=0.5"
+
+class _RetryableStatus(Exception):
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after      # seconds, from the server's Retry-After header
+
+class SpeechClient:
+    # Long-lived client for the speech server. Connections are kept alive and reused across requests,
+    # concurrency is bounded, and failed requests are retried with jittered exponential backoff until
+    # they succeed, run out of attempts, or hit their deadline. Requests that change server state are
+    # only retried when the server cannot have run them.
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        max_connections: int = 4,
+        max_concurrency: int = 4,
+        connect_timeout: float = 3,
+        request_timeout: float = 15,
+        keepalive_timeout: float = 60,
+        max_retries: int = 2,
+        backoff: float = 0.2,
+        robot_id: Optional[str] = None,
+        robot_token: Optional[str] = None
+    ):
+        self.url = url or URL
+        self.robot_id = robot_id or ROBOT_ID
+        self.robot_token = robot_token or ROBOT_TOKEN
+        self._max_connections = max_connections
+        self._connect_timeout = connect_timeout
+        self._request_timeout = request_timeout
+        self._keepalive_timeout = keepalive_timeout
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_concurrency = max_concurrency
+        # Created on first use so that they bind to the running event loop
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def warm_up(self, timeout: float = 5) -> bool:
+        # Opens a pooled connection (DNS lookup, TCP and TLS handshakes) ahead of the first upload, so
+        # the first utterance does not pay for it. Returns whether the server answered.
+        session = self._get_session()
+        try:
+            with span("client.warm_up"):
+                async with session.get(f"{self.url}/status", headers=self._headers(), timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    await response.read()
+                    return response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Speech server at {self.url} not reachable yet: {e}")
+            return False
+
+    async def transcribe(self, audio: bytes, filename: str = "voice.wav", content_type: str = "audio/wav", deadline: Optional[float] = None) -> str:
+        body = await self._post_audio(path="/transcribe", make_data=lambda: audio, filename=filename, content_type=content_type, deadline=deadline, idempotent=True)
+        return TranscriptionResponse.model_validate_json(json_data=body).text
+
+    async def transcribe_file(self, filepath: str, deadline: Optional[float] = None) -> str:
+        # The file is streamed from disk rather than read into memory; aiohttp closes it once sent
+        content_type = mimetypes.guess_type(filepath)[0] or "application/octet-stream"
+        body = await self._post_audio(path="/transcribe", make_data=lambda: open(filepath, "rb"), filename=os.path.basename(filepath), content_type=content_type, deadline=deadline, idempotent=True)
+        return TranscriptionResponse.model_validate_json(json_data=body).text
+
+    async def process_speech(self, text: str, deadline: Optional[float] = None) -> List[SpotCommand]:
+        def make_form():
+            form_data = aiohttp.FormData()
+            form_data.add_field("text", text)
+            return form_data
+        # The binary command encoding is preferred; servers that do not offer it answer in JSON. Each
+        # request adds a turn to the robot's conversation, so it is only retried when the server cannot
+        # have run it.
+        body = await self._post(path="/process_speech", make_data=make_form, deadline=deadline, idempotent=False, accept=ACCEPT_COMMANDS)
+        if is_encoded(body):
+            return decode_commands(body)
+        return ProcessSpeechResponse.model_validate_json(json_data=body).commands
+
+    async def voice_command(self, audio: bytes, filename: str = "voice.wav", content_type: str = "audio/wav", deadline: Optional[float] = None) -> VoiceCommandResponse:
+        # Transcription and command parsing in one round trip
+        # Each request adds a turn to the robot's conversation, so it is only retried when the server
+        # cannot have run it
+        body = await self._post_audio(path="/voice_command", make_data=lambda: audio, filename=filename, content_type=content_type, deadline=deadline, idempotent=False)
+        return VoiceCommandResponse.model_validate_json(json_data=body)
+
+    async def voice_command_stream(self, audio: bytes, filename: str = "voice.wav", content_type: str = "audio/wav") -> AsyncIterator[VoiceCommandEvent]:
+        # Yields the transcript event as soon as the server has it, then each command as it is parsed,
+        # then all of the commands
+        params = { "filename": filename, "stream": "true" }
+        async for event in self._stream_events(path="/voice_command", make_data=lambda: audio, params=params, content_type=content_type):
+            yield event
+
+    async def process_speech_stream(self, text: str) -> AsyncIterator[SpotCommand]:
+        # Yields each command as soon as the server has parsed it, so the robot can start on the first
+        # while the rest are still being generated
+        def make_form():
+            form_data = aiohttp.FormData()
+            form_data.add_field("text", text)
+            form_data.add_field("stream", "true")
+            return form_data
+        async for event in self._stream_events(path="/process_speech", make_data=make_form):
+            if event.type == VoiceCommandEventType.COMMAND:
+                yield event.command
+
+    async def _stream_events(self, path: str, make_data: Callable[[], Any], params: Optional[dict] = None, content_type: Optional[str] = None) -> AsyncIterator[VoiceCommandEvent]:
+        # Streamed requests add a turn to the conversation, so like other such requests they are only
+        # retried when the server cannot have run them, which is always before any event has arrived
+        with span(f"client.{path.strip('/')}_stream"):
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    session = self._get_session()
+                    async with self._semaphore:
+                        client_timeout = aiohttp.ClientTimeout(total=self._request_timeout, connect=self._connect_timeout)
+                        async with session.post(f"{self.url}{path}", data=make_data(), params=params, headers=self._headers(content_type=content_type), timeout=client_timeout) as response:
+                            if _is_retryable_status(response.status, idempotent=False) and attempt <= self._max_retries:
+                                raise _RetryableStatus(response.status, retry_after=_retry_after(response))
+                            response.raise_for_status()
+                            async for line in response.content:
+                                line = line.strip()
+                                if len(line) == 0:
+                                    continue
+                                event = VoiceCommandEvent.model_validate_json(json_data=line)
+                                if event.type == VoiceCommandEventType.ERROR:
+                                    raise RuntimeError(f"Server failed to process {path}: {event.text}")
+                                yield event
+                    return
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError, _RetryableStatus) as e:
+                    delay = self._retry_delay(attempt=attempt, error=e, idempotent=False, deadline=None)
+                    if delay is None:
+                        raise
+                    print(f"Request to {path} failed ({type(e).__name__}: {e}), retrying in {delay:.2f} s")
+                    await asyncio.sleep(delay)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._max_connections, keepalive_timeout=self._keepalive_timeout, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._session
+
+    def _headers(self, content_type: Optional[str] = None, accept: Optional[str] = None) -> dict:
+        # Identifies the robot to a fleet server, and lets the server attribute its spans to the
+        # utterance being processed
+        headers = {}
+        if content_type is not None:
+            headers["Content-Type"] = content_type
+        if accept is not None:
+            headers["Accept"] = accept
+        if self.robot_token is not None:
+            headers["Authorization"] = f"Bearer {self.robot_token}"
+        if self.robot_id is not None:
+            headers[ROBOT_ID_HEADER] = self.robot_id
+        correlation = current_correlation_id()
+        if correlation is not None:
+            headers[CORRELATION_HEADER] = correlation
+        return headers
+
+    async def _post_audio(self, path: str, make_data: Callable[[], Any], filename: str, content_type: str, deadline: Optional[float], idempotent: bool) -> bytes:
+        # Audio is sent as the raw request body, which the server reads as it arrives, instead of being
+        # wrapped in a multipart form. The filename tells the server the format when the content type
+        # does not.
+        return await self._post(path=path, make_data=make_data, deadline=deadline, idempotent=idempotent, params={ "filename": filename }, content_type=content_type)
+
+    async def _post(
+        self,
+        path: str,
+        make_data: Callable[[], Any],
+        deadline: Optional[float],
+        idempotent: bool,
+        params: Optional[dict] = None,
+        content_type: Optional[str] = None,
+        accept: Optional[str] = None
+    ) -> bytes:
+        # Spans cover all attempts, including backoff. Returns the raw response body.
+        with span(f"client.{path.strip('/')}"):
+            return await self._post_with_retries(path=path, make_data=make_data, deadline=deadline, idempotent=idempotent, params=params, content_type=content_type, accept=accept)
+
+    async def _post_with_retries(
+        self,
+        path: str,
+        make_data: Callable[[], Any],
+        deadline: Optional[float],
+        idempotent: bool,
+        params: Optional[dict],
+        content_type: Optional[str],
+        accept: Optional[str]
+    ) -> bytes:
+        # deadline is an absolute time.monotonic() value covering all attempts, including backoff
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._request_timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    raise asyncio.TimeoutError(f"Deadline exceeded for {path}")
+            try:
+                session = self._get_session()
+                async with self._semaphore:
+                    client_timeout = aiohttp.ClientTimeout(total=timeout, connect=min(self._connect_timeout, timeout))
+                    async with session.post(f"{self.url}{path}", data=make_data(), params=params, headers=self._headers(content_type=content_type, accept=accept), timeout=client_timeout) as response:
+                        if _is_retryable_status(response.status, idempotent=idempotent) and attempt <= self._max_retries:
+                            raise _RetryableStatus(response.status, retry_after=_retry_after(response))
+                        response.raise_for_status()
+                        return await response.read()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError, _RetryableStatus) as e:
+                delay = self._retry_delay(attempt=attempt, error=e, idempotent=idempotent, deadline=deadline)
+                if delay is None:
+                    raise
+                print(f"Request to {path} failed ({type(e).__name__}: {e}), retrying in {delay:.2f} s")
+                await asyncio.sleep(delay)
+
+    def _retry_delay(self, attempt: int, error: Exception, idempotent: bool, deadline: Optional[float]) -> Optional[float]:
+        # Seconds to wait before the next attempt, or None to give up. Requests that are not idempotent
+        # are only retried when the server cannot have run them: the connection was never made, or the
+        # server shed the request with 429. A read timeout or a 5xx may come after the work was done.
+        if attempt > self._max_retries:
+            return None
+        if not idempotent and not isinstance(error, (_RetryableStatus, aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)):
+            return None
+        delay = random.uniform(0, self._backoff * (2 ** (attempt - 1)))
+        if isinstance(error, _RetryableStatus) and error.retry_after is not None:
+            # An overloaded server says when it expects to have room
+            delay = max(delay, error.retry_after)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+
+def _is_retryable_status(status: int, idempotent: bool) -> bool:
+    # A 429 comes from the fleet scheduler, before the request has run
+    return status == 429 if not idempotent else status in RETRYABLE_STATUSES
+
+def _retry_after(response: aiohttp.ClientResponse) -> Optional[float]:
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+####################################################################################################
+# Module-Level API
+####################################################################################################
+
+_client: Optional[SpeechClient] = None
+
+def get_client() -> SpeechClient:
+    global _client
+    if _client is None:
+        _client = SpeechClient()
+    return _client
+
+async def transcribe(filepath: Optional[str] = None, audio: Optional[bytes] = None, filename: str = "voice.wav", content_type: str = "audio/wav") -> str:
+    # Uploads either a file on disk, streamed, or an in-memory buffer
+    if audio is None:
+        return await get_client().transcribe_file(filepath=filepath)
+    return await get_client().transcribe(audio=audio, filename=filename, content_type=content_type)
 
 async def process_speech(text: str) -> List[SpotCommand]:
-    url = f"{URL}/process_speech"
-    async with aiohttp.ClientSession() as session:
-        form_data = aiohttp.FormData()
-        form_data.add_field("text", text)
-        async with session.post(url, data=form_data) as response:
-            return ProcessSpeechResponse.model_validate_json(json_data=await response.text()).commands
\ No newline at end of file
+    return await get_client().process_speech(text=text)
+
+def process_speech_stream(text: str) -> AsyncIterator[SpotCommand]:
+    return get_client().process_speech_stream(text=text)
+
+async def voice_command(audio: bytes, filename: str = "voice.wav", content_type: str = "audio/wav") -> VoiceCommandResponse:
+    return await get_client().voice_command(audio=audio, filename=filename, content_type=content_type)
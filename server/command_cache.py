@@ -0,0 +1,82 @@
+from collections import OrderedDict
+import json
+import os
+import time
+from typing import List, Optional, Tuple
+
+from .models import SPOT_COMMANDS, SpotCommand, CacheStats
+from .text import normalize_text
+
+
+# Maps normalized transcripts to the commands they produced. Entries expire after ttl_seconds and the
+# least recently used entry is evicted once max_entries is reached. When a path is given, entries are
+# loaded from it on construction and written back by save().
+class CommandCache:
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 7 * 24 * 3600, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self._entries: "OrderedDict[str, Tuple[float, List[SpotCommand]]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def get(self, text: str) -> Optional[List[SpotCommand]]:
+        key = normalize_text(text)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                del self._entries[key]
+            self._misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return [ command.model_copy() for command in entry[1] ]
+
+    def put(self, text: str, commands: List[SpotCommand]):
+        key = normalize_text(text)
+        if len(key) == 0:
+            return
+        self._entries[key] = (time.time() + self.ttl_seconds, [ command.model_copy() for command in commands ])
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        return CacheStats(entries=len(self._entries), max_entries=self.max_entries, hits=self._hits, misses=self._misses, evictions=self._evictions)
+
+    def load(self):
+        try:
+            with open(self.path, "r") as fp:
+                data = json.load(fp)
+            now = time.time()
+            for entry in data["entries"]:
+                if entry["expires_at"] > now:
+                    self._entries[entry["key"]] = (entry["expires_at"], SPOT_COMMANDS.validate_python(entry["commands"]))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            print(f"Loaded {len(self._entries)} cached commands from {self.path}")
+        except Exception as e:
+            print(f"Failed to load command cache from {self.path}: {e}")
+
+    def save(self):
+        if self.path is None:
+            return
+        now = time.time()
+        data = {
+            "entries": [
+                { "key": key, "expires_at": expires_at, "commands": [ command.model_dump(mode="json") for command in commands ] }
+                for key, (expires_at, commands) in self._entries.items() if expires_at > now
+            ]
+        }
+        # Write atomically so a crash mid-save cannot corrupt the cache
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as fp:
+            json.dump(data, fp)
+        os.replace(temp_path, self.path)
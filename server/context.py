@@ -0,0 +1,148 @@
+from collections import deque
+import threading
+import time
+from typing import Deque, Dict, List
+
+from .models import SpotCommand
+from .text import tokenize
+
+
+# Words that make an utterance's meaning depend on what the robot did before ("do that again", "turn
+# back"). Such utterances must not be answered from the command cache, whose entries were resolved
+# against some other conversation.
+CONTEXT_WORDS = { "again", "that", "this", "it", "same", "back", "undo", "previous", "last", "more", "another", "repeat", "reverse", "opposite" }
+
+# Rough size of a message in prompt tokens: about four characters per token for English, plus the
+# per-message framing overhead of the chat format
+CHARS_PER_TOKEN = 4
+TOKENS_PER_MESSAGE = 4
+
+def is_context_dependent(text: str) -> bool:
+    return any(token in CONTEXT_WORDS for token in tokenize(text))
+
+def estimate_tokens(messages: List[dict]) -> int:
+    total = 0
+    for message in messages:
+        total += TOKENS_PER_MESSAGE + len(message.get("content") or "") // CHARS_PER_TOKEN
+        for tool_call in message.get("tool_calls") or []:
+            total += (len(tool_call["function"]["name"]) + len(tool_call["function"]["arguments"])) // CHARS_PER_TOKEN
+    return total
+
+def describe_commands(commands: List[SpotCommand]) -> str:
+    # How a turn resolved without the LLM is recorded in the conversation
+    if len(commands) == 0:
+        return "No commands."
+    return "Executed: " + "; ".join(
+        f"{command.command.value} {command.dir.value} {command.amount:g}" + (f" for {command.duration:g} s" if command.duration > 0 else "")
+        for command in commands
+    )
+
+
+####################################################################################################
+# Conversations
+####################################################################################################
+
+class Turn:
+    __slots__ = ("messages", "summary", "tokens")
+
+    def __init__(self, messages: List[dict], summary: str):
+        self.messages = messages        # user message, assistant message, and any tool responses
+        self.summary = summary          # one line standing in for the turn once it is truncated
+        self.tokens = estimate_tokens(messages)
+
+# One robot's recent exchanges. The newest turns are kept verbatim, tool calls and tool responses
+# included, up to max_tokens; older ones are folded into a summary of at most max_summary_lines, so the
+# prompt stays bounded however long the session runs. Messages are only ever appended between
+# truncations, so consecutive prompts share as long a prefix as possible.
+class Conversation:
+    def __init__(self, session_id: str, max_tokens: int = 1200, max_summary_lines: int = 8):
+        self.session_id = session_id
+        self.max_tokens = max_tokens
+        self.max_summary_lines = max_summary_lines
+        self.last_used = time.monotonic()
+        self._turns: Deque[Turn] = deque()
+        self._summary: Deque[str] = deque(maxlen=max_summary_lines)
+        self._lock = threading.Lock()
+
+    def messages(self) -> List[dict]:
+        # The history to place between the fixed system prefix and the new user message
+        with self._lock:
+            self.last_used = time.monotonic()
+            history = []
+            if len(self._summary) > 0:
+                history.append({ "role": "system", "content": "Earlier in this conversation:\n" + "\n".join(self._summary) })
+            for turn in self._turns:
+                history += turn.messages
+            return history
+
+    def add_turn(self, messages: List[dict], commands: List[SpotCommand]):
+        user_text = messages[0].get("content") or ""
+        turn = Turn(messages=messages, summary=f'User: "{user_text}" -> {describe_commands(commands)}')
+        with self._lock:
+            self.last_used = time.monotonic()
+            self._turns.append(turn)
+            self._truncate()
+
+    def add_resolved(self, text: str, commands: List[SpotCommand]):
+        # Records a turn answered by the local grammar or the cache, so later references to it resolve
+        self.add_turn(
+            messages=[ { "role": "user", "content": text }, { "role": "assistant", "content": describe_commands(commands) } ],
+            commands=commands
+        )
+
+    def tokens(self) -> int:
+        with self._lock:
+            summary_tokens = TOKENS_PER_MESSAGE + sum(len(line) for line in self._summary) // CHARS_PER_TOKEN if len(self._summary) > 0 else 0
+            return summary_tokens + sum(turn.tokens for turn in self._turns)
+
+    def clear(self):
+        with self._lock:
+            self._turns.clear()
+            self._summary.clear()
+
+    def _truncate(self):
+        # Always keeps the newest turn verbatim, since it is what "that" most often refers to
+        while len(self._turns) > 1 and sum(turn.tokens for turn in self._turns) > self.max_tokens:
+            self._summary.append(self._turns.popleft().summary)
+
+# Conversations keyed by session (the robot ID the fleet scheduler resolved). Sessions idle for longer
+# than ttl_seconds start over.
+class ContextStore:
+    def __init__(self, max_tokens: int = 1200, ttl_seconds: float = 600, max_sessions: int = 1024):
+        self.max_tokens = max_tokens
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._conversations: Dict[str, Conversation] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Conversation:
+        with self._lock:
+            conversation = self._conversations.get(session_id)
+            if conversation is not None and conversation.last_used < time.monotonic() - self.ttl_seconds:
+                conversation = None
+            if conversation is None:
+                self._expire()
+                conversation = self._conversations[session_id] = Conversation(session_id=session_id, max_tokens=self.max_tokens)
+            return conversation
+
+    def reset(self, session_id: str):
+        with self._lock:
+            self._conversations.pop(session_id, None)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        for session_id in [ session_id for session_id, conversation in self._conversations.items() if conversation.last_used < cutoff ]:
+            del self._conversations[session_id]
+        while len(self._conversations) >= self.max_sessions:
+            del self._conversations[min(self._conversations, key=lambda session_id: self._conversations[session_id].last_used)]
+
+def assistant_message(message) -> dict:
+    # Converts the client library's response message to the plain dict form it is sent back in, so
+    # stored history is serializable and independent of the response objects
+    result = { "role": "assistant", "content": message.content }
+    if message.tool_calls:
+        result["tool_calls"] = [
+            { "id": tool_call.id, "type": "function", "function": { "name": tool_call.function.name, "arguments": tool_call.function.arguments } }
+            for tool_call in message.tool_calls
+        ]
+    return result
@@ -0,0 +1,173 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import math
+import time
+from typing import AsyncIterator, Deque, Dict, List, Optional
+
+from .models import RobotSessionStats
+from .tracing import record
+
+
+ROBOT_ID_HEADER = "X-Robot-ID"
+DEFAULT_ROBOT_ID = "default"
+
+
+class FleetOverloaded(Exception):
+    def __init__(self, robot_id: str, retry_after: int):
+        super().__init__(f"Too many requests queued for robot {robot_id}")
+        self.robot_id = robot_id
+        self.retry_after = retry_after      # seconds
+
+class RobotSession:
+    def __init__(self, robot_id: str):
+        self.robot_id = robot_id
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.last_seen = time.monotonic()
+        self.admitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.peak_queue_depth = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+
+    def stats(self) -> RobotSessionStats:
+        return RobotSessionStats(
+            robot_id=self.robot_id,
+            in_flight=self.in_flight,
+            queue_depth=len(self.waiters),
+            peak_queue_depth=self.peak_queue_depth,
+            admitted=self.admitted,
+            rejected=self.rejected,
+            completed=self.completed,
+            mean_wait_seconds=self.total_wait_seconds / self.admitted if self.admitted > 0 else 0.0,
+            mean_run_seconds=self.total_run_seconds / self.completed if self.completed > 0 else 0.0
+        )
+
+# Shares the server between robots. At most max_concurrency requests run at once, and at most
+# per_robot_concurrency of them for any one robot. Waiting requests are granted slots round-robin
+# across robots, so a robot with a deep queue cannot starve the others. Each robot's queue is bounded;
+# a request arriving at a full queue is rejected immediately with an estimate of when to retry,
+# rather than waiting behind an ever-growing backlog.
+class FleetScheduler:
+    def __init__(self, max_concurrency: int = 16, per_robot_concurrency: int = 4, max_queue_per_robot: int = 8, session_ttl_seconds: float = 3600):
+        self.max_concurrency = max_concurrency
+        self.per_robot_concurrency = per_robot_concurrency
+        self.max_queue_per_robot = max_queue_per_robot
+        self.session_ttl_seconds = session_ttl_seconds
+        self._sessions: Dict[str, RobotSession] = {}
+        self._turns: Deque[str] = deque()       # robots with waiting requests, in round-robin order
+        self._in_flight = 0
+
+    @asynccontextmanager
+    async def admit(self, robot_id: str) -> AsyncIterator[RobotSession]:
+        # Holds one of the robot's slots for the duration of the block. Raises FleetOverloaded if the
+        # robot's queue is full.
+        session = self._session(robot_id)
+        queued_at = time.perf_counter()
+        # Robots still waiting while there is free capacity are all at their own cap, so a robot with
+        # nothing queued can go ahead without jumping the line
+        if session.in_flight < self.per_robot_concurrency and self._in_flight < self.max_concurrency and len(session.waiters) == 0:
+            self._grant(session)
+        else:
+            if len(session.waiters) >= self.max_queue_per_robot:
+                session.rejected += 1
+                raise FleetOverloaded(robot_id=robot_id, retry_after=self._retry_after(session))
+            waiter = asyncio.get_running_loop().create_future()
+            session.waiters.append(waiter)
+            session.peak_queue_depth = max(session.peak_queue_depth, len(session.waiters))
+            if robot_id not in self._turns:
+                self._turns.append(robot_id)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Caller went away: give up the place in the queue, or the slot if it was just granted
+                if waiter.done() and not waiter.cancelled():
+                    self._release(session)
+                elif waiter in session.waiters:
+                    session.waiters.remove(waiter)
+                raise
+        wait_seconds = time.perf_counter() - queued_at
+        session.admitted += 1
+        session.total_wait_seconds += wait_seconds
+        record("fleet.queued", wait_seconds)
+        started_at = time.perf_counter()
+        try:
+            yield session
+        finally:
+            session.completed += 1
+            session.total_run_seconds += time.perf_counter() - started_at
+            self._release(session)
+
+    def stats(self) -> List[RobotSessionStats]:
+        self._expire_sessions()
+        return [ session.stats() for session in sorted(self._sessions.values(), key=lambda session: session.robot_id) ]
+
+    def _session(self, robot_id: str) -> RobotSession:
+        session = self._sessions.get(robot_id)
+        if session is None:
+            self._expire_sessions()
+            session = self._sessions[robot_id] = RobotSession(robot_id=robot_id)
+        session.last_seen = time.monotonic()
+        return session
+
+    def _grant(self, session: RobotSession):
+        session.in_flight += 1
+        self._in_flight += 1
+
+    def _release(self, session: RobotSession):
+        session.in_flight -= 1
+        self._in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        # Grants free slots to waiting requests, taking one from each eligible robot in turn
+        skipped = 0
+        while self._in_flight < self.max_concurrency and skipped < len(self._turns):
+            robot_id = self._turns.popleft()
+            session = self._sessions.get(robot_id)
+            if session is None:
+                continue
+            while len(session.waiters) > 0 and session.waiters[0].done():
+                session.waiters.popleft()
+            if len(session.waiters) == 0:
+                continue
+            if session.in_flight >= self.per_robot_concurrency:
+                self._turns.append(robot_id)
+                skipped += 1
+                continue
+            self._grant(session)
+            session.waiters.popleft().set_result(None)
+            if len(session.waiters) > 0:
+                self._turns.append(robot_id)
+            skipped = 0
+
+    def _retry_after(self, session: RobotSession) -> int:
+        # Time for the robot's queue to drain at its recent pace
+        mean_run_seconds = session.total_run_seconds / session.completed if session.completed > 0 else 1.0
+        return max(1, math.ceil(mean_run_seconds * len(session.waiters) / self.per_robot_concurrency))
+
+    def _expire_sessions(self):
+        cutoff = time.monotonic() - self.session_ttl_seconds
+        for robot_id in [ robot_id for robot_id, session in self._sessions.items() if session.last_seen < cutoff and session.in_flight == 0 and len(session.waiters) == 0 ]:
+            del self._sessions[robot_id]
+
+def robot_id_from_headers(headers: Dict[str, str], tokens: Optional[Dict[str, str]] = None) -> Optional[str]:
+    # A bearer token, when tokens are configured, identifies the robot; otherwise the X-Robot-ID header
+    # does. headers must have lower-case names. Returns None for an unknown token.
+    if tokens:
+        authorization = headers.get("authorization", "")
+        if not authorization.lower().startswith("bearer "):
+            return None
+        return tokens.get(authorization[len("bearer "):].strip())
+    return headers.get(ROBOT_ID_HEADER.lower()) or DEFAULT_ROBOT_ID
+
+def parse_tokens(spec: Optional[str]) -> Dict[str, str]:
+    # "token1:robot1,token2:robot2" -> { token: robot_id }
+    tokens = {}
+    for entry in (spec or "").split(","):
+        if ":" in entry:
+            token, robot_id = entry.split(":", 1)
+            tokens[token.strip()] = robot_id.strip()
+    return tokens
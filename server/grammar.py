@@ -0,0 +1,219 @@
+from typing import List, Optional, Set
+
+from .models import CommandType, Direction, SpotCommand
+from .speech_processor import FEET_TO_METERS
+from .text import FILLER_WORDS, parse_number, tokenize, words_to_numbers
+
+
+####################################################################################################
+# Vocabulary
+####################################################################################################
+
+WALK_VERBS = { "walk", "move", "go", "step", "head", "drive", "back" }
+TURN_VERBS = { "turn", "rotate", "spin", "pivot" }
+STOP_VERBS = { "stop", "halt", "freeze" }
+SIT_VERBS = { "sit", "lie" }
+
+# Words that may follow "stop" ("stop moving", "stop right there") without changing its meaning
+STOP_WORDS = { "moving", "walking", "turning", "it", "everything", "now", "right", "there", "immediately" }
+
+WALK_DIRECTIONS = {
+    "forward": Direction.FORWARD, "forwards": Direction.FORWARD, "ahead": Direction.FORWARD, "straight": Direction.FORWARD,
+    "backward": Direction.BACKWARD, "backwards": Direction.BACKWARD, "back": Direction.BACKWARD, "up": None
+}
+
+TURN_DIRECTIONS = {
+    "left": Direction.LEFT, "counterclockwise": Direction.LEFT, "anticlockwise": Direction.LEFT,
+    "right": Direction.RIGHT, "clockwise": Direction.RIGHT
+}
+
+# Multiplier to convert a distance to meters. Bare numbers are in feet, as in the walk_command tool.
+DISTANCE_UNITS = {
+    "feet": FEET_TO_METERS, "foot": FEET_TO_METERS, "ft": FEET_TO_METERS,
+    "inches": FEET_TO_METERS / 12, "inch": FEET_TO_METERS / 12,
+    "yards": 3 * FEET_TO_METERS, "yard": 3 * FEET_TO_METERS,
+    "meters": 1.0, "meter": 1.0, "metres": 1.0, "metre": 1.0, "m": 1.0
+}
+
+ANGLE_UNITS = { "degrees", "degree", "deg" }
+TIME_UNITS = { "seconds": 1.0, "second": 1.0, "secs": 1.0, "sec": 1.0, "s": 1.0, "minutes": 60.0, "minute": 60.0 }
+
+# Words that may appear between clauses or around the command without changing its meaning
+CONNECTORS = { "then", "and", "after", "that", "next", "also", "finally", "first" }
+POLITE_WORDS = { "spot", "can", "could", "would", "will", "you", "i", "want", "need", "to", "me", "for", "the", "robot" }
+
+DEFAULT_TURN_DEGREES = 90.0
+
+# Precomputed word sets used by the parser
+_CLAUSE_GAP_WORDS = CONNECTORS | POLITE_WORDS
+_WALK_DIRECTION_WORDS = set(WALK_DIRECTIONS)
+_TURN_DIRECTION_WORDS = set(TURN_DIRECTIONS)
+_DISTANCE_OR_TIME_UNITS = set(DISTANCE_UNITS) | set(TIME_UNITS)
+_TIME_UNIT_WORDS = set(TIME_UNITS)
+
+
+####################################################################################################
+# Parser
+####################################################################################################
+
+class _Tokens:
+    def __init__(self, tokens: List[str]):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self, offset: int = 0) -> Optional[str]:
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def accept(self, words: Set[str]) -> Optional[str]:
+        token = self.peek()
+        if token is not None and token in words:
+            self.position += 1
+            return token
+        return None
+
+    def accept_number(self) -> Optional[float]:
+        token = self.peek()
+        value = parse_number(token) if token is not None else None
+        if value is not None:
+            self.position += 1
+        return value
+
+    def skip(self, words: Set[str]):
+        while self.accept(words) is not None:
+            pass
+
+    def done(self) -> bool:
+        return self.position >= len(self.tokens)
+
+def parse_local(text: str) -> Optional[List[SpotCommand]]:
+    # Deterministic parser for the walk/turn/bow/dance/stop/sit commands covered by the LLM tools. Returns None
+    # unless every word of the utterance is accounted for, in which case the LLM should be consulted.
+    tokens = _Tokens([ token for token in words_to_numbers(tokenize(text)) if token not in FILLER_WORDS ])
+    commands = []
+    while True:
+        tokens.skip(_CLAUSE_GAP_WORDS)
+        if tokens.done():
+            break
+        start = tokens.position
+        for parse_clause in (_parse_walk, _parse_turn, _parse_bow, _parse_dance, _parse_stop, _parse_sit):
+            tokens.position = start
+            command = parse_clause(tokens)
+            if command is not None:
+                commands.append(command)
+                break
+        else:
+            return None
+    return commands if len(commands) > 0 else None
+
+def _parse_walk(tokens: _Tokens) -> Optional[SpotCommand]:
+    verb = tokens.accept(WALK_VERBS)
+    if verb is None:
+        return None
+    direction = Direction.BACKWARD if verb == "back" else None
+    distance = None
+    duration = None
+    while not tokens.done():
+        word = tokens.accept(_WALK_DIRECTION_WORDS)
+        if word is not None:
+            if WALK_DIRECTIONS[word] is not None:
+                if direction is not None and direction != WALK_DIRECTIONS[word]:
+                    return None
+                direction = WALK_DIRECTIONS[word]
+            continue
+        if tokens.accept({ "by" }) is not None:
+            continue
+        if tokens.accept({ "for" }) is not None:
+            duration = _parse_duration(tokens)
+            if duration is None:
+                return None
+            continue
+        number = tokens.accept_number()
+        if number is not None:
+            if distance is not None:
+                return None
+            unit = tokens.accept(_DISTANCE_OR_TIME_UNITS)
+            if unit in TIME_UNITS:
+                duration = number * TIME_UNITS[unit]
+            else:
+                distance = number * DISTANCE_UNITS[unit if unit is not None else "feet"]
+            continue
+        break
+    if direction is None:
+        direction = Direction.FORWARD
+    if (distance is None or distance <= 0) and (duration is None or duration <= 0):
+        # "walk forward" with no extent is ambiguous
+        return None
+    return SpotCommand(command=CommandType.WALK, dir=direction, amount=distance or 0.0, duration=duration or 0.0)
+
+def _parse_duration(tokens: _Tokens) -> Optional[float]:
+    number = tokens.accept_number()
+    if number is None:
+        return None
+    unit = tokens.accept(_TIME_UNIT_WORDS)
+    if unit is None:
+        return None
+    return number * TIME_UNITS[unit]
+
+def _parse_turn(tokens: _Tokens) -> Optional[SpotCommand]:
+    if tokens.accept(TURN_VERBS) is None:
+        return None
+    direction = None
+    angle = None
+    while not tokens.done():
+        word = tokens.accept(_TURN_DIRECTION_WORDS)
+        if word is not None:
+            if direction is not None and direction != TURN_DIRECTIONS[word]:
+                return None
+            direction = TURN_DIRECTIONS[word]
+            continue
+        if tokens.accept({ "around" }) is not None:
+            angle = 180.0
+            continue
+        if tokens.accept({ "to", "the", "by" }) is not None:
+            continue
+        number = tokens.accept_number()
+        if number is not None:
+            if angle is not None:
+                return None
+            angle = number
+            tokens.accept(ANGLE_UNITS)
+            continue
+        break
+    if angle is None:
+        if direction is None:
+            return None
+        angle = DEFAULT_TURN_DEGREES
+    # Written so that a nan, which fails every comparison, is rejected too
+    if not 0 < angle <= 360:
+        return None
+    return SpotCommand(command=CommandType.TURN, dir=direction if direction is not None else Direction.UNKNOWN, amount=angle, duration=0.0)
+
+def _parse_bow(tokens: _Tokens) -> Optional[SpotCommand]:
+    if tokens.accept({ "take" }) is not None:
+        tokens.accept({ "a" })
+    if tokens.accept({ "bow" }) is None:
+        return None
+    return SpotCommand(command=CommandType.BOW, dir=Direction.UNKNOWN, amount=0.0, duration=0.0)
+
+def _parse_dance(tokens: _Tokens) -> Optional[SpotCommand]:
+    if tokens.accept({ "do" }) is not None:
+        tokens.accept({ "a" })
+    if tokens.accept({ "dance" }) is None:
+        return None
+    return SpotCommand(command=CommandType.DUST_OFF, dir=Direction.UNKNOWN, amount=0.0, duration=0.0)
+
+def _parse_stop(tokens: _Tokens) -> Optional[SpotCommand]:
+    if tokens.accept(STOP_VERBS) is None:
+        return None
+    tokens.skip(STOP_WORDS)
+    return SpotCommand(command=CommandType.STOP, dir=Direction.UNKNOWN, amount=0.0, duration=0.0)
+
+def _parse_sit(tokens: _Tokens) -> Optional[SpotCommand]:
+    verb = tokens.accept(SIT_VERBS)
+    if verb is None:
+        return None
+    # "sit" alone will do, but not "lie"
+    if tokens.accept({ "down" }) is None and verb == "lie":
+        return None
+    return SpotCommand(command=CommandType.SIT, dir=Direction.UNKNOWN, amount=0.0, duration=0.0)
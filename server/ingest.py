@@ -0,0 +1,112 @@
+from io import BytesIO
+import os
+import tempfile
+from typing import AsyncIterator, BinaryIO, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+
+# Uploads are received in chunks and held in memory up to spool_bytes, then spooled to a temporary
+# file, so a request holds at most spool_bytes of audio in memory however long the recording is
+DEFAULT_MAX_UPLOAD_BYTES = 25 * 1024 * 1024       # Whisper's own limit
+DEFAULT_SPOOL_BYTES = 1024 * 1024
+DEFAULT_MAX_AUDIO_SECONDS = 60.0
+CHUNK_BYTES = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+class AudioUpload:
+    # Received audio, readable any number of times, concurrently (e.g. by a primary and a hedged
+    # transcription backend). Readers get the in-memory bytes without copying them, or their own handle
+    # on the spooled file. close() removes the spooled file; readers already open can finish reading.
+    def __init__(self, filename: str, max_bytes: int = DEFAULT_MAX_UPLOAD_BYTES, spool_bytes: int = DEFAULT_SPOOL_BYTES):
+        self.filename = filename            # the extension identifies the format
+        self.max_bytes = max_bytes
+        self.spool_bytes = spool_bytes
+        self.size = 0
+        self._chunks: List[bytes] = []
+        self._data: Optional[bytes] = None
+        self._file: Optional[BinaryIO] = None
+
+    @classmethod
+    def from_bytes(cls, data: bytes, filename: str) -> "AudioUpload":
+        upload = cls(filename=filename, max_bytes=len(data), spool_bytes=len(data))
+        upload._data = data
+        upload.size = len(data)
+        return upload
+
+    @property
+    def spooled(self) -> bool:
+        return self._file is not None
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+        if self._file is not None:
+            self._file.write(chunk)
+        elif self.size > self.spool_bytes:
+            self._file = tempfile.NamedTemporaryFile(suffix=os.path.splitext(self.filename)[1], delete=False)
+            for buffered in self._chunks:
+                self._file.write(buffered)
+            self._file.write(chunk)
+            self._chunks = []
+        else:
+            self._chunks.append(chunk)
+
+    def finish(self):
+        if self._file is not None:
+            self._file.flush()
+        else:
+            self._data = b"".join(self._chunks)
+            self._chunks = []
+
+    def open(self) -> BinaryIO:
+        # A reader positioned at the start, named after the upload so backends can tell the format
+        if self._file is not None:
+            return open(self._file.name, "rb")     # the spooled file has the upload's extension
+        reader = BytesIO(self._data)               # shares the bytes object rather than copying it
+        reader.name = self.filename
+        return reader
+
+    def duration(self) -> Optional[float]:
+        # Seconds of audio, or None for formats whose header cannot be read without decoding
+        try:
+            import soundfile
+            with self.open() as reader:
+                return soundfile.info(reader).duration
+        except Exception:
+            return None
+
+    def close(self):
+        self._data = None
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.unlink(self._file.name)
+            except OSError:
+                pass
+            self._file = None
+
+async def receive(chunks: AsyncIterator[bytes], upload: AudioUpload) -> AudioUpload:
+    # Raises UploadTooLarge as soon as the limit is crossed, without reading the rest of the body
+    try:
+        async for chunk in chunks:
+            if len(chunk) == 0:
+                continue
+            # Chunks held in memory are appended in place; anything that goes to the spooled file is
+            # written on a worker thread, so a slow disk does not stall the event loop
+            if upload.spooled or upload.size + len(chunk) > upload.spool_bytes:
+                await run_in_threadpool(upload.write, chunk)
+            else:
+                upload.write(chunk)
+        if upload.spooled:
+            await run_in_threadpool(upload.finish)
+        else:
+            upload.finish()
+        return upload
+    except BaseException:
+        upload.close()
+        raise
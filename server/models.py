@@ -1,13 +1,38 @@
 from enum import Enum
-from typing import List
+from typing import List, Optional
 
-from pydantic import BaseModel, ValidationError, Field
+from pydantic import BaseModel, ValidationError, Field, TypeAdapter
 
+class CommandType(str, Enum):
+    WALK = "WALK"
+    TURN = "TURN"
+    BOW = "BOW"
+    DUST_OFF = "DUST_OFF"
+    STOP = "STOP"
+    SIT = "SIT"
+
+class Direction(str, Enum):
+    FORWARD = "forward"
+    BACKWARD = "backward"
+    LEFT = "left"
+    RIGHT = "right"
+    UNKNOWN = "unknown"
+
+    @classmethod
+    def _missing_(cls, value):
+        # Anything the LLM invents is treated as unspecified rather than failing the whole request
+        return cls.UNKNOWN
+
+# Serializes exactly as the untyped command did ("WALK", "forward", ...), so the JSON is unchanged
 class SpotCommand(BaseModel):
-    command: str
-    dir: str
-    amount: float
-    duration: float
+    command: CommandType
+    dir: Direction
+    amount: float       # meters for WALK, degrees for TURN
+    duration: float     # seconds
+
+# Validates a whole list of commands in one call, e.g. when loading or decoding them, rather than one
+# model at a time
+SPOT_COMMANDS = TypeAdapter(List[SpotCommand])
 
 
 class TranscriptionResponse(BaseModel):
@@ -15,3 +40,65 @@ class TranscriptionResponse(BaseModel):
 
 class ProcessSpeechResponse(BaseModel):
     commands: List[SpotCommand]
+
+class VoiceCommandResponse(BaseModel):
+    text: str
+    commands: List[SpotCommand]
+
+class VoiceCommandEventType(str, Enum):
+    TRANSCRIPT = "transcript"
+    COMMAND = "command"
+    COMMANDS = "commands"
+    ERROR = "error"
+
+# One line of an NDJSON /voice_command or /process_speech response: the transcript (voice commands
+# only), then each command as soon as it is parsed, then all of the commands together
+class VoiceCommandEvent(BaseModel):
+    type: VoiceCommandEventType
+    text: Optional[str] = None
+    command: Optional[SpotCommand] = None
+    commands: Optional[List[SpotCommand]] = None
+
+class BackendStats(BaseModel):
+    name: str
+    max_concurrency: int
+    queue_depth: int
+    peak_queue_depth: int
+    in_flight: int
+    completed: int
+    failed: int
+    mean_wait_seconds: float
+    mean_run_seconds: float
+
+class CacheStats(BaseModel):
+    entries: int
+    max_entries: int
+    hits: int
+    misses: int
+    evictions: int
+
+class RobotSessionStats(BaseModel):
+    robot_id: str
+    in_flight: int
+    queue_depth: int
+    peak_queue_depth: int
+    admitted: int
+    rejected: int
+    completed: int
+    mean_wait_seconds: float
+    mean_run_seconds: float
+
+class TranscriptionStats(BaseModel):
+    primary: str
+    secondary: Optional[str]
+    hedge_delay_seconds: float
+    requests: int
+    hedged: int
+    secondary_wins: int
+    failovers: int
+
+class StatusResponse(BaseModel):
+    backends: List[BackendStats]
+    command_cache: CacheStats
+    sessions: List[RobotSessionStats]
+    transcription: TranscriptionStats
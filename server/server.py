@@ -1,9 +1,11 @@
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime
 from enum import Enum
 from io import BytesIO
 import os
 import traceback
-from typing import List, Optional, Annotated
+from typing import AsyncIterator, Dict, List, Optional, Annotated
 
 import openai
 from pydantic import BaseModel, ValidationError, Field
@@ -11,17 +13,126 @@ from fastapi import FastAPI, status, Form, UploadFile, Depends, Request
 from pydantic import BaseModel, ValidationError
 from fastapi.exceptions import HTTPException
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import State
 
-from server.models import TranscriptionResponse, ProcessSpeechResponse
-from server.transcription import transcribe
-from server.speech_processor import process_speech
+from server.backends import BackendExecutor
+from server.command_cache import CommandCache
+from server.context import ContextStore, Conversation, is_context_dependent
+from server.fleet import DEFAULT_ROBOT_ID, FleetOverloaded, FleetScheduler, parse_tokens, robot_id_from_headers
+from server.grammar import parse_local
+from server.ingest import CHUNK_BYTES, DEFAULT_MAX_AUDIO_SECONDS, DEFAULT_MAX_UPLOAD_BYTES, DEFAULT_SPOOL_BYTES, AudioUpload, UploadTooLarge, receive
+from server.models import TranscriptionResponse, ProcessSpeechResponse, VoiceCommandResponse, VoiceCommandEvent, VoiceCommandEventType, StatusResponse, SpotCommand
+from server.transcription import HedgedTranscriber, TranscriptionBackend, WhisperBackend, audio_filename, create_backend
+from server.speech_processor import process_speech, process_speech_stream
+from server.wire import COMMANDS_MEDIA_TYPE, encode_commands
+from server.tracing import CORRELATION_HEADER, METRICS_CONTENT_TYPE, correlation_id, new_correlation_id, render_metrics, span
 
 
 ####################################################################################################
 # Server API 
 ####################################################################################################
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    if hasattr(app.state, "command_cache"):
+        app.state.command_cache.save()
+
+class TracingMiddleware:
+    # Adopts the caller's correlation ID (or assigns one) for the duration of the request, echoes it in
+    # the response headers, and times the request. Plain ASGI rather than BaseHTTPMiddleware so that
+    # the context variable is visible to handlers and streamed responses.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        header = CORRELATION_HEADER.lower().encode("latin-1")
+        requested = next((value.decode("latin-1") for name, value in scope["headers"] if name == header), None)
+        token = correlation_id.set(requested or new_correlation_id())
+
+        async def send_with_correlation_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [ (header, correlation_id.get().encode("latin-1")) ]
+            await send(message)
+
+        try:
+            with span(f"http.{scope['path'].strip('/')}"):
+                await self.app(scope, receive, send_with_correlation_id)
+        finally:
+            correlation_id.reset(token)
+
+class FleetMiddleware:
+    # Admits speech requests through the fleet scheduler, identifying the robot by its token or
+    # X-Robot-ID header. The slot is held until the response (including a streamed one) is complete.
+    FLEET_PATHS = { "/transcribe", "/process_speech", "/voice_command" }
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.FLEET_PATHS:
+            await self.app(scope, receive, send)
+            return
+        state = scope["app"].state
+        headers = { name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"] }
+        robot_id = robot_id_from_headers(headers=headers, tokens=state.fleet_tokens)
+        if robot_id is None:
+            await JSONResponse({ "detail": "Unknown robot token" }, status_code=status.HTTP_401_UNAUTHORIZED)(scope, receive, send)
+            return
+        scope.setdefault("state", {})["robot_id"] = robot_id
+        try:
+            async with state.fleet.admit(robot_id):
+                await self.app(scope, receive, send)
+        except FleetOverloaded as e:
+            response = JSONResponse({ "detail": str(e) }, status_code=status.HTTP_429_TOO_MANY_REQUESTS, headers={ "Retry-After": str(e.retry_after) })
+            await response(scope, receive, send)
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(FleetMiddleware)
+app.add_middleware(TracingMiddleware)       # outermost, so rejected requests are traced too
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def configure(
+    openai_client: openai.OpenAI,
+    whisper_concurrency: int = 8,
+    chat_concurrency: int = 8,
+    command_cache: Optional[CommandCache] = None,
+    fleet: Optional[FleetScheduler] = None,
+    fleet_tokens: Optional[Dict[str, str]] = None,
+    context_store: Optional[ContextStore] = None,
+    transcription_backend: Optional[TranscriptionBackend] = None,
+    hedge_backend: Optional[TranscriptionBackend] = None,
+    max_upload_bytes: int = DEFAULT_MAX_UPLOAD_BYTES,
+    spool_bytes: int = DEFAULT_SPOOL_BYTES,
+    max_audio_seconds: float = DEFAULT_MAX_AUDIO_SECONDS
+):
+    # Blocking OpenAI calls run on per-backend thread pools, so requests are served concurrently up to
+    # each backend's limit rather than serialized on the event loop. When fleet_tokens is given, robots
+    # must present one of them as a bearer token instead of naming themselves. Transcription uses
+    # Whisper unless another backend is given; with a hedge backend, slow transcriptions are also sent
+    # there (whisper_concurrency sizes both backends' pools).
+    app.state.openai_client = openai_client
+    transcription_backend = transcription_backend if transcription_backend is not None else WhisperBackend(client=openai_client)
+    app.state.transcriber = HedgedTranscriber(
+        primary=transcription_backend,
+        primary_executor=BackendExecutor(name=transcription_backend.name, max_concurrency=whisper_concurrency),
+        secondary=hedge_backend,
+        secondary_executor=BackendExecutor(name=hedge_backend.name, max_concurrency=whisper_concurrency) if hedge_backend is not None else None
+    )
+    app.state.chat_backend = BackendExecutor(name="chat", max_concurrency=chat_concurrency)
+    app.state.command_cache = command_cache if command_cache is not None else CommandCache()
+    app.state.fleet = fleet if fleet is not None else FleetScheduler(max_concurrency=max(whisper_concurrency, chat_concurrency))
+    app.state.fleet_tokens = fleet_tokens or None
+    app.state.context_store = context_store if context_store is not None else ContextStore()
+    app.state.max_upload_bytes = max_upload_bytes
+    app.state.spool_bytes = spool_bytes
+    app.state.max_audio_seconds = max_audio_seconds
 
 class Checker:
     def __init__(self, model: BaseModel):
@@ -38,19 +149,207 @@ class Checker:
 
 @app.post("/transcribe")
 async def api_transcribe(request: Request, audio: UploadFile = None):
+    upload = await _receive_audio(request=request, audio=audio)
     try:
-        return TranscriptionResponse(text=transcribe(client=request.app.state.openai_client, audio_bytes=await audio.read()))
+        return TranscriptionResponse(text=await _transcribe(state=request.app.state, upload=upload))
     except Exception as e:
         print(f"{traceback.format_exc()}")
         raise HTTPException(400, detail=f"{str(e)}: {traceback.format_exc()}")
+    finally:
+        upload.close()
     
 @app.post("/process_speech")
-async def api_process_speech(request: Request, text: Annotated[str, Form()]):
+async def api_process_speech(request: Request, text: Annotated[str, Form()], stream: Annotated[bool, Form()] = False):
+    # Streaming clients receive each command as soon as it has been parsed, so they can start executing
+    # the first while the LLM is still generating the rest
+    if _wants_stream(request=request, stream=stream):
+        return StreamingResponse(_stream_process_speech(state=request.app.state, text=text, session_id=_session_id(request)), media_type=NDJSON_MEDIA_TYPE)
+    try:
+        commands = await _process_speech(state=request.app.state, text=text, session_id=_session_id(request))
+    except Exception as e:
+        print(f"{traceback.format_exc()}")
+        raise HTTPException(400, detail=f"{str(e)}: {traceback.format_exc()}")
+    # Clients that accept the binary command encoding get it in place of JSON
+    if COMMANDS_MEDIA_TYPE in request.headers.get("accept", ""):
+        return Response(content=encode_commands(commands), media_type=COMMANDS_MEDIA_TYPE)
+    return ProcessSpeechResponse(commands=commands)
+
+@app.post("/voice_command")
+async def api_voice_command(request: Request, audio: UploadFile = None, stream: Annotated[bool, Form()] = False):
+    # Transcription and command parsing in a single round trip. Clients that send stream=true or accept
+    # NDJSON receive the transcript as soon as it is available, followed by each command as it is parsed.
+    state = request.app.state
+    upload = await _receive_audio(request=request, audio=audio)
+    if _wants_stream(request=request, stream=stream):
+        return StreamingResponse(_stream_voice_command(state=state, upload=upload, session_id=_session_id(request)), media_type=NDJSON_MEDIA_TYPE)
     try:
-        return ProcessSpeechResponse(commands=process_speech(client=request.app.state.openai_client, text=text))
+        text = await _transcribe(state=state, upload=upload)
+        commands = await _process_speech(state=state, text=text, session_id=_session_id(request)) if len(text.strip()) > 0 else []
+        return VoiceCommandResponse(text=text, commands=commands)
     except Exception as e:
         print(f"{traceback.format_exc()}")
         raise HTTPException(400, detail=f"{str(e)}: {traceback.format_exc()}")
+    finally:
+        upload.close()
+
+@app.get("/status")
+async def api_status(request: Request):
+    state = request.app.state
+    return StatusResponse(
+        backends=[ executor.stats() for executor in state.transcriber.executors() ] + [ state.chat_backend.stats() ],
+        command_cache=state.command_cache.stats(),
+        sessions=state.fleet.stats(),
+        transcription=state.transcriber.stats()
+    )
+
+@app.get("/metrics")
+async def api_metrics():
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+def _session_id(request: Request) -> str:
+    # Conversations are per robot, as identified by the fleet middleware
+    return getattr(request.state, "robot_id", DEFAULT_ROBOT_ID)
+
+def _wants_stream(request: Request, stream: bool) -> bool:
+    # Raw-body uploads have no form fields, so they ask for streaming in the query string
+    return stream or request.query_params.get("stream", "").lower() in ("1", "true") or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def _upload_filename(filename: Optional[str], content_type: Optional[str]) -> str:
+    try:
+        return audio_filename(filename=filename, content_type=content_type)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+
+async def _receive_audio(request: Request, audio: Optional[UploadFile]) -> AudioUpload:
+    # Audio arrives either as the raw request body with an audio/* content type (or a filename query
+    # parameter naming the format), which is read as it streams in, or as a multipart "audio" field.
+    # Either way it is copied in chunks into a spool that keeps at most spool_bytes in memory, and
+    # uploads over the size or duration limits are rejected with 413 as soon as that is known.
+    state = request.app.state
+    if audio is not None:
+        filename = _upload_filename(filename=audio.filename, content_type=audio.content_type)
+        chunks = _read_chunks(audio)
+    else:
+        filename = _upload_filename(filename=request.query_params.get("filename"), content_type=request.headers.get("content-type"))
+        content_length = request.headers.get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > state.max_upload_bytes:
+            raise HTTPException(413, detail=f"Upload exceeds {state.max_upload_bytes} bytes")
+        chunks = request.stream()
+    with span("server.receive"):
+        try:
+            upload = await receive(chunks=chunks, upload=AudioUpload(filename=filename, max_bytes=state.max_upload_bytes, spool_bytes=state.spool_bytes))
+        except UploadTooLarge as e:
+            raise HTTPException(413, detail=str(e))
+    if upload.size == 0:
+        upload.close()
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="No audio uploaded")
+    # Reads the header, from the spooled file for large uploads
+    duration = await run_in_threadpool(upload.duration) if upload.spooled else upload.duration()
+    if duration is not None and duration > state.max_audio_seconds:
+        upload.close()
+        raise HTTPException(413, detail=f"Audio is {duration:.1f} s long, the limit is {state.max_audio_seconds:g} s")
+    return upload
+
+async def _read_chunks(audio: UploadFile) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await audio.read(CHUNK_BYTES)
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+async def _transcribe(state: State, upload: AudioUpload) -> str:
+    with span("server.transcribe"):
+        return await state.transcriber.transcribe(upload=upload)
+
+def _resolve_without_llm(state: State, text: str, conversation: Conversation) -> Optional[List[SpotCommand]]:
+    # Simple commands are parsed locally, and repeated phrases are answered from the cache. Phrases that
+    # refer back to earlier commands bypass the cache, since the same words can mean something different
+    # each time.
+    with span("server.parse_local"):
+        commands = parse_local(text)
+    if commands is not None:
+        print(f"Parsed locally: {commands}")
+    elif not is_context_dependent(text):
+        commands = state.command_cache.get(text)
+    if commands is not None:
+        conversation.add_resolved(text=text, commands=commands)
+    return commands
+
+def _cache_commands(state: State, text: str, commands: List[SpotCommand]):
+    if not is_context_dependent(text):
+        state.command_cache.put(text, commands)
+
+async def _process_speech(state: State, text: str, session_id: str = DEFAULT_ROBOT_ID) -> List[SpotCommand]:
+    # Only what cannot be resolved locally goes to the LLM, along with the session's conversation so far
+    conversation = state.context_store.get(session_id)
+    commands = _resolve_without_llm(state=state, text=text, conversation=conversation)
+    if commands is not None:
+        return commands
+    with span("server.process_speech"):
+        commands = await state.chat_backend.run(process_speech, client=state.openai_client, text=text, conversation=conversation)
+    _cache_commands(state=state, text=text, commands=commands)
+    return commands
+
+async def _stream_commands(state: State, text: str, session_id: str = DEFAULT_ROBOT_ID) -> AsyncIterator[SpotCommand]:
+    # As _process_speech, but yields each command the LLM produces as soon as its tool call is complete.
+    # The completion streams on the chat backend's thread, which hands commands over to the event loop.
+    conversation = state.context_store.get(session_id)
+    commands = _resolve_without_llm(state=state, text=text, conversation=conversation)
+    if commands is not None:
+        for command in commands:
+            yield command
+        return
+    loop = asyncio.get_running_loop()
+    received: asyncio.Queue = asyncio.Queue()
+
+    def on_command(command: SpotCommand):
+        loop.call_soon_threadsafe(received.put_nowait, command)
+
+    with span("server.process_speech"):
+        completion = asyncio.ensure_future(state.chat_backend.run(
+            process_speech_stream, client=state.openai_client, text=text, conversation=conversation, on_command=on_command
+        ))
+        # Runs after every command handed over by the thread, so None marks the end
+        completion.add_done_callback(lambda _: received.put_nowait(None))
+        while True:
+            command = await received.get()
+            if command is None:
+                break
+            yield command
+        commands = completion.result()
+    _cache_commands(state=state, text=text, commands=commands)
+
+async def _command_events(state: State, text: str, session_id: str) -> AsyncIterator[str]:
+    commands = []
+    if len(text.strip()) > 0:
+        async for command in _stream_commands(state=state, text=text, session_id=session_id):
+            commands.append(command)
+            yield _ndjson_line(VoiceCommandEvent(type=VoiceCommandEventType.COMMAND, command=command))
+    yield _ndjson_line(VoiceCommandEvent(type=VoiceCommandEventType.COMMANDS, commands=commands))
+
+async def _stream_process_speech(state: State, text: str, session_id: str) -> AsyncIterator[str]:
+    # The response status is already sent once streaming begins, so failures are reported in-band
+    try:
+        async for line in _command_events(state=state, text=text, session_id=session_id):
+            yield line
+    except Exception as e:
+        print(f"{traceback.format_exc()}")
+        yield _ndjson_line(VoiceCommandEvent(type=VoiceCommandEventType.ERROR, text=str(e)))
+
+async def _stream_voice_command(state: State, upload: AudioUpload, session_id: str) -> AsyncIterator[str]:
+    try:
+        text = await _transcribe(state=state, upload=upload)
+        yield _ndjson_line(VoiceCommandEvent(type=VoiceCommandEventType.TRANSCRIPT, text=text))
+        async for line in _command_events(state=state, text=text, session_id=session_id):
+            yield line
+    except Exception as e:
+        print(f"{traceback.format_exc()}")
+        yield _ndjson_line(VoiceCommandEvent(type=VoiceCommandEventType.ERROR, text=str(e)))
+    finally:
+        upload.close()
+
+def _ndjson_line(event: VoiceCommandEvent) -> str:
+    return event.model_dump_json(exclude_none=True) + "\n"
 
 
 ####################################################################################################
@@ -62,9 +361,35 @@ if __name__ == "__main__":
     # parser = argparse.ArgumentParser()
     # options = parser.parse_args()
 
-    # Instantiate a vision provider
+    # Instantiate OpenAI client and backend thread pools. TRANSCRIPTION_BACKEND and HEDGE_BACKEND are
+    # one of "whisper", "deepgram" or "stub".
     openai_client = openai.OpenAI()
-    app.state.openai_client = openai_client
+    hedge_backend = os.getenv("HEDGE_BACKEND")
+    configure(
+        openai_client=openai_client,
+        whisper_concurrency=int(os.getenv("WHISPER_CONCURRENCY", 8)),
+        chat_concurrency=int(os.getenv("CHAT_CONCURRENCY", 8)),
+        command_cache=CommandCache(
+            max_entries=int(os.getenv("COMMAND_CACHE_SIZE", 1024)),
+            ttl_seconds=float(os.getenv("COMMAND_CACHE_TTL", 7 * 24 * 3600)),
+            path=os.getenv("COMMAND_CACHE_PATH")
+        ),
+        fleet=FleetScheduler(
+            max_concurrency=int(os.getenv("FLEET_MAX_CONCURRENCY", 16)),
+            per_robot_concurrency=int(os.getenv("ROBOT_MAX_CONCURRENCY", 4)),
+            max_queue_per_robot=int(os.getenv("ROBOT_MAX_QUEUE", 8))
+        ),
+        fleet_tokens=parse_tokens(os.getenv("FLEET_TOKENS")),    # "token:robot_id,..."
+        context_store=ContextStore(
+            max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", 1200)),
+            ttl_seconds=float(os.getenv("CONTEXT_TTL", 600))
+        ),
+        transcription_backend=create_backend(os.getenv("TRANSCRIPTION_BACKEND", "whisper"), openai_client=openai_client),
+        hedge_backend=create_backend(hedge_backend, openai_client=openai_client) if hedge_backend else None,
+        max_upload_bytes=int(os.getenv("MAX_UPLOAD_BYTES", DEFAULT_MAX_UPLOAD_BYTES)),
+        spool_bytes=int(os.getenv("UPLOAD_SPOOL_BYTES", DEFAULT_SPOOL_BYTES)),
+        max_audio_seconds=float(os.getenv("MAX_AUDIO_SECONDS", DEFAULT_MAX_AUDIO_SECONDS))
+    )
 
     # Run server
     import uvicorn
@@ -1,16 +1,23 @@
 from enum import Enum
 import json
-from typing import List
+import time
+from typing import Callable, List, Optional
 
 import openai
 from pydantic import BaseModel, ValidationError, Field
 
-from .models import SpotCommand
+from .context import Conversation, assistant_message, describe_commands
+from .models import CommandType, Direction, SpotCommand
+from .tracing import record, span
 
 
+FEET_TO_METERS = 0.3048
+
 SYSTEM_MESSAGE = """
 You are a quadrupedal robot named Spot created by Boston Dynamics. You listen for commands from the
-user, which always mention your name, and output a list of command strings directly. 
+user, which always mention your name, and output a list of command strings directly. The earlier
+conversation shows what you have already been asked and done; use it to resolve references such as
+"do that again" or "turn back".
 """
 
 TOOLS = [
@@ -76,6 +83,20 @@ TOOLS = [
             "description": "Produces command object for dancing",
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "stop_command",
+            "description": "Produces command object for stopping all motion immediately",
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "sit_command",
+            "description": "Produces command object for stopping and sitting down",
+        },
+    },
 ]
 
 class Role(str, Enum):
@@ -87,101 +108,216 @@ class Message(BaseModel):
     role: Role
     content: str
 
+PROMPT_PREFIX = [ Message(role=Role.SYSTEM, content=SYSTEM_MESSAGE).model_dump(mode="json") ]
 
-def process_speech(client: openai.OpenAI, text: str) -> List[SpotCommand]:
+
+def process_speech(client: openai.OpenAI, text: str, conversation: Optional[Conversation] = None) -> List[SpotCommand]:
+    # The system message and tool schema lead every request unchanged, followed by the conversation's
+    # history, so successive requests share a prefix the API can reuse. The exchange, tool responses
+    # included, is added to the conversation afterwards.
     model = "gpt-3.5-turbo"
 
-    message_history = [
-        Message(role=Role.SYSTEM, content=SYSTEM_MESSAGE),
-        Message(role=Role.USER, content=text)
-    ]
+    user_message = Message(role=Role.USER, content=text).model_dump(mode="json")
+    history = conversation.messages() if conversation is not None else []
+    message_history = PROMPT_PREFIX + history + [ user_message ]
     
-    first_response = client.chat.completions.create(
-        model=model,
-        messages=message_history,
-        tools=TOOLS,
-        tool_choice="auto"
-    )
+    with span("llm.chat_completion"):
+        first_response = client.chat.completions.create(
+            model=model,
+            messages=message_history,
+            tools=TOOLS,
+            tool_choice="auto"
+        )
     first_response_message = first_response.choices[0].message
+    turn = [ user_message, assistant_message(first_response_message) ]
 
     # Handle tool requests
-    commands = []
-    available_functions = {
-        "walk_command": _handle_walk_command,
-        "turn_command": _handle_turn_command,
-        "bow_command": _handle_bow_command,
-        "dance_command": _handle_dance_command,
-    }
+    spot_commands = []
     if first_response_message.tool_calls:
-        # Append initial response to history, which may include tool use
-        message_history.append(first_response_message)
-        
         # Call tools
         for tool_call in first_response_message.tool_calls:
-            # Determine which tool and what arguments to call with
-            function_name = tool_call.function.name
-            function_to_call = available_functions.get(function_name)
-            function_args = json.loads(tool_call.function.arguments)
-            print(f"Function Name={function_name}, Args={function_args}")
-
-            # Call the tool
-            function_response = function_to_call(**function_args)
-            commands.append(function_response)
-            
-            # Append function response for GPT to continue
-            message_history.append(
-                {
-                    "tool_call_id": tool_call.id,
-                    "role": "tool",
-                    "name": function_name,
-                    "content": function_response,
-                }
-            )
-
-        response = "\n".join(commands)
-        print(f"Response:\n{response}")
-
-    return parse_commands(command_strings=commands)
-
-def _handle_walk_command(direction: str, distance: float, duration: float) -> str:
-    return f"WALK {direction} {distance} {duration}"
-
-def _handle_turn_command(direction: str, angle: float) -> str:
-    return f"TURN {direction} {angle}"
-
-def _handle_bow_command() -> str:
-    return f"BOW"
-
-def _handle_dance_command() -> str:
-    return f"DUST_OFF"
-
-def parse_float(text: str) -> float:
+            command = _call_tool(function_name=tool_call.function.name, arguments=tool_call.function.arguments)
+            if command is not None:
+                spot_commands.append(command)
+
+            # Append function response, which later turns can refer back to
+            turn.append(_tool_message(tool_call_id=tool_call.id, function_name=tool_call.function.name, command=command))
+
+        print(f"Response: {describe_commands(spot_commands)}")
+
+    if conversation is not None:
+        conversation.add_turn(messages=turn, commands=spot_commands)
+    return spot_commands
+
+class _StreamedToolCall:
+    __slots__ = ("id", "name", "arguments", "command", "finished")
+
+    def __init__(self):
+        self.id = ""
+        self.name = ""
+        self.arguments = ""
+        self.command: Optional[SpotCommand] = None
+        self.finished = False     # set once the call has been executed
+
+def process_speech_stream(
+    client: openai.OpenAI,
+    text: str,
+    conversation: Optional[Conversation] = None,
+    on_command: Optional[Callable[[SpotCommand], None]] = None
+) -> List[SpotCommand]:
+    # Like process_speech, but the completion is streamed and each tool call is executed as soon as its
+    # arguments are complete, so on_command receives the first command while the rest are still being
+    # generated. Called on the backend thread; returns every command once the completion finishes.
+    model = "gpt-3.5-turbo"
+
+    user_message = Message(role=Role.USER, content=text).model_dump(mode="json")
+    history = conversation.messages() if conversation is not None else []
+    message_history = PROMPT_PREFIX + history + [ user_message ]
+
+    content = []
+    tool_calls: List[_StreamedToolCall] = []
+    spot_commands = []
+
+    def finish(tool_call: _StreamedToolCall):
+        if tool_call.finished:
+            return
+        tool_call.finished = True
+        tool_call.command = _call_tool(function_name=tool_call.name, arguments=tool_call.arguments)
+        if tool_call.command is not None:
+            spot_commands.append(tool_call.command)
+            if on_command is not None:
+                on_command(tool_call.command)
+
+    with span("llm.chat_completion"):
+        started_at = time.perf_counter()
+        stream = client.chat.completions.create(
+            model=model,
+            messages=message_history,
+            tools=TOOLS,
+            tool_choice="auto",
+            stream=True
+        )
+        for chunk in stream:
+            if started_at is not None:
+                record("llm.first_chunk", time.perf_counter() - started_at)
+                started_at = None
+            if len(chunk.choices) == 0:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                content.append(delta.content)
+            for tool_delta in delta.tool_calls or []:
+                while len(tool_calls) <= tool_delta.index:
+                    tool_calls.append(_StreamedToolCall())
+                tool_call = tool_calls[tool_delta.index]
+                if tool_delta.id:
+                    tool_call.id = tool_delta.id
+                if tool_delta.function is not None:
+                    tool_call.name += tool_delta.function.name or ""
+                    tool_call.arguments += tool_delta.function.arguments or ""
+                # A call's arguments are complete once they parse, or once the next call has begun
+                for earlier in tool_calls[:tool_delta.index]:
+                    finish(earlier)
+                if _is_complete_json(tool_call.arguments):
+                    finish(tool_call)
+        for tool_call in tool_calls:
+            finish(tool_call)
+
+    if len(tool_calls) > 0:
+        print(f"Response: {describe_commands(spot_commands)}")
+
+    if conversation is not None:
+        assistant = { "role": "assistant", "content": "".join(content) or None }
+        if len(tool_calls) > 0:
+            assistant["tool_calls"] = [
+                { "id": tool_call.id, "type": "function", "function": { "name": tool_call.name, "arguments": tool_call.arguments } }
+                for tool_call in tool_calls
+            ]
+        turn = [ user_message, assistant ] + [
+            _tool_message(tool_call_id=tool_call.id, function_name=tool_call.name, command=tool_call.command)
+            for tool_call in tool_calls
+        ]
+        conversation.add_turn(messages=turn, commands=spot_commands)
+    return spot_commands
+
+def _is_complete_json(arguments: str) -> bool:
+    if not arguments.rstrip().endswith("}"):
+        return False
     try:
-        return float(text)
-    except:
-        return 0
+        return isinstance(json.loads(arguments), dict)
+    except ValueError:
+        return False
+
+def _call_tool(function_name: str, arguments: str) -> Optional[SpotCommand]:
+    # Determine which tool and what arguments to call with. Tools without parameters may be called
+    # with empty arguments. Returns None for a call that does not amount to a command.
+    function_to_call = AVAILABLE_FUNCTIONS.get(function_name)
+    try:
+        function_args = json.loads(arguments) if len(arguments.strip()) > 0 else {}
+    except ValueError as e:
+        # e.g. a streamed call cut off by the end of the completion; the other calls still count
+        print(f"Skipping {function_name} call with malformed arguments {arguments!r}: {e}")
+        return None
+    print(f"Function Name={function_name}, Args={function_args}")
+    if function_to_call is None or not isinstance(function_args, dict):
+        return None
+
+    # Call the tool
+    with span(f"llm.tool.{function_name}"):
+        try:
+            return function_to_call(**function_args)
+        except TypeError:
+            # Missing or unexpected arguments
+            return None
+
+def _tool_message(tool_call_id: str, function_name: str, command: Optional[SpotCommand]) -> dict:
+    return {
+        "tool_call_id": tool_call_id,
+        "role": "tool",
+        "name": function_name,
+        "content": describe_commands([ command ] if command is not None else []),
+    }
 
-def parse_commands(command_strings: List[str]) -> List[SpotCommand]:
-    commands = []
-    for command_string in command_strings:
-        parts = command_string.split(" ")
-        if len(parts) <= 0:
-            continue
-        if parts[0] == "WALK":
-            if len(parts) == 4:
-                amount = parse_float(parts[2]) * 0.3048
-                duration = parse_float(parts[3])
-                if amount <= 0 and duration <= 0:
-                    continue
-                commands.append(SpotCommand(command="WALK", dir=parts[1], amount=amount, duration=duration))
-        elif parts[0] == "TURN":
-            if len(parts) == 3: 
-                amount = parse_float(parts[2])
-                if amount <= 0:
-                    continue
-                commands.append(SpotCommand(command="TURN", dir=parts[1], amount=amount, duration=0))
-        elif parts[0] == "BOW":
-            commands.append(SpotCommand(command="BOW", dir="unknown", amount=0, duration=0))
-        elif parts[0] == "DUST_OFF":
-            commands.append(SpotCommand(command="DUST_OFF", dir="unknown", amount=0, duration=0))
-    return commands
\ No newline at end of file
+# The handlers build commands straight from the tool arguments, with no intermediate text form.
+# Directions the schema does not allow become Direction.UNKNOWN; calls that would not move the robot
+# produce no command.
+
+def _handle_walk_command(direction: str, distance: float, duration: float) -> Optional[SpotCommand]:
+    amount = parse_float(distance) * FEET_TO_METERS
+    duration = parse_float(duration)
+    if amount <= 0 and duration <= 0:
+        return None
+    return SpotCommand(command=CommandType.WALK, dir=Direction(direction), amount=amount, duration=duration)
+
+def _handle_turn_command(direction: str, angle: float) -> Optional[SpotCommand]:
+    amount = parse_float(angle)
+    if amount <= 0:
+        return None
+    return SpotCommand(command=CommandType.TURN, dir=Direction(direction), amount=amount, duration=0.0)
+
+def _handle_bow_command() -> SpotCommand:
+    return SpotCommand(command=CommandType.BOW, dir=Direction.UNKNOWN, amount=0.0, duration=0.0)
+
+def _handle_dance_command() -> SpotCommand:
+    return SpotCommand(command=CommandType.DUST_OFF, dir=Direction.UNKNOWN, amount=0.0, duration=0.0)
+
+def _handle_stop_command() -> SpotCommand:
+    return SpotCommand(command=CommandType.STOP, dir=Direction.UNKNOWN, amount=0.0, duration=0.0)
+
+def _handle_sit_command() -> SpotCommand:
+    return SpotCommand(command=CommandType.SIT, dir=Direction.UNKNOWN, amount=0.0, duration=0.0)
+
+AVAILABLE_FUNCTIONS = {
+    "walk_command": _handle_walk_command,
+    "turn_command": _handle_turn_command,
+    "bow_command": _handle_bow_command,
+    "dance_command": _handle_dance_command,
+    "stop_command": _handle_stop_command,
+    "sit_command": _handle_sit_command,
+}
+
+def parse_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
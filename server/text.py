@@ -0,0 +1,119 @@
+import math
+import re
+from typing import List, Optional
+
+
+####################################################################################################
+# Number Words
+####################################################################################################
+
+UNITS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+    "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15,
+    "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19
+}
+
+TENS = {
+    "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50, "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90
+}
+
+SCALES = {
+    "hundred": 100, "thousand": 1000
+}
+
+def format_number(value: float) -> str:
+    return str(int(value)) if value == int(value) else f"{value:g}"
+
+def words_to_numbers(tokens: List[str]) -> List[str]:
+    # Replaces runs of number words with digits: "one hundred eighty" -> "180", "two point five" -> "2.5",
+    # "one and a half" -> "1.5", "a hundred" -> "100". Digits already present are left alone.
+    output = []
+    i = 0
+    while i < len(tokens):
+        value, consumed = _parse_number(tokens, i)
+        if consumed == 0:
+            output.append(tokens[i])
+            i += 1
+        else:
+            output.append(format_number(value))
+            i += consumed
+    return output
+
+def _parse_number(tokens: List[str], start: int):
+    total = 0
+    current = 0
+    i = start
+    seen_number = False
+    while i < len(tokens):
+        token = tokens[i]
+        next_token = tokens[i + 1] if i + 1 < len(tokens) else None
+        if token in UNITS:
+            current += UNITS[token]
+        elif token in TENS:
+            current += TENS[token]
+        elif token in SCALES and (seen_number or (i > start and tokens[i - 1] == "a")):
+            current = max(current, 1) * SCALES[token]
+            if SCALES[token] >= 1000:
+                total += current
+                current = 0
+        elif token == "a" and not seen_number and next_token in SCALES:
+            # "a hundred"
+            i += 1
+            continue
+        elif token == "and" and seen_number and next_token == "a" and i + 2 < len(tokens) and tokens[i + 2] == "half":
+            # "one and a half"
+            return total + current + 0.5, i + 3 - start
+        elif token == "and" and seen_number and (next_token in UNITS or next_token in TENS):
+            # "one hundred and eighty"
+            i += 1
+            continue
+        elif token == "point" and seen_number and next_token in UNITS:
+            digits = []
+            i += 1
+            while i < len(tokens) and tokens[i] in UNITS and UNITS[tokens[i]] < 10:
+                digits.append(str(UNITS[tokens[i]]))
+                i += 1
+            return float(f"{total + current}.{''.join(digits)}"), i - start
+        else:
+            break
+        seen_number = True
+        i += 1
+    if not seen_number:
+        return 0, 0
+    return total + current, i - start
+
+def parse_number(token: str) -> Optional[float]:
+    # float() also accepts "inf", "nan" and overflowing literals like "1e400", none of which is a
+    # distance or an angle
+    try:
+        value = float(token)
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+
+####################################################################################################
+# Transcript Normalization
+####################################################################################################
+
+FILLER_WORDS = {
+    "um", "umm", "uh", "uhh", "er", "erm", "ah", "oh", "hmm", "mm", "please", "hey", "okay", "ok", "so", "just",
+    "kindly", "now"
+}
+
+_PUNCTUATION = re.compile(r"[^\w\s.]")
+_SENTENCE_PERIOD = re.compile(r"\.(?!\d)")
+
+def tokenize(text: str) -> List[str]:
+    # Lowercases and splits on whitespace, removing punctuation but keeping decimal points
+    text = text.lower().replace("°", " degrees ").replace("-", " ")
+    text = _PUNCTUATION.sub(" ", text)
+    text = _SENTENCE_PERIOD.sub(" ", text)
+    return text.split()
+
+def normalize_text(text: str) -> str:
+    # Canonical form of a transcript for matching: "Um, Spot, turn LEFT ninety-degrees, please." and
+    # "spot turn left 90 degrees" both become "spot turn left 90 degrees"
+    tokens = [ token for token in words_to_numbers(tokenize(text)) if token not in FILLER_WORDS ]
+    tokens = [ format_number(float(token)) if parse_number(token) is not None else token for token in tokens ]
+    return " ".join(tokens)
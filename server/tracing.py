@@ -0,0 +1,181 @@
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+import contextvars
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+import uuid
+
+
+####################################################################################################
+# Correlation IDs
+####################################################################################################
+
+# Identifies one utterance end to end: assigned on the robot when the audio is captured, sent to the
+# server in the X-Correlation-ID header, and attached to every span recorded on its behalf.
+CORRELATION_HEADER = "X-Correlation-ID"
+
+correlation_id: contextvars.ContextVar = contextvars.ContextVar("correlation_id", default=None)
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+def current_correlation_id() -> Optional[str]:
+    return correlation_id.get()
+
+
+####################################################################################################
+# Latency Histograms
+####################################################################################################
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Cumulative-bucket histogram in the Prometheus sense, plus a window of the most recent samples from
+# which exact quantiles are computed
+class LatencyHistogram:
+    def __init__(self, name: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, window: int = 1024):
+        self.name = name
+        self.buckets = buckets
+        self._bucket_counts = [ 0 ] * (len(buckets) + 1)    # last is +Inf
+        self._count = 0
+        self._sum = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._bucket_counts[bisect_left(self.buckets, seconds)] += 1
+            self._count += 1
+            self._sum += seconds
+            self._recent.append(seconds)
+
+    def quantiles(self, qs: Tuple[float, ...] = QUANTILES) -> Dict[float, float]:
+        with self._lock:
+            samples = sorted(self._recent)
+        if len(samples) == 0:
+            return { q: 0.0 for q in qs }
+        return { q: samples[min(len(samples) - 1, int(q * len(samples)))] for q in qs }
+
+    def recent_count(self) -> int:
+        # Samples the quantiles are computed from
+        with self._lock:
+            return len(self._recent)
+
+    def snapshot(self) -> Tuple[List[int], int, float]:
+        # (cumulative bucket counts including +Inf, count, sum)
+        with self._lock:
+            cumulative = []
+            total = 0
+            for count in self._bucket_counts:
+                total += count
+                cumulative.append(total)
+            return cumulative, self._count, self._sum
+
+_histograms: Dict[str, LatencyHistogram] = {}
+_histograms_lock = threading.Lock()
+
+def histogram(name: str) -> LatencyHistogram:
+    with _histograms_lock:
+        if name not in _histograms:
+            _histograms[name] = LatencyHistogram(name=name)
+        return _histograms[name]
+
+def histograms() -> List[LatencyHistogram]:
+    with _histograms_lock:
+        return sorted(_histograms.values(), key=lambda h: h.name)
+
+
+####################################################################################################
+# Spans
+####################################################################################################
+
+TRACE_SPANS = os.getenv("TRACE_SPANS", "0") == "1"     # print every finished span
+
+class Span:
+    __slots__ = ("name", "correlation_id", "started_at", "duration", "failed")
+
+    def __init__(self, name: str, correlation_id: Optional[str]):
+        self.name = name
+        self.correlation_id = correlation_id
+        self.started_at = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.failed = False
+
+_recent_spans = deque(maxlen=256)
+
+@contextmanager
+def span(name: str) -> Iterator[Span]:
+    # Times the enclosed block (sync or async code) and records it under the current correlation ID
+    current = Span(name=name, correlation_id=correlation_id.get())
+    try:
+        yield current
+    except BaseException:
+        current.failed = True
+        raise
+    finally:
+        _finish(current, time.perf_counter() - current.started_at)
+
+def record(name: str, seconds: float, correlation: Optional[str] = None):
+    # For intervals not delimited by a block, e.g. time spent queued, or work finished on another thread
+    finished = Span(name=name, correlation_id=correlation if correlation is not None else correlation_id.get())
+    _finish(finished, seconds)
+
+def recent_spans() -> List[Span]:
+    return list(_recent_spans)
+
+def _finish(finished: Span, seconds: float):
+    finished.duration = seconds
+    histogram(finished.name).observe(seconds)
+    _recent_spans.append(finished)
+    if TRACE_SPANS:
+        print(f"[{finished.correlation_id or '-'}] {finished.name}: {seconds * 1000:.1f} ms{' (failed)' if finished.failed else ''}")
+
+
+####################################################################################################
+# Prometheus Exposition
+####################################################################################################
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def render_metrics(prefix: str = "spot") -> str:
+    all_histograms = histograms()
+    lines = [
+        f"# HELP {prefix}_span_duration_seconds Duration of traced spans",
+        f"# TYPE {prefix}_span_duration_seconds histogram"
+    ]
+    for h in all_histograms:
+        cumulative, count, total = h.snapshot()
+        for bound, bucket_count in zip(list(h.buckets) + [ "+Inf" ], cumulative):
+            lines.append(f'{prefix}_span_duration_seconds_bucket{{span="{h.name}",le="{bound}"}} {bucket_count}')
+        lines.append(f'{prefix}_span_duration_seconds_sum{{span="{h.name}"}} {total}')
+        lines.append(f'{prefix}_span_duration_seconds_count{{span="{h.name}"}} {count}')
+    lines += [
+        f"# HELP {prefix}_span_latency_seconds Quantiles of recent span durations",
+        f"# TYPE {prefix}_span_latency_seconds summary"
+    ]
+    for h in all_histograms:
+        _, count, total = h.snapshot()
+        for q, value in h.quantiles().items():
+            lines.append(f'{prefix}_span_latency_seconds{{span="{h.name}",quantile="{q}"}} {value}')
+        lines.append(f'{prefix}_span_latency_seconds_sum{{span="{h.name}"}} {total}')
+        lines.append(f'{prefix}_span_latency_seconds_count{{span="{h.name}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+async def start_exporter(port: int, host: str = "0.0.0.0"):
+    # Serves /metrics for processes that are not web servers themselves (the robot side). Returns the
+    # aiohttp runner; call its cleanup() to stop.
+    from aiohttp import web
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(body=render_metrics().encode("utf-8"), headers={ "Content-Type": METRICS_CONTENT_TYPE })
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
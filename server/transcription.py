@@ -1,19 +1,215 @@
+import asyncio
 from datetime import datetime
 from enum import Enum
 from io import BytesIO
+import mimetypes
 import os
+import time
 import traceback
-from typing import List, Optional, Annotated
+from typing import BinaryIO, List, Optional, Annotated
 
 import openai
 
-def transcribe(client: openai.OpenAI, audio_bytes: bytes) -> str:
-    # Create a file-like object for Whisper API to consume
-    buffer = BytesIO(initial_bytes=audio_bytes)
-    buffer.name = "voice.mp4"
-    # Whisper
+from .backends import BackendExecutor
+from .ingest import AudioUpload
+from .models import TranscriptionStats
+from .tracing import histogram, record
+
+
+# Whisper infers the audio format from the file extension
+SUPPORTED_EXTENSIONS = { ".flac", ".m4a", ".mp3", ".mp4", ".mpeg", ".mpga", ".oga", ".ogg", ".wav", ".webm" }
+
+CONTENT_TYPE_EXTENSIONS = {
+    "audio/wav": ".wav",
+    "audio/x-wav": ".wav",
+    "audio/wave": ".wav",
+    "audio/flac": ".flac",
+    "audio/x-flac": ".flac",
+    "audio/ogg": ".ogg",
+    "audio/opus": ".ogg",
+    "audio/webm": ".webm",
+    "audio/mpeg": ".mp3",
+    "audio/mp4": ".mp4",
+    "audio/m4a": ".m4a",
+    "audio/x-m4a": ".m4a"
+}
+
+def audio_filename(filename: Optional[str] = None, content_type: Optional[str] = None) -> str:
+    # Name to give the upload so that Whisper decodes it correctly. The content type wins over the
+    # extension when both are present and they disagree.
+    if content_type is not None:
+        extension = CONTENT_TYPE_EXTENSIONS.get(content_type.split(";")[0].strip().lower())
+        if extension is not None:
+            return f"voice{extension}"
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension in SUPPORTED_EXTENSIONS:
+        return f"voice{extension}"
+    if filename is None and content_type is None:
+        return "voice.wav"
+    raise ValueError(f"Unsupported audio format: filename={filename}, content_type={content_type}")
+
+def transcribe(client: openai.OpenAI, audio: BinaryIO) -> str:
+    # audio is a readable file object whose name carries the extension Whisper infers the format from;
+    # it is streamed to the API as it is
     transcript = client.audio.translations.create(
         model="whisper-1", 
-        file=buffer,
+        file=audio,
     )
-    return transcript.text
\ No newline at end of file
+    return transcript.text
+
+
+
+####################################################################################################
+# Transcription Backends
+####################################################################################################
+
+# Transcribes one complete utterance, read from a file object whose name has the format's extension.
+# transcribe() blocks, and is run on a BackendExecutor of the same name.
+class TranscriptionBackend:
+    name = "transcription"
+
+    def transcribe(self, audio: BinaryIO) -> str:
+        raise NotImplementedError()
+
+class WhisperBackend(TranscriptionBackend):
+    def __init__(self, client: openai.OpenAI, name: str = "whisper"):
+        self.client = client
+        self.name = name
+
+    def transcribe(self, audio: BinaryIO) -> str:
+        return transcribe(client=self.client, audio=audio)
+
+class DeepgramBackend(TranscriptionBackend):
+    # Deepgram's pre-recorded API. The SDK is imported on construction, so servers that do not use
+    # Deepgram do not need it installed.
+    def __init__(self, api_key: Optional[str] = None, url: Optional[str] = None, model: str = "nova-2", timeout: float = 15, name: str = "deepgram"):
+        from deepgram import DeepgramClient, DeepgramClientOptions, PrerecordedOptions
+        import httpx
+        config = DeepgramClientOptions(url=url or os.getenv("DEEPGRAM_URL", "api.deepgram.com"))
+        self._client = DeepgramClient(api_key=api_key or os.getenv("DEEPGRAM_API_KEY", ""), config=config)
+        self._options = PrerecordedOptions(model=model, language="en-US", punctuate=True, smart_format=True)
+        self._timeout = httpx.Timeout(timeout)
+        self.name = name
+
+    def transcribe(self, audio: BinaryIO) -> str:
+        source = { "stream": audio, "mimetype": mimetypes.guess_type(audio.name)[0] or "audio/wav" }
+        response = self._client.listen.prerecorded.v("1").transcribe_file(source, self._options, timeout=self._timeout)
+        return response.results.channels[0].alternatives[0].transcript
+
+class StubBackend(TranscriptionBackend):
+    # Answers with a fixed transcript after a fixed delay, for running the server without credentials
+    def __init__(self, text: str = "", latency: float = 0.0, name: str = "stub"):
+        self.text = text
+        self.latency = latency
+        self.name = name
+
+    def transcribe(self, audio: BinaryIO) -> str:
+        time.sleep(self.latency)
+        return self.text
+
+def create_backend(name: str, openai_client: Optional[openai.OpenAI] = None) -> TranscriptionBackend:
+    if name == "whisper":
+        return WhisperBackend(client=openai_client)
+    if name == "deepgram":
+        return DeepgramBackend()
+    if name == "stub":
+        return StubBackend(text=os.getenv("STUB_TRANSCRIPT", ""), latency=float(os.getenv("STUB_LATENCY", 0)))
+    raise ValueError(f"Unknown transcription backend: {name}")
+
+
+####################################################################################################
+# Hedged Transcription
+####################################################################################################
+
+# Sends each utterance to the primary backend, and if it has not answered within hedge_quantile of its
+# recently observed latency, sends the same audio to the secondary as well and takes whichever answers
+# first. Until min_samples latencies have been observed, initial_hedge_delay is used instead. A primary
+# that fails outright is failed over to the secondary immediately. Without a secondary, requests simply
+# go to the primary.
+class HedgedTranscriber:
+    def __init__(
+        self,
+        primary: TranscriptionBackend,
+        primary_executor: BackendExecutor,
+        secondary: Optional[TranscriptionBackend] = None,
+        secondary_executor: Optional[BackendExecutor] = None,
+        hedge_quantile: float = 0.9,
+        initial_hedge_delay: float = 2.0,
+        min_hedge_delay: float = 0.05,
+        min_samples: int = 20
+    ):
+        self.primary = primary
+        self.primary_executor = primary_executor
+        self.secondary = secondary
+        self.secondary_executor = secondary_executor
+        self.hedge_quantile = hedge_quantile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self._requests = 0
+        self._hedged = 0
+        self._secondary_wins = 0
+        self._failovers = 0
+
+    def hedge_delay(self) -> float:
+        latencies = histogram(f"transcription.{self.primary.name}")
+        if latencies.recent_count() < self.min_samples:
+            return self.initial_hedge_delay
+        return max(self.min_hedge_delay, latencies.quantiles(qs=(self.hedge_quantile,))[self.hedge_quantile])
+
+    async def transcribe(self, upload: AudioUpload) -> str:
+        self._requests += 1
+        primary = self._submit(backend=self.primary, executor=self.primary_executor, upload=upload)
+        if self.secondary is None:
+            return await primary
+        done, _ = await asyncio.wait([ primary ], timeout=self.hedge_delay())
+        if len(done) > 0 and primary.exception() is None:
+            return primary.result()
+        if len(done) > 0:
+            self._failovers += 1
+            print(f"Transcription by {self.primary.name} failed ({primary.exception()}), failing over to {self.secondary.name}")
+        else:
+            self._hedged += 1
+        secondary = self._submit(backend=self.secondary, executor=self.secondary_executor, upload=upload)
+        pending = { primary, secondary } - done
+        try:
+            while len(pending) > 0:
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in finished:
+                    if future.exception() is None:
+                        if future is secondary:
+                            self._secondary_wins += 1
+                        return future.result()
+            # Both failed; report the primary's error
+            return primary.result()
+        finally:
+            # The slower call still finishes on its thread, and its latency is still recorded
+            for future in pending:
+                future.cancel()
+
+    def executors(self) -> List[BackendExecutor]:
+        return [ self.primary_executor ] + ([ self.secondary_executor ] if self.secondary_executor is not None else [])
+
+    def stats(self) -> TranscriptionStats:
+        return TranscriptionStats(
+            primary=self.primary.name,
+            secondary=self.secondary.name if self.secondary is not None else None,
+            hedge_delay_seconds=self.hedge_delay(),
+            requests=self._requests,
+            hedged=self._hedged,
+            secondary_wins=self._secondary_wins,
+            failovers=self._failovers
+        )
+
+    def _submit(self, backend: TranscriptionBackend, executor: BackendExecutor, upload: AudioUpload) -> asyncio.Future:
+        # Each backend reads through its own handle, opened now so that it stays readable after the
+        # request has finished with the upload
+        submitted_at = time.perf_counter()
+        audio = upload.open()
+
+        def call() -> str:
+            with audio:
+                text = backend.transcribe(audio=audio)
+            record(f"transcription.{backend.name}", time.perf_counter() - submitted_at)
+            return text
+        return asyncio.ensure_future(executor.run(call))
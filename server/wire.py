@@ -0,0 +1,51 @@
+import struct
+from typing import List
+
+from .models import SPOT_COMMANDS, CommandType, Direction, SpotCommand
+
+
+# Compact binary form of a list of commands, for clients that accept it in place of JSON: a header
+# (magic, version, count) then one fixed-size little-endian record per command of opcode, direction,
+# amount and duration. 10 bytes per command against about 65 for JSON.
+COMMANDS_MEDIA_TYPE = "application/x-spot-commands"
+
+MAGIC = b"SPC"
+VERSION = 1
+HEADER = struct.Struct("<3sBH")
+RECORD = struct.Struct("<BBff")     # amount and duration as float32, ample for meters, degrees and seconds
+
+# Codes are positions in these tuples, so members may only ever be appended
+COMMAND_TYPES = tuple(CommandType)
+DIRECTIONS = tuple(Direction)
+_COMMAND_TYPE_CODES = { command_type: code for code, command_type in enumerate(COMMAND_TYPES) }
+_DIRECTION_CODES = { direction: code for code, direction in enumerate(DIRECTIONS) }
+
+
+def encode_commands(commands: List[SpotCommand]) -> bytes:
+    data = bytearray(HEADER.size + RECORD.size * len(commands))
+    HEADER.pack_into(data, 0, MAGIC, VERSION, len(commands))
+    for i, command in enumerate(commands):
+        RECORD.pack_into(
+            data, HEADER.size + i * RECORD.size,
+            _COMMAND_TYPE_CODES[command.command], _DIRECTION_CODES[command.dir], command.amount, command.duration
+        )
+    return bytes(data)
+
+def decode_commands(data: bytes) -> List[SpotCommand]:
+    # Raises ValueError for anything that is not a well-formed payload of this version
+    if len(data) < HEADER.size:
+        raise ValueError("Truncated command payload")
+    magic, version, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unsupported command payload (magic {magic!r}, version {version})")
+    if len(data) != HEADER.size + count * RECORD.size:
+        raise ValueError(f"Command payload of {len(data)} bytes does not hold {count} commands")
+    fields = []
+    for command_code, direction_code, amount, duration in RECORD.iter_unpack(memoryview(data)[HEADER.size:]):
+        if command_code >= len(COMMAND_TYPES) or direction_code >= len(DIRECTIONS):
+            raise ValueError(f"Unknown command code {command_code} or direction code {direction_code}")
+        fields.append({ "command": COMMAND_TYPES[command_code], "dir": DIRECTIONS[direction_code], "amount": amount, "duration": duration })
+    return SPOT_COMMANDS.validate_python(fields)
+
+def is_encoded(data: bytes) -> bool:
+    return data[:len(MAGIC)] == MAGIC
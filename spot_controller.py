@@ -1,10 +1,21 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import heapq
+import itertools
+import threading
 import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import numpy as np
 import bosdyn.client
 from bosdyn.client.robot_command import RobotCommandClient, RobotCommandBuilder, blocking_stand  # , blocking_sit
 from bosdyn.geometry import EulerZXY
 from bosdyn.api.spot import robot_command_pb2 as spot_command_pb2
+from bosdyn.api import trajectory_pb2
+from bosdyn.util import seconds_to_duration
 from bosdyn.client.frame_helpers import ODOM_FRAME_NAME
-from bosdyn.api.basic_command_pb2 import RobotCommandFeedbackStatus
+from bosdyn.api.basic_command_pb2 import RobotCommandFeedbackStatus, SitCommand, StandCommand
 from bosdyn.client.estop import EstopClient, EstopEndpoint, EstopKeepAlive
 from bosdyn.client.robot_state import RobotStateClient
 from bosdyn.client.frame_helpers import ODOM_FRAME_NAME, VISION_FRAME_NAME, BODY_FRAME_NAME, \
@@ -13,33 +24,367 @@ from bosdyn.client import math_helpers
 
 import traceback
 
+from server.tracing import current_correlation_id, record, span
+from trajectory import compose, ramped_velocity, MAX_ACCELERATION
+
 VELOCITY_CMD_DURATION = 0.5
 
 
+####################################################################################################
+# Command Handles and Feedback
+####################################################################################################
+
+class CommandKind:
+    TRAJECTORY = "trajectory"
+    VELOCITY = "velocity"
+    STAND = "stand"
+    SIT = "sit"
+    REFRESHED = "refreshed"
+    HALT = "halt"
+
+class CommandHandle:
+    # Completion of an asynchronously issued robot command. Resolves to True when the command completes
+    # and False when it fails, times out or is cancelled. Await it from asyncio, block on result(), or
+    # chain the next motion with then().
+    def __init__(self, controller: "SpotController", kind: str, timeout: float):
+        self.kind = kind
+        self.cmd_id: Optional[int] = None
+        self.issued_at: Optional[float] = None
+        self.end_time: Optional[float] = None      # for velocity commands
+        self.deadline = time.time() + timeout
+        self.correlation_id = current_correlation_id()     # captured here, as commands complete on other threads
+        self._created_at = time.perf_counter()
+        self._controller = controller
+        self._future: Future = Future()
+        self._cancel_hook: Optional[Callable[[], None]] = None
+
+    def __await__(self):
+        return asyncio.wrap_future(self._future).__await__()
+
+    def result(self, timeout: Optional[float] = None) -> bool:
+        return self._future.result(timeout=timeout)
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def add_done_callback(self, fn: Callable[["CommandHandle"], None]):
+        self._future.add_done_callback(lambda _: fn(self))
+
+    def cancel(self, stop_robot: bool = True):
+        # Stops the robot immediately rather than waiting for the command to finish. Without stop_robot
+        # the command is only abandoned, for callers that stop the robot themselves (see halt_async).
+        if self._cancel_hook is not None:
+            self._cancel_hook(stop_robot)
+            return
+        if self._resolve(False) and stop_robot:
+            self._controller.stop_async()
+
+    def then(self, next_command: Callable[[], "CommandHandle"]) -> "CommandHandle":
+        # Issues next_command once this one succeeds. The returned handle resolves with the result of
+        # the chained command (or False if this one fails) and cancels whichever command is current.
+        chained = CommandHandle(controller=self._controller, kind=self.kind, timeout=float("inf"))
+        current = [ self ]
+
+        def on_done(handle: CommandHandle):
+            if not handle.result() or chained.done():
+                chained._resolve(False)
+                return
+            current[0] = next_command()
+            current[0].add_done_callback(lambda next_handle: chained._resolve(next_handle.result()))
+
+        def cancel(stop_robot: bool):
+            chained._resolve(False)
+            current[0].cancel(stop_robot)
+
+        chained._cancel_hook = cancel
+        self.add_done_callback(on_done)
+        return chained
+
+    def _resolve(self, succeeded: bool) -> bool:
+        try:
+            self._future.set_result(succeeded)
+        except Exception:
+            # Already resolved
+            return False
+        record(f"robot.{self.kind}", time.perf_counter() - self._created_at, correlation=self.correlation_id)
+        return True
+
+class FeedbackPoller:
+    # Single background thread that polls feedback for every in-flight command and resolves its handle.
+    # It sleeps while nothing is in flight, polls quickly while a command is starting up or about to
+    # reach its goal, and backs off while the robot is en route.
+    FAST_INTERVAL = 0.05
+    SLOW_INTERVAL = 0.25
+    STARTUP_SECONDS = 0.5
+
+    def __init__(self, command_client: RobotCommandClient, logger):
+        self._command_client = command_client
+        self._logger = logger
+        self._handles: Dict[int, CommandHandle] = {}
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="FeedbackPoller", daemon=True)
+        self._thread.start()
+
+    def track(self, handle: CommandHandle):
+        with self._condition:
+            self._handles[id(handle)] = handle
+            self._condition.notify()
+
+    def shutdown(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and len(self._handles) == 0:
+                    self._condition.wait()
+                if not self._running:
+                    for handle in self._handles.values():
+                        handle._resolve(False)
+                    return
+                handles = list(self._handles.values())
+            interval = self.SLOW_INTERVAL
+            for handle in handles:
+                finished, next_interval = self._poll(handle)
+                if finished:
+                    with self._condition:
+                        self._handles.pop(id(handle), None)
+                else:
+                    interval = min(interval, next_interval)
+            with self._condition:
+                if self._running and len(self._handles) > 0:
+                    self._condition.wait(timeout=interval)
+
+    def _poll(self, handle: CommandHandle):
+        # Returns (finished, suggested interval until next poll)
+        if handle.done():
+            return True, 0
+        now = time.time()
+        if now > handle.deadline:
+            self._logger.warning(f"Command {handle.cmd_id} timed out")
+            handle._resolve(False)
+            return True, 0
+        if handle.kind == CommandKind.VELOCITY:
+            if now >= handle.end_time:
+                handle._resolve(True)
+                return True, 0
+            return False, min(self.SLOW_INTERVAL, handle.end_time - now)
+        try:
+            feedback = self._command_client.robot_command_feedback(handle.cmd_id)
+        except Exception as e:
+            self._logger.error(f"Failed to get feedback for command {handle.cmd_id}: {e}")
+            return False, self.SLOW_INTERVAL
+        mobility_feedback = feedback.feedback.synchronized_feedback.mobility_command_feedback
+        if mobility_feedback.status != RobotCommandFeedbackStatus.STATUS_PROCESSING:
+            print("Failed to reach the goal")
+            handle._resolve(False)
+            return True, 0
+        starting = now - handle.issued_at < self.STARTUP_SECONDS
+        if handle.kind == CommandKind.STAND:
+            if mobility_feedback.stand_feedback.status == StandCommand.Feedback.STATUS_IS_STANDING:
+                handle._resolve(True)
+                return True, 0
+            return False, self.FAST_INTERVAL
+        if handle.kind == CommandKind.SIT:
+            if mobility_feedback.sit_feedback.status == SitCommand.Feedback.STATUS_IS_SITTING:
+                handle._resolve(True)
+                return True, 0
+            return False, self.FAST_INTERVAL
+        traj_feedback = mobility_feedback.se2_trajectory_feedback
+        if (traj_feedback.status == traj_feedback.STATUS_AT_GOAL and
+                traj_feedback.body_movement_status == traj_feedback.BODY_STATUS_SETTLED):
+            print("Arrived at the goal.")
+            handle._resolve(True)
+            return True, 0
+        near_goal = traj_feedback.status in (traj_feedback.STATUS_NEAR_GOAL, traj_feedback.STATUS_AT_GOAL)
+        return False, self.FAST_INTERVAL if starting or near_goal else self.SLOW_INTERVAL
+
+
+####################################################################################################
+# Refreshed Commands
+####################################################################################################
+
+class RefreshHandle(CommandHandle):
+    # A command that is re-sent periodically with a rolling end time, so the robot keeps executing it
+    # only for as long as it keeps being refreshed. Resolves to True once its duration has elapsed and
+    # False when cancelled. update() replaces the command, e.g. with a new velocity setpoint; a setpoint
+    # function instead produces the command for each refresh from the seconds elapsed since the start.
+    def __init__(
+        self,
+        controller: "SpotController",
+        scheduler: "RefreshScheduler",
+        command,
+        period: float,
+        hold_seconds: float,
+        duration: Optional[float],
+        setpoint: Optional[Callable[[float], Any]] = None
+    ):
+        super().__init__(controller=controller, kind=CommandKind.REFRESHED, timeout=float("inf"))
+        self.period = period
+        self.hold_seconds = hold_seconds      # how far past each send the command's end time is set
+        self.started_at = time.time()
+        self.stop_at = self.started_at + duration if duration is not None else None
+        self.sends = 0
+        self.missed = 0                       # refresh slots skipped because the scheduler fell behind
+        self._command = command
+        self._setpoint = setpoint
+        self._scheduler = scheduler
+        self._generation = 0
+
+    def update(self, command):
+        # Takes effect immediately rather than at the next refresh
+        self._command = command
+        self._scheduler.wake(self)
+
+class RefreshScheduler:
+    # Single background thread that owns every periodically refreshed command (stance, velocity, ...).
+    # Refreshes run at a fixed rate: each is scheduled relative to the previous slot rather than to when
+    # the previous send finished, so send latency does not accumulate as drift. End times are passed as
+    # local time and converted to robot time by the command client using the robot's time sync.
+    def __init__(self, command_client: RobotCommandClient, logger):
+        self._command_client = command_client
+        self._logger = logger
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="RefreshScheduler", daemon=True)
+        self._thread.start()
+
+    def schedule(self, handle: RefreshHandle) -> RefreshHandle:
+        self.wake(handle)
+        return handle
+
+    def wake(self, handle: RefreshHandle):
+        # (Re)starts the handle's refresh cycle now; any previously scheduled slot is discarded
+        with self._condition:
+            handle._generation += 1
+            heapq.heappush(self._heap, (time.time(), next(self._sequence), handle._generation, handle))
+            self._condition.notify()
+
+    def shutdown(self):
+        # Resolves every scheduled handle as failed and stops refreshing. Safe to call more than once.
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and len(self._heap) == 0:
+                    self._condition.wait()
+                if not self._running:
+                    for _, _, _, handle in self._heap:
+                        handle._resolve(False)
+                    return
+                due, _, generation, handle = self._heap[0]
+                now = time.time()
+                if due > now:
+                    self._condition.wait(timeout=due - now)
+                    continue
+                heapq.heappop(self._heap)
+            if handle.done() or generation != handle._generation:
+                continue
+            next_due = self._refresh(handle, due)
+            if next_due is not None:
+                with self._condition:
+                    if generation == handle._generation:
+                        heapq.heappush(self._heap, (next_due, next(self._sequence), generation, handle))
+
+    def _refresh(self, handle: RefreshHandle, due: float) -> Optional[float]:
+        # Sends the command and returns when it is next due, or None when the handle has finished
+        now = time.time()
+        if handle.stop_at is not None and now >= handle.stop_at:
+            handle._resolve(True)
+            return None
+        end_time = now + handle.hold_seconds
+        if handle.stop_at is not None:
+            end_time = min(end_time, handle.stop_at)
+        try:
+            if handle._setpoint is not None:
+                handle._command = handle._setpoint(now - handle.started_at)
+            self._command_client.robot_command(lease=None, command=handle._command, end_time_secs=end_time)
+            handle.sends += 1
+            if handle.done():
+                # Cancelled while this refresh was in flight, so it may have reached the robot after the
+                # stop: stop again rather than let it run until its end time
+                self._command_client.robot_command(RobotCommandBuilder.stop_command())
+                return None
+        except Exception as e:
+            self._logger.error(f"Failed to refresh command: {e}")
+        next_due = due + handle.period
+        now = time.time()
+        if next_due <= now:
+            missed = int((now - due) // handle.period)
+            handle.missed += missed
+            next_due = due + (missed + 1) * handle.period
+        if handle.stop_at is not None:
+            next_due = min(next_due, handle.stop_at)
+        return next_due
+
+
 class SpotController:
     def __init__(self, username, password, robot_ip):
         self.username = username
         self.password = password
         self.robot_ip = robot_ip
+        self.startup_timings: Dict[str, float] = {}     # seconds per startup phase, in order
 
-        sdk = bosdyn.client.create_standard_sdk('ControllingSDK')
-
-        self.robot = sdk.create_robot(robot_ip)
-        id_client = self.robot.ensure_client('robot-id')
+        with self._startup_phase("sdk"):
+            sdk = bosdyn.client.create_standard_sdk('ControllingSDK')
+            self.robot = sdk.create_robot(robot_ip)
 
-        self.robot.authenticate(username, password)
-        self.command_client = self.robot.ensure_client(RobotCommandClient.default_service_name)
+        with self._startup_phase("authenticate"):
+            self.robot.authenticate(username, password)
         self.robot.logger.info("Authenticated")
 
-        self._lease_client = None
+        # One directory lookup, after which creating the clients involves no round trips
+        with self._startup_phase("clients"):
+            self.robot.sync_with_directory()
+            id_client = self.robot.ensure_client('robot-id')
+            self.command_client = self.robot.ensure_client(RobotCommandClient.default_service_name)
+            self._lease_client = self.robot.ensure_client('lease')
+            self._estop_client = self.robot.ensure_client(EstopClient.default_service_name)
+            self.state_client = self.robot.ensure_client(RobotStateClient.default_service_name)
+
+        # Time sync converges on its own thread while the rest of startup proceeds, instead of being
+        # started and waited for just before standing
+        self.robot.start_time_sync()
+
         self._lease = None
         self._lease_keepalive = None
 
-        self._estop_client = self.robot.ensure_client(EstopClient.default_service_name)
         self._estop_endpoint = EstopEndpoint(self._estop_client, 'GNClient', 9.0)
         self._estop_keepalive = None
 
-        self.state_client = self.robot.ensure_client(RobotStateClient.default_service_name)
+        self._start_workers()
+
+    @classmethod
+    def with_clients(cls, robot, command_client, state_client) -> "SpotController":
+        # Wraps already-created clients without connecting, authenticating or taking the lease, e.g. the
+        # local stand-ins in bench/fake_spot.py. Call close() when done.
+        controller = cls.__new__(cls)
+        controller.robot = robot
+        controller.command_client = command_client
+        controller.state_client = state_client
+        controller.startup_timings = {}
+        controller._start_workers()
+        return controller
+
+    def _start_workers(self):
+        # Asynchronous commands are sent in order on a dedicated thread, and their completion is
+        # reported by a shared feedback poller
+        self._command_sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix="SpotCommand")
+        self._feedback_poller = FeedbackPoller(command_client=self.command_client, logger=self.robot.logger)
+        # Keep-alive commands (stance, velocity streams) are re-sent by a shared scheduler thread
+        self._refresh_scheduler = RefreshScheduler(command_client=self.command_client, logger=self.robot.logger)
+        # Stops have a thread of their own, so they never wait behind commands being sent
+        self._stop_sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix="SpotStop")
 
     def release_estop(self):
         self._estop_endpoint.force_simple_setup()
@@ -56,7 +401,8 @@ class SpotController:
             self._estop_keepalive = None
 
     def lease_control(self):
-        self._lease_client = self.robot.ensure_client('lease')
+        if self._lease_client is None:
+            self._lease_client = self.robot.ensure_client('lease')
         self._lease = self._lease_client.take()
         self._lease_keepalive = bosdyn.client.lease.LeaseKeepAlive(self._lease_client, must_acquire=True)
         self.robot.logger.info("Lease acquired")
@@ -67,20 +413,44 @@ class SpotController:
         self._lease_keepalive = None
 
     def __enter__(self):
-        self.lease_control()
-        self.release_estop()
+        # Taking the lease and registering the E-Stop endpoint are independent, so their round trips
+        # overlap. Power-on needs both.
+        with self._startup_phase("lease_estop"):
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix="SpotStartup") as startup:
+                lease = startup.submit(self.lease_control)
+                estop = startup.submit(self.release_estop)
+                lease.result()
+                estop.result()
         self.power_on_stand_up()
+        print("Spot startup: " + ", ".join(f"{name} {seconds:.2f} s" for name, seconds in self.startup_timings.items()))
         return self
 
+    @contextmanager
+    def _startup_phase(self, name: str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        with span(f"startup.spot.{name}"):
+            yield
+        self.startup_timings[name] = time.perf_counter() - started_at
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_type:
             self.robot.logger.error("Spot powered off with " + exc_val + " exception")
+        # Keep-alive commands must stop before sitting down, or a stance or velocity refresh could
+        # command the robot as it sits and powers off. close() below shuts down the rest.
+        self._refresh_scheduler.shutdown()
         self.power_off_sit_down()
         self.return_lease()
         self.set_estop()
+        self.close()
 
         return True if exc_type else False
 
+    def close(self):
+        self._refresh_scheduler.shutdown()
+        self._feedback_poller.shutdown()
+        self._command_sender.shutdown()
+        self._stop_sender.shutdown()
+
     def move_head_in_points(self, yaws, pitches, rolls, body_height=0, sleep_after_point_reached=0, timeout=3):
         for i in range(len(yaws)):
             footprint_r_body = EulerZXY(yaw=yaws[i], roll=rolls[i], pitch=pitches[i])
@@ -91,46 +461,152 @@ class SpotController:
                 time.sleep(sleep_after_point_reached)
 
     def wait_until_action_complete(self, cmd_id, timeout=15):
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            feedback = self.command_client.robot_command_feedback(cmd_id)
-            mobility_feedback = feedback.feedback.synchronized_feedback.mobility_command_feedback
-            if mobility_feedback.status != RobotCommandFeedbackStatus.STATUS_PROCESSING:
-                print("Failed to reach the goal")
-                return False
-            traj_feedback = mobility_feedback.se2_trajectory_feedback
-            if (traj_feedback.status == traj_feedback.STATUS_AT_GOAL and
-                    traj_feedback.body_movement_status == traj_feedback.BODY_STATUS_SETTLED):
-                print("Arrived at the goal.")
-                return True
-            time.sleep(0.5)
+        with span("robot.wait_until_action_complete"):
+            handle = CommandHandle(controller=self, kind=CommandKind.TRAJECTORY, timeout=timeout)
+            handle.cmd_id = cmd_id
+            handle.issued_at = time.time()
+            self._feedback_poller.track(handle)
+            return handle.result()
 
     def move_to_goal(self, goal_x=0, goal_y=0, rotation=0):
-        cmd = RobotCommandBuilder.synchro_trajectory_command_in_body_frame(
-            goal_x_rt_body=goal_x,
-            goal_y_rt_body=goal_y,
-            goal_heading_rt_body=rotation,
-            frame_tree_snapshot=self.robot.get_frame_tree_snapshot()
-        )
-        # cmd = RobotCommandBuilder.synchro_se2_trajectory_point_command(goal_x=goal_x, goal_y=goal_y, goal_heading=0,
-        #                                                                frame_name=GRAV_ALIGNED_BODY_FRAME_NAME)
-        cmd_id = self.command_client.robot_command(lease=None, command=cmd,
-                                                   end_time_secs=time.time() + 10)
-        self.wait_until_action_complete(cmd_id)
-
+        with span("robot.move_to_goal"):
+            self.move_to_goal_async(goal_x=goal_x, goal_y=goal_y, rotation=rotation).result()
         self.robot.logger.info("Moved to x={} y={}".format(goal_x, goal_y))
 
+    def move_to_goal_async(self, goal_x=0, goal_y=0, rotation=0, timeout=15) -> CommandHandle:
+        def send():
+            cmd = RobotCommandBuilder.synchro_trajectory_command_in_body_frame(
+                goal_x_rt_body=goal_x,
+                goal_y_rt_body=goal_y,
+                goal_heading_rt_body=rotation,
+                frame_tree_snapshot=self.robot.get_frame_tree_snapshot()
+            )
+            # cmd = RobotCommandBuilder.synchro_se2_trajectory_point_command(goal_x=goal_x, goal_y=goal_y, goal_heading=0,
+            #                                                                frame_name=GRAV_ALIGNED_BODY_FRAME_NAME)
+            return self.command_client.robot_command(lease=None, command=cmd,
+                                                     end_time_secs=time.time() + 10)
+        return self._issue(CommandHandle(controller=self, kind=CommandKind.TRAJECTORY, timeout=timeout), send)
+
+    def get_odom_pose(self) -> np.ndarray:
+        # Current [x, y, heading] of the body in the odom frame
+        state = self.state_client.get_robot_state()
+        odom_T_body = get_se2_a_tform_b(state.kinematic_state.transforms_snapshot, ODOM_FRAME_NAME, GRAV_ALIGNED_BODY_FRAME_NAME)
+        return np.array([ odom_T_body.x, odom_T_body.y, odom_T_body.angle ])
+
+    def follow_trajectory_async(self, poses: np.ndarray, times: np.ndarray, timeout_margin=10) -> CommandHandle:
+        # Sends a whole multi-point path as one SE2 trajectory so the robot flows through the waypoints
+        # without stopping to settle at each. poses is (N, 3) [x, y, heading] relative to the body pose
+        # at the time the command is sent; they are composed into the odom frame just before sending.
+        # times are when each point should be reached, relative to the start.
+        total_time = float(times[-1]) if len(times) > 0 else 0.0
+        handle = CommandHandle(controller=self, kind=CommandKind.TRAJECTORY, timeout=total_time + timeout_margin)
+
+        def send():
+            odom_poses = compose(origin=self.get_odom_pose(), poses=poses)
+            trajectory = trajectory_pb2.SE2Trajectory()
+            for (x, y, heading), t in zip(odom_poses, times):
+                point = trajectory.points.add()
+                point.pose.CopyFrom(math_helpers.SE2Pose(x=x, y=y, angle=heading).to_proto())
+                point.time_since_reference.CopyFrom(seconds_to_duration(float(t)))
+            # The builder only takes a single goal pose; swap in the full trajectory (timed relative to
+            # when the robot receives the command, since no reference time is set)
+            cmd = RobotCommandBuilder.synchro_se2_trajectory_command(trajectory.points[-1].pose, frame_name=ODOM_FRAME_NAME)
+            cmd.synchronized_command.mobility_command.se2_trajectory_request.trajectory.CopyFrom(trajectory)
+            return self.command_client.robot_command(lease=None, command=cmd, end_time_secs=time.time() + total_time + timeout_margin)
+        return self._issue(handle, send)
+
+    def stop(self):
+        self.command_client.robot_command(RobotCommandBuilder.stop_command())
+
+    def stop_async(self) -> Future:
+        # Sends a stop command on the stop thread and returns at once, so it is safe to call from the
+        # event loop
+        def stop():
+            try:
+                self.stop()
+            except Exception as e:
+                self.robot.logger.error(f"Failed to stop: {e}")
+        return self._stop_sender.submit(stop)
+
+    def halt_async(self, still_speed=0.02, still_rate=0.05, poll_interval=0.02, timeout=3) -> CommandHandle:
+        # Sends a stop command at once and resolves to True when odometry shows the body has come to
+        # rest (below still_speed m/s and still_rate rad/s between consecutive polls), or False after
+        # timeout. In-flight commands should be cancelled with stop_robot=False first, so the robot gets
+        # one stop rather than one per command. The handle's span, robot.halt, is the stop-to-halt
+        # latency from this call to the halt being confirmed; handle.halt_latency runs only to the first
+        # of the two polls that showed the body at rest, so it excludes the last polling interval.
+        handle = CommandHandle(controller=self, kind=CommandKind.HALT, timeout=timeout)
+        handle.halt_latency = None
+
+        def halt():
+            try:
+                sent_at = time.perf_counter()
+                self.stop()
+                record("robot.halt.send", time.perf_counter() - sent_at, correlation=handle.correlation_id)
+                previous, previous_at = self.get_odom_pose(), time.perf_counter()
+                while time.time() < handle.deadline and not handle.done():
+                    time.sleep(poll_interval)
+                    pose, now = self.get_odom_pose(), time.perf_counter()
+                    elapsed = now - previous_at
+                    turned = abs(np.arctan2(np.sin(pose[2] - previous[2]), np.cos(pose[2] - previous[2])))
+                    if np.linalg.norm(pose[:2] - previous[:2]) < still_speed * elapsed and turned < still_rate * elapsed:
+                        handle.halt_latency = previous_at - handle._created_at
+                        handle._resolve(True)
+                        return
+                    previous, previous_at = pose, now
+                self.robot.logger.warning(f"Robot still moving {timeout} s after stop")
+                handle._resolve(False)
+            except Exception as e:
+                self.robot.logger.error(f"Failed to halt: {e}")
+                handle._resolve(False)
+        self._stop_sender.submit(halt)
+        return handle
+
+    def _issue(self, handle: CommandHandle, send: Callable[[], int]) -> CommandHandle:
+        # Sends the command off the calling thread and hands it to the feedback poller
+        def issue():
+            if handle.done():
+                return
+            try:
+                sent_at = time.perf_counter()
+                handle.cmd_id = send()
+                if handle.done():
+                    # Cancelled while being sent, so the command may have reached the robot after the stop
+                    self.stop()
+                    return
+                handle.issued_at = time.time()
+                record(f"robot.{handle.kind}.send", time.perf_counter() - sent_at, correlation=handle.correlation_id)
+                self._feedback_poller.track(handle)
+            except Exception as e:
+                self.robot.logger.error(f"Failed to send {handle.kind} command: {e}")
+                handle._resolve(False)
+        self._command_sender.submit(issue)
+        return handle
+
     def power_on_stand_up(self):
-        self.robot.power_on(timeout_sec=20)
-        assert self.robot.is_powered_on(), "Not powered on"
-        self.robot.time_sync.wait_for_sync()
-        blocking_stand(self.command_client, timeout_sec=10)
+        with self._startup_phase("power_on"):
+            self.robot.power_on(timeout_sec=20)
+            assert self.robot.is_powered_on(), "Not powered on"
+        # Normally already converged, having run since authentication
+        with self._startup_phase("time_sync"):
+            self.robot.time_sync.wait_for_sync()
+        with self._startup_phase("stand"):
+            blocking_stand(self.command_client, timeout_sec=10)
+
+    def sit_async(self, timeout=10) -> CommandHandle:
+        # Sits down without powering off; a stand command brings the robot back up
+        def send():
+            return self.command_client.robot_command(RobotCommandBuilder.synchro_sit_command())
+        return self._issue(CommandHandle(controller=self, kind=CommandKind.SIT, timeout=timeout), send)
 
     def power_off_sit_down(self):
         self.move_head_in_points(yaws=[0], pitches=[0], rolls=[0])
         self.robot.power_off(cut_immediately=False)
 
     def make_stance(self, x_offset, y_offset):
+        self.make_stance_async(x_offset=x_offset, y_offset=y_offset).result()
+
+    def make_stance_async(self, x_offset, y_offset, duration=6) -> RefreshHandle:
         state = self.state_client.get_robot_state()
         vo_T_body = get_se2_a_tform_b(state.kinematic_state.transforms_snapshot,
                                       VISION_FRAME_NAME,
@@ -145,14 +621,7 @@ class SpotController:
             VISION_FRAME_NAME, pos_fl_rt_vision.position,
             pos_fr_rt_vision.position, pos_hl_rt_vision.position, pos_hr_rt_vision.position)
 
-        start_time = time.time()
-        while time.time() - start_time < 6:
-            # Update end time
-            stance_cmd.synchronized_command.mobility_command.stance_request.end_time.CopyFrom(
-                self.robot.time_sync.robot_timestamp_from_local_secs(time.time() + 5))
-            # Send the command
-            self.command_client.robot_command(stance_cmd)
-            time.sleep(0.1)
+        return self.refresh_command(stance_cmd, period=0.1, hold_seconds=5, duration=duration)
 
     def move_by_velocity_control(self, v_x=0.0, v_y=0.0, v_rot=0.0, cmd_duration=VELOCITY_CMD_DURATION):
         # v_x+ - forward, v_y+ - left | m/s, v_rot+ - counterclockwise |rad/s
@@ -160,6 +629,59 @@ class SpotController:
             RobotCommandBuilder.synchro_velocity_command(v_x=v_x, v_y=v_y, v_rot=v_rot),
             end_time_secs=time.time() + cmd_duration)
 
+    def move_by_velocity_control_async(self, v_x=0.0, v_y=0.0, v_rot=0.0, cmd_duration=VELOCITY_CMD_DURATION) -> CommandHandle:
+        # Resolves once cmd_duration has elapsed
+        handle = CommandHandle(controller=self, kind=CommandKind.VELOCITY, timeout=cmd_duration + 5)
+
+        def send():
+            handle.end_time = time.time() + cmd_duration
+            return self.command_client.robot_command(
+                lease=None, command=RobotCommandBuilder.synchro_velocity_command(v_x=v_x, v_y=v_y, v_rot=v_rot),
+                end_time_secs=handle.end_time)
+        return self._issue(handle, send)
+
+    def stream_velocity(self, v_x=0.0, v_y=0.0, v_rot=0.0, duration=None, period=0.1) -> RefreshHandle:
+        # Keeps moving at the given velocity until duration elapses or the handle is cancelled. Change
+        # the setpoint with handle.update(RobotCommandBuilder.synchro_velocity_command(...)).
+        command = RobotCommandBuilder.synchro_velocity_command(v_x=v_x, v_y=v_y, v_rot=v_rot)
+        return self.refresh_command(command, period=period, hold_seconds=VELOCITY_CMD_DURATION, duration=duration)
+
+    def walk_for_duration_async(self, speed, duration, max_acceleration=MAX_ACCELERATION, period=0.1) -> CommandHandle:
+        # Walks forward (speed > 0, m/s) or backward for duration seconds by streaming velocity setpoints
+        # that ramp up and down at max_acceleration. Cancelling the handle stops the robot mid-stream.
+        # Once the handle resolves, handle.distance_covered is the distance actually travelled along the
+        # starting heading, measured from odometry.
+        handle = CommandHandle(controller=self, kind=CommandKind.VELOCITY, timeout=float("inf"))
+        handle.distance_covered = None
+        # Odometry is read on the command thread, which also runs measure() below, so the start pose is
+        # available by then without blocking the caller
+        start_pose = self._command_sender.submit(self.get_odom_pose)
+
+        def setpoint(elapsed):
+            v_x = float(ramped_velocity(elapsed, speed=speed, duration=duration, max_acceleration=max_acceleration))
+            return RobotCommandBuilder.synchro_velocity_command(v_x=v_x, v_y=0, v_rot=0)
+
+        stream = self.refresh_command(setpoint(0), period=period, hold_seconds=VELOCITY_CMD_DURATION, duration=duration, setpoint=setpoint)
+
+        def measure(stream: RefreshHandle):
+            try:
+                start, end = start_pose.result(), self.get_odom_pose()
+                handle.distance_covered = float(np.dot(end[:2] - start[:2], [ np.cos(start[2]), np.sin(start[2]) ]))
+            except Exception as e:
+                self.robot.logger.error(f"Failed to measure distance covered: {e}")
+            handle._resolve(stream.result())
+
+        handle._cancel_hook = stream.cancel
+        stream.add_done_callback(lambda stream: self._command_sender.submit(measure, stream))
+        return handle
+
+    def refresh_command(self, command, period=0.1, hold_seconds=VELOCITY_CMD_DURATION, duration=None, setpoint=None) -> RefreshHandle:
+        # Registers a command to be re-sent every period seconds, each time valid for hold_seconds, until
+        # duration elapses (or indefinitely when None) or the handle is cancelled
+        handle = RefreshHandle(controller=self, scheduler=self._refresh_scheduler, command=command,
+                               period=period, hold_seconds=hold_seconds, duration=duration, setpoint=setpoint)
+        return self._refresh_scheduler.schedule(handle)
+
     def _start_robot_command(self, command_proto, end_time_secs=None):
         self.command_client.robot_command(lease=None, command=command_proto, end_time_secs=end_time_secs)
 
@@ -167,6 +689,11 @@ class SpotController:
         cmd = RobotCommandBuilder.synchro_stand_command(body_height=body_height)
         self.command_client.robot_command(cmd)
 
+    def stand_at_height_async(self, body_height, timeout=10) -> CommandHandle:
+        def send():
+            return self.command_client.robot_command(RobotCommandBuilder.synchro_stand_command(body_height=body_height))
+        return self._issue(CommandHandle(controller=self, kind=CommandKind.STAND, timeout=timeout), send)
+
     def bow(self, pitch, body_height=0, sleep_after_point_reached=0):
         self.move_head_in_points([0, 0], [pitch, 0], [0, 0], body_height=body_height,
                                  sleep_after_point_reached=sleep_after_point_reached, timeout=3)
@@ -0,0 +1,115 @@
+import asyncio
+import socket
+from typing import Awaitable, Callable, List
+
+import aiohttp
+from aiohttp import web
+import pytest
+
+from server.client import SpeechClient
+from server.models import CommandType, Direction, ProcessSpeechResponse, SpotCommand, TranscriptionResponse
+
+
+COMMANDS = [ SpotCommand(command=CommandType.TURN, dir=Direction.LEFT, amount=90.0, duration=0.0) ]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class Script:
+    # Answers each request with the next of the given responses: a status code, "slow", or "ok" for body
+    def __init__(self, responses: List[str], body: str):
+        self.responses = responses
+        self.body = body
+        self.calls = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        await request.read()
+        response = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        if response.isdigit():
+            return web.Response(status=int(response), headers={ "Retry-After": "0" })
+        if response == "slow":
+            await asyncio.sleep(2)
+        return web.Response(text=self.body, content_type="application/json")
+
+def call(path: str, script: Script, request: Callable[[SpeechClient], Awaitable], **kwargs):
+    async def run():
+        app = web.Application()
+        app.router.add_post(path, script.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        port = free_port()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        try:
+            async with SpeechClient(url=f"http://127.0.0.1:{port}", max_retries=2, backoff=0.01, **kwargs) as client:
+                return await request(client)
+        finally:
+            await runner.cleanup()
+    return asyncio.run(run())
+
+def process_speech(responses: List[str], **kwargs):
+    script = Script(responses, body=ProcessSpeechResponse(commands=COMMANDS).model_dump_json())
+    return script, lambda: call("/process_speech", script, lambda client: client.process_speech(text="turn left"), **kwargs)
+
+def test_shed_request_is_retried():
+    script, run = process_speech([ "429", "429", "ok" ])
+    assert run() == COMMANDS
+    assert script.calls == 3
+
+def test_server_error_is_not_retried():
+    # The turn may already have been recorded
+    script, run = process_speech([ "503", "ok" ])
+    with pytest.raises(aiohttp.ClientResponseError):
+        run()
+    assert script.calls == 1
+
+def test_read_timeout_is_not_retried():
+    script, run = process_speech([ "slow", "ok" ], request_timeout=0.5)
+    with pytest.raises(asyncio.TimeoutError):
+        run()
+    assert script.calls == 1
+
+def test_refused_connection_is_retried():
+    attempts = []
+
+    async def run():
+        async with SpeechClient(url=f"http://127.0.0.1:{free_port()}", max_retries=2, backoff=0.01) as client:
+            retry_delay = client._retry_delay
+
+            def recording_retry_delay(**kwargs):
+                attempts.append(kwargs["attempt"])
+                return retry_delay(**kwargs)
+            client._retry_delay = recording_retry_delay
+            await client.process_speech(text="turn left")
+    with pytest.raises(aiohttp.ClientConnectorError):
+        asyncio.run(run())
+    assert attempts == [ 1, 2, 3 ]
+
+def test_transcription_retries_server_errors():
+    script = Script([ "503", "ok" ], body=TranscriptionResponse(text="turn left").model_dump_json())
+    text = call("/transcribe", script, lambda client: client.transcribe(audio=b"RIFF", filename="voice.wav", content_type="audio/wav"))
+    assert text == "turn left"
+    assert script.calls == 2
+
+def test_streamed_request_backs_off_when_shed():
+    events = "\n".join([
+        '{"type": "command", "command": ' + COMMANDS[0].model_dump_json() + '}',
+        '{"type": "commands", "commands": [' + COMMANDS[0].model_dump_json() + ']}',
+    ]) + "\n"
+    script = Script([ "429", "ok" ], body=events)
+
+    async def stream(client: SpeechClient):
+        return [ command async for command in client.process_speech_stream(text="turn left") ]
+    assert call("/process_speech", script, stream) == COMMANDS
+    assert script.calls == 2
+
+def test_streamed_request_is_not_retried_after_server_error():
+    script = Script([ "503", "ok" ], body="")
+
+    async def stream(client: SpeechClient):
+        return [ command async for command in client.process_speech_stream(text="turn left") ]
+    with pytest.raises(aiohttp.ClientResponseError):
+        call("/process_speech", script, stream)
+    assert script.calls == 1
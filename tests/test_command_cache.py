@@ -0,0 +1,96 @@
+import json
+
+from server import command_cache
+from server.command_cache import CommandCache
+from server.models import CommandType, Direction, SpotCommand
+from server.text import normalize_text
+
+
+def walk(feet: float) -> SpotCommand:
+    return SpotCommand(command=CommandType.WALK, dir=Direction.FORWARD, amount=feet * 0.3048, duration=0.0)
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+def test_matches_normalized_transcripts():
+    cache = CommandCache()
+    cache.put("Um, Spot, walk forward TWO feet, please.", [ walk(2) ])
+    assert cache.get("spot walk forward 2 feet") == [ walk(2) ]
+    assert cache.get("spot walk forward 3 feet") is None
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.entries) == (1, 1, 1)
+
+def test_returns_copies():
+    cache = CommandCache()
+    cache.put("walk 2", [ walk(2) ])
+    cache.get("walk 2")[0].amount = 100
+    assert cache.get("walk 2") == [ walk(2) ]
+
+def test_evicts_least_recently_used():
+    cache = CommandCache(max_entries=2)
+    cache.put("walk 1", [ walk(1) ])
+    cache.put("walk 2", [ walk(2) ])
+    cache.get("walk 1")
+    cache.put("walk 3", [ walk(3) ])
+    assert cache.get("walk 2") is None
+    assert cache.get("walk 1") == [ walk(1) ]
+    assert cache.get("walk 3") == [ walk(3) ]
+    assert cache.stats().evictions == 1
+
+def test_entries_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(command_cache.time, "time", clock.time)
+    cache = CommandCache(ttl_seconds=60)
+    cache.put("walk 1", [ walk(1) ])
+    clock.now += 59
+    assert cache.get("walk 1") == [ walk(1) ]
+    clock.now += 2
+    assert cache.get("walk 1") is None
+    assert cache.stats().entries == 0
+
+def test_persists_unexpired_entries(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(command_cache.time, "time", clock.time)
+    path = str(tmp_path / "cache.json")
+    cache = CommandCache(ttl_seconds=60, path=path)
+    cache.put("walk 1", [ walk(1) ])
+    clock.now += 30
+    cache.put("turn left", [ SpotCommand(command=CommandType.TURN, dir=Direction.LEFT, amount=90, duration=0) ])
+    clock.now += 40
+    cache.save()
+    with open(path) as fp:
+        assert [ entry["key"] for entry in json.load(fp)["entries"] ] == [ "turn left" ]
+
+    restored = CommandCache(ttl_seconds=60, path=path)
+    assert restored.get("turn left") == [ SpotCommand(command=CommandType.TURN, dir=Direction.LEFT, amount=90, duration=0) ]
+    assert restored.get("walk 1") is None
+
+def test_load_caps_entries(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = CommandCache(path=path)
+    for feet in range(1, 6):
+        cache.put(f"walk {feet}", [ walk(feet) ])
+    cache.save()
+    restored = CommandCache(max_entries=2, path=path)
+    assert restored.stats().entries == 2
+    assert restored.get("walk 5") == [ walk(5) ]
+
+def test_ignores_corrupt_file(tmp_path):
+    path = tmp_path / "cache.json"
+    path.write_text("{ not json")
+    cache = CommandCache(path=str(path))
+    assert cache.stats().entries == 0
+
+def test_non_finite_words_are_not_numbers():
+    # "infinity" and "nan" once reached int() while normalizing, failing the request before the LLM
+    # was asked
+    cache = CommandCache()
+    for text in [ "Spot, walk forward to infinity", "Nan, turn left", "walk 1e400 feet", "inf" ]:
+        assert cache.get(text) is None
+        cache.put(text, [ walk(1) ])
+        assert cache.get(text) == [ walk(1) ]
+    assert normalize_text("Nan, turn left") == "nan turn left"
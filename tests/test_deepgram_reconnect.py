@@ -0,0 +1,57 @@
+import asyncio
+import itertools
+import socket
+
+from aiohttp import web
+import numpy as np
+
+from ai import DeepgramTranscriber
+from local.fake_deepgram import create_app
+
+
+SAMPLE_RATE = 16000
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def utterance_audio() -> bytes:
+    # Half a second of tone between stretches of low noise, enough for the fake server's VAD to see
+    # one utterance and its end
+    rng = np.random.default_rng(0)
+    t = np.arange(int(0.5 * SAMPLE_RATE)) / SAMPLE_RATE
+    tone = 8000 * np.sin(2 * np.pi * 300 * t)
+    quiet = lambda seconds: rng.normal(scale=30, size=int(seconds * SAMPLE_RATE))
+    samples = np.concatenate([ quiet(0.5), tone, quiet(1.2) ])
+    return samples.astype("<i2").tobytes()
+
+async def send(transcriber: DeepgramTranscriber, audio: bytes, chunk_seconds: float = 0.1):
+    chunk_bytes = int(chunk_seconds * SAMPLE_RATE) * 2
+    for i in range(0, len(audio), chunk_bytes):
+        await transcriber.send_audio(audio[i:i + chunk_bytes])
+        await asyncio.sleep(0.01)
+
+async def reconnects_after_drop():
+    runner = web.AppRunner(create_app(transcripts=itertools.cycle([ "Spot, walk forward.", "Spot, turn left." ]), drop_after=1))
+    await runner.setup()
+    port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    sentences = asyncio.Queue()
+    transcriber = DeepgramTranscriber(on_sentence_received=sentences.put, sample_rate=SAMPLE_RATE, url=f"http://127.0.0.1:{port}")
+    try:
+        await transcriber.start()
+        await send(transcriber, utterance_audio())
+        first = await asyncio.wait_for(sentences.get(), timeout=10)
+        # The server has closed the socket; this audio is buffered until the transcriber reconnects
+        await send(transcriber, utterance_audio())
+        second = await asyncio.wait_for(sentences.get(), timeout=15)
+        return first, second
+    finally:
+        await transcriber.finish()
+        await runner.cleanup()
+
+def test_reconnects_and_delivers_sentences_after_drop():
+    first, second = asyncio.run(reconnects_after_drop())
+    assert first == "Spot, walk forward."
+    assert second == "Spot, turn left."
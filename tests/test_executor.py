@@ -0,0 +1,101 @@
+import asyncio
+import math
+
+import pytest
+
+from bench.fake_spot import FakeSpot
+from executor import CommandExecutor
+from server.models import CommandType, Direction, SpotCommand
+from spot_controller import SpotController
+
+
+TWO_FEET = 2 * 0.3048
+
+def walk(meters: float) -> SpotCommand:
+    return SpotCommand(command=CommandType.WALK, dir=Direction.FORWARD, amount=meters, duration=0.0)
+
+def turn_left() -> SpotCommand:
+    return SpotCommand(command=CommandType.TURN, dir=Direction.LEFT, amount=90.0, duration=0.0)
+
+def stop() -> SpotCommand:
+    return SpotCommand(command=CommandType.STOP, dir=Direction.UNKNOWN, amount=0.0, duration=0.0)
+
+def sit() -> SpotCommand:
+    return SpotCommand(command=CommandType.SIT, dir=Direction.UNKNOWN, amount=0.0, duration=0.0)
+
+def run(scenario):
+    async def main():
+        spot = FakeSpot(rpc_latency=0.002, settle_seconds=0.05, stop_seconds=0.05)
+        controller = SpotController.with_clients(robot=spot.robot, command_client=spot.command_client, state_client=spot.state_client)
+        executor = CommandExecutor(spot=controller)
+        await executor.start()
+        try:
+            await asyncio.wait_for(scenario(executor), timeout=20)
+            await asyncio.wait_for(executor.join(), timeout=20)
+        finally:
+            await executor.close()
+            controller.close()
+        return spot, executor
+    return asyncio.run(main())
+
+def requests(spot: FakeSpot):
+    return [ request for _, request in spot.command_log ]
+
+@pytest.mark.parametrize("safety, robot_request", [ (stop(), "stop"), (sit(), "sit_request") ])
+def test_safety_command_after_motion_in_same_batch_runs_last(safety: SpotCommand, robot_request: str):
+    async def scenario(executor: CommandExecutor):
+        executor.submit_all([ walk(TWO_FEET), safety ])
+    spot, executor = run(scenario)
+    assert spot.pose()[0] == pytest.approx(TWO_FEET, abs=0.01)
+    assert (executor.superseded, executor.preempted) == (0, 0)
+    assert requests(spot)[0] == "se2_trajectory_request"
+    assert robot_request in requests(spot)[1:]
+
+@pytest.mark.parametrize("safety, robot_request", [ (stop(), "stop"), (sit(), "sit_request") ])
+def test_safety_command_after_motion_in_same_stream_runs_last(safety: SpotCommand, robot_request: str):
+    async def commands():
+        yield walk(TWO_FEET)
+        # The walk is under way by the time the safety command is parsed
+        await asyncio.sleep(0.2)
+        yield safety
+
+    async def scenario(executor: CommandExecutor):
+        await executor.submit_stream(commands())
+    spot, executor = run(scenario)
+    assert spot.pose()[0] == pytest.approx(TWO_FEET, abs=0.01)
+    assert (executor.superseded, executor.preempted) == (0, 0)
+    assert robot_request in requests(spot)[1:]
+
+def test_stop_preempts_earlier_batches():
+    async def scenario(executor: CommandExecutor):
+        executor.submit_all([ walk(3.0) ])
+        executor.submit_all([ turn_left() ])
+        await asyncio.sleep(0.5)
+        executor.submit_all([ stop() ])
+    spot, executor = run(scenario)
+    assert 0.1 < spot.pose()[0] < 1.0
+    assert spot.pose()[2] == pytest.approx(0.0, abs=0.01)
+    assert (executor.superseded, executor.preempted, executor.halts) == (1, 1, 1)
+    assert executor.last_halt_seconds is not None
+
+def test_batch_runs_after_earlier_batch_is_preempted():
+    async def scenario(executor: CommandExecutor):
+        executor.submit_all([ walk(3.0) ])
+        await asyncio.sleep(0.5)
+        executor.submit_all([ turn_left(), stop() ])
+    spot, executor = run(scenario)
+    # The walk is cut short, the robot comes to rest, then turns, then stops
+    assert 0.1 < spot.pose()[0] < 1.0
+    assert spot.pose()[2] == pytest.approx(math.pi / 2, abs=0.05)
+    assert executor.preempted == 1
+    assert requests(spot) == [ "se2_trajectory_request", "stop", "se2_trajectory_request", "stop" ]
+
+def test_repeated_stops_are_coalesced():
+    async def scenario(executor: CommandExecutor):
+        executor.submit_all([ walk(3.0) ])
+        await asyncio.sleep(0.3)
+        executor.submit_all([ stop() ])
+        executor.submit_all([ stop() ])
+    spot, executor = run(scenario)
+    assert (executor.coalesced, executor.halts) == (1, 1)
+    assert requests(spot).count("stop") == 1
@@ -0,0 +1,109 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.datastructures import State
+
+from server import server
+from server.fleet import FleetOverloaded, FleetScheduler, ROBOT_ID_HEADER
+
+
+async def hold(fleet: FleetScheduler, robot_id: str, started: list, release: asyncio.Event):
+    async with fleet.admit(robot_id):
+        started.append(robot_id)
+        await release.wait()
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_per_robot_cap():
+    async def run():
+        fleet = FleetScheduler(max_concurrency=8, per_robot_concurrency=2, max_queue_per_robot=8)
+        started = []
+        release = asyncio.Event()
+        tasks = [ asyncio.ensure_future(hold(fleet, "a", started, release)) for _ in range(3) ]
+        tasks.append(asyncio.ensure_future(hold(fleet, "b", started, release)))
+        await settle()
+        # The third request for a waits for one of the first two, but does not hold up b
+        assert started == [ "a", "a", "b" ]
+        stats = { session.robot_id: session for session in fleet.stats() }
+        assert (stats["a"].in_flight, stats["a"].queue_depth) == (2, 1)
+        release.set()
+        await asyncio.gather(*tasks)
+        assert started == [ "a", "a", "b", "a" ]
+        assert { session.robot_id: session.completed for session in fleet.stats() } == { "a": 3, "b": 1 }
+    asyncio.run(run())
+
+def test_waiting_robots_take_turns():
+    async def run():
+        fleet = FleetScheduler(max_concurrency=1, per_robot_concurrency=1, max_queue_per_robot=8)
+        order = []
+        gate = asyncio.Event()
+        async def request(robot_id: str):
+            async with fleet.admit(robot_id):
+                await gate.wait()
+                order.append(robot_id)
+        first = asyncio.ensure_future(request("a"))
+        await settle()
+        rest = [ asyncio.ensure_future(request(robot_id)) for robot_id in [ "a", "a", "b", "b" ] ]
+        await settle()
+        gate.set()
+        await asyncio.gather(first, *rest)
+        assert order == [ "a", "a", "b", "a", "b" ]
+    asyncio.run(run())
+
+def test_full_queue_is_rejected():
+    async def run():
+        fleet = FleetScheduler(max_concurrency=8, per_robot_concurrency=1, max_queue_per_robot=2)
+        started = []
+        release = asyncio.Event()
+        tasks = [ asyncio.ensure_future(hold(fleet, "a", started, release)) for _ in range(3) ]
+        await settle()
+        with pytest.raises(FleetOverloaded) as e:
+            async with fleet.admit("a"):
+                pass
+        assert e.value.robot_id == "a"
+        assert e.value.retry_after >= 1
+        # Another robot is unaffected
+        async with fleet.admit("b"):
+            pass
+        release.set()
+        await asyncio.gather(*tasks)
+        assert { session.robot_id: session.rejected for session in fleet.stats() } == { "a": 1, "b": 0 }
+    asyncio.run(run())
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def run():
+        fleet = FleetScheduler(max_concurrency=8, per_robot_concurrency=1, max_queue_per_robot=1)
+        started = []
+        release = asyncio.Event()
+        running = asyncio.ensure_future(hold(fleet, "a", started, release))
+        waiting = asyncio.ensure_future(hold(fleet, "a", started, release))
+        await settle()
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        # The queue has room again
+        queued = asyncio.ensure_future(hold(fleet, "a", started, release))
+        await settle()
+        release.set()
+        await asyncio.gather(running, queued)
+        assert started == [ "a", "a" ]
+    asyncio.run(run())
+
+def test_server_answers_429_with_retry_after(monkeypatch):
+    # configure() sets up the module-level app; give it a fresh state that is put back afterwards
+    monkeypatch.setattr(server.app, "state", State())
+
+    async def run():
+        fleet = FleetScheduler(max_concurrency=8, per_robot_concurrency=1, max_queue_per_robot=0)
+        server.configure(openai_client=None, fleet=fleet)
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async with fleet.admit("robot-1"):
+                response = await client.post("/process_speech", data={ "text": "walk forward 2 feet" }, headers={ ROBOT_ID_HEADER: "robot-1" })
+                assert response.status_code == 429
+                assert int(response.headers["Retry-After"]) >= 1
+                response = await client.post("/process_speech", data={ "text": "walk forward 2 feet" }, headers={ ROBOT_ID_HEADER: "robot-2" })
+                assert response.status_code == 200
+    asyncio.run(run())
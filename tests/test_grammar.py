@@ -0,0 +1,58 @@
+import pytest
+
+from server.grammar import parse_local
+from server.models import CommandType, Direction
+from server.speech_processor import FEET_TO_METERS
+
+
+def parsed(text: str):
+    commands = parse_local(text)
+    assert commands is not None, text
+    return [ (command.command, command.dir, round(command.amount, 4), command.duration) for command in commands ]
+
+def test_walk_distance_defaults_to_feet():
+    assert parsed("Spot, walk forward three feet") == [ (CommandType.WALK, Direction.FORWARD, round(3 * FEET_TO_METERS, 4), 0.0) ]
+    assert parsed("walk 2") == [ (CommandType.WALK, Direction.FORWARD, round(2 * FEET_TO_METERS, 4), 0.0) ]
+
+def test_walk_units():
+    assert parsed("go back 1.5 meters") == [ (CommandType.WALK, Direction.BACKWARD, 1.5, 0.0) ]
+    assert parsed("move backwards 1 yard") == [ (CommandType.WALK, Direction.BACKWARD, round(3 * FEET_TO_METERS, 4), 0.0) ]
+
+def test_walk_duration():
+    assert parsed("walk forward for 5 seconds") == [ (CommandType.WALK, Direction.FORWARD, 0.0, 5.0) ]
+    assert parsed("walk forward 2 minutes") == [ (CommandType.WALK, Direction.FORWARD, 0.0, 120.0) ]
+
+def test_turn():
+    assert parsed("turn left") == [ (CommandType.TURN, Direction.LEFT, 90.0, 0.0) ]
+    assert parsed("rotate clockwise 45 degrees") == [ (CommandType.TURN, Direction.RIGHT, 45.0, 0.0) ]
+    assert parsed("turn around") == [ (CommandType.TURN, Direction.UNKNOWN, 180.0, 0.0) ]
+
+def test_bow_dance_stop_sit():
+    assert parsed("take a bow") == [ (CommandType.BOW, Direction.UNKNOWN, 0.0, 0.0) ]
+    assert parsed("do a dance") == [ (CommandType.DUST_OFF, Direction.UNKNOWN, 0.0, 0.0) ]
+    assert parsed("stop right there") == [ (CommandType.STOP, Direction.UNKNOWN, 0.0, 0.0) ]
+    assert parsed("sit") == [ (CommandType.SIT, Direction.UNKNOWN, 0.0, 0.0) ]
+    assert parsed("lie down") == [ (CommandType.SIT, Direction.UNKNOWN, 0.0, 0.0) ]
+
+def test_multiple_clauses():
+    assert [ command[0] for command in parsed("walk forward 2 feet then turn right and then take a bow") ] == [ CommandType.WALK, CommandType.TURN, CommandType.BOW ]
+    assert [ command[0] for command in parsed("stop and turn left") ] == [ CommandType.STOP, CommandType.TURN ]
+    assert [ command[0] for command in parsed("walk forward 2 feet then stop") ] == [ CommandType.WALK, CommandType.STOP ]
+
+@pytest.mark.parametrize("text", [
+    "walk forward",                     # no extent
+    "walk forward backward 2 feet",     # conflicting directions
+    "turn left right",
+    "turn 400 degrees",
+    "lie",
+    "walk to the kitchen",              # left to the LLM
+    "please fetch the ball",
+    "",
+    "walk forward nan feet",            # not a number, though float() accepts it
+    "walk forward infinity feet",
+    "walk forward 1e400 feet",
+    "turn left nan degrees",
+    "turn left inf degrees",
+])
+def test_falls_back_to_llm(text: str):
+    assert parse_local(text) is None
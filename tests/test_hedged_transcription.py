@@ -0,0 +1,85 @@
+import asyncio
+import itertools
+from typing import BinaryIO
+
+import pytest
+
+from server.backends import BackendExecutor
+from server.ingest import AudioUpload
+from server.transcription import HedgedTranscriber, StubBackend, TranscriptionBackend
+
+
+# Latencies are recorded in process-wide histograms keyed by backend name, so each test uses fresh names
+_names = itertools.count()
+
+def stub(text: str, latency: float = 0.0) -> StubBackend:
+    return StubBackend(text=text, latency=latency, name=f"{text}-{next(_names)}")
+
+class FailingBackend(TranscriptionBackend):
+    def __init__(self, message: str):
+        self.message = message
+        self.name = f"failing-{next(_names)}"
+
+    def transcribe(self, audio: BinaryIO) -> str:
+        raise RuntimeError(self.message)
+
+class RecordingBackend(StubBackend):
+    def transcribe(self, audio: BinaryIO) -> str:
+        self.received = audio.read()
+        return super().transcribe(audio=audio)
+
+def hedged(primary: TranscriptionBackend, secondary: TranscriptionBackend = None, **kwargs) -> HedgedTranscriber:
+    return HedgedTranscriber(
+        primary=primary,
+        primary_executor=BackendExecutor(name=primary.name, max_concurrency=4),
+        secondary=secondary,
+        secondary_executor=BackendExecutor(name=secondary.name, max_concurrency=4) if secondary is not None else None,
+        **kwargs
+    )
+
+def transcribe(transcriber: HedgedTranscriber, data: bytes = b"RIFF") -> str:
+    return asyncio.run(transcriber.transcribe(AudioUpload.from_bytes(data=data, filename="voice.wav")))
+
+def test_without_secondary():
+    primary = RecordingBackend(text="walk forward", name=f"recording-{next(_names)}")
+    transcriber = hedged(primary=primary)
+    assert transcribe(transcriber, data=b"audio bytes") == "walk forward"
+    assert primary.received == b"audio bytes"
+    stats = transcriber.stats()
+    assert (stats.requests, stats.hedged, stats.secondary) == (1, 0, None)
+
+def test_fast_primary_is_not_hedged():
+    transcriber = hedged(primary=stub("primary"), secondary=stub("secondary"), initial_hedge_delay=1.0)
+    assert transcribe(transcriber) == "primary"
+    stats = transcriber.stats()
+    assert (stats.requests, stats.hedged, stats.secondary_wins, stats.failovers) == (1, 0, 0, 0)
+
+def test_slow_primary_is_hedged():
+    transcriber = hedged(primary=stub("primary", latency=0.5), secondary=stub("secondary"), initial_hedge_delay=0.05)
+    assert transcribe(transcriber) == "secondary"
+    stats = transcriber.stats()
+    assert (stats.hedged, stats.secondary_wins) == (1, 1)
+
+def test_primary_wins_a_hedged_race():
+    transcriber = hedged(primary=stub("primary", latency=0.1), secondary=stub("secondary", latency=1.0), initial_hedge_delay=0.02)
+    assert transcribe(transcriber) == "primary"
+    stats = transcriber.stats()
+    assert (stats.hedged, stats.secondary_wins) == (1, 0)
+
+def test_failed_primary_fails_over():
+    transcriber = hedged(primary=FailingBackend("primary down"), secondary=stub("secondary"), initial_hedge_delay=1.0)
+    assert transcribe(transcriber) == "secondary"
+    stats = transcriber.stats()
+    assert (stats.hedged, stats.failovers, stats.secondary_wins) == (0, 1, 1)
+
+def test_both_failing_raises_primary_error():
+    transcriber = hedged(primary=FailingBackend("primary down"), secondary=FailingBackend("secondary down"))
+    with pytest.raises(RuntimeError, match="primary down"):
+        transcribe(transcriber)
+
+def test_hedge_delay_follows_primary_latency():
+    transcriber = hedged(primary=stub("primary", latency=0.01), secondary=stub("secondary"), initial_hedge_delay=5.0, min_hedge_delay=0.001, min_samples=5)
+    assert transcriber.hedge_delay() == 5.0
+    for _ in range(5):
+        assert transcribe(transcriber) == "primary"
+    assert 0.01 <= transcriber.hedge_delay() < 1.0
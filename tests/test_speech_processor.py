@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+from server.models import CommandType, Direction, SpotCommand
+from server.speech_processor import FEET_TO_METERS, process_speech_stream
+
+
+def tool_chunk(index: int, arguments: str, name: str = None, id: str = None):
+    function = SimpleNamespace(name=name, arguments=arguments)
+    delta = SimpleNamespace(content=None, tool_calls=[ SimpleNamespace(index=index, id=id, function=function) ])
+    return SimpleNamespace(choices=[ SimpleNamespace(delta=delta) ])
+
+class StreamingClient:
+    # Stands in for openai.OpenAI, streaming the given chunks as the completion
+    def __init__(self, chunks: list):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: iter(chunks)))
+
+def test_malformed_streamed_tool_call_is_skipped():
+    client = StreamingClient([
+        tool_chunk(0, "", name="walk_command", id="call_0"),
+        tool_chunk(0, '{"direction": "forward", "distance": 2, "duration": 0}'),
+        tool_chunk(1, "", name="turn_command", id="call_1"),
+        tool_chunk(1, '{"direction": "left", "ang'),      # the completion ends mid-call
+    ])
+    emitted = []
+    commands = process_speech_stream(client=client, text="walk forward two feet and turn left", on_command=emitted.append)
+    walk = SpotCommand(command=CommandType.WALK, dir=Direction.FORWARD, amount=2 * FEET_TO_METERS, duration=0.0)
+    assert commands == [ walk ]
+    assert emitted == [ walk ]
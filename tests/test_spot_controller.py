@@ -0,0 +1,30 @@
+import time
+
+from bench.fake_spot import FakeSpot
+from spot_controller import SpotController
+
+
+def velocity_requests(spot: FakeSpot) -> int:
+    return sum(1 for _, request in spot.command_log if request == "se2_velocity_request")
+
+def test_exit_stops_refreshes_before_sitting():
+    spot = FakeSpot(rpc_latency=0.002)
+    controller = SpotController.with_clients(robot=spot.robot, command_client=spot.command_client, state_client=spot.state_client)
+    handle = controller.stream_velocity(v_x=0.3, period=0.02)
+    time.sleep(0.1)
+    assert velocity_requests(spot) > 1
+
+    sent_while_sitting = []
+    def power_off_sit_down():
+        before = velocity_requests(spot)
+        time.sleep(0.1)
+        sent_while_sitting.append(velocity_requests(spot) - before)
+    controller.power_off_sit_down = power_off_sit_down
+    controller.return_lease = lambda: None
+    controller.set_estop = lambda: None
+    controller.__exit__(None, None, None)
+
+    assert sent_while_sitting == [ 0 ]
+    assert handle.done()
+    # close() shuts the scheduler down again, harmlessly
+    controller.close()
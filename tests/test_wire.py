@@ -0,0 +1,43 @@
+import pytest
+
+from server.models import CommandType, Direction, SpotCommand
+from server.wire import HEADER, RECORD, decode_commands, encode_commands, is_encoded
+
+
+COMMANDS = [
+    SpotCommand(command=CommandType.WALK, dir=Direction.FORWARD, amount=0.6096, duration=0.0),
+    SpotCommand(command=CommandType.TURN, dir=Direction.LEFT, amount=90.0, duration=0.0),
+    SpotCommand(command=CommandType.WALK, dir=Direction.BACKWARD, amount=0.0, duration=5.0),
+    SpotCommand(command=CommandType.BOW, dir=Direction.UNKNOWN, amount=0.0, duration=0.0),
+    SpotCommand(command=CommandType.DUST_OFF, dir=Direction.UNKNOWN, amount=0.0, duration=0.0),
+    SpotCommand(command=CommandType.STOP, dir=Direction.UNKNOWN, amount=0.0, duration=0.0),
+    SpotCommand(command=CommandType.SIT, dir=Direction.RIGHT, amount=0.0, duration=0.0),
+]
+
+def test_round_trip():
+    data = encode_commands(COMMANDS)
+    assert len(data) == HEADER.size + RECORD.size * len(COMMANDS)
+    assert is_encoded(data)
+    decoded = decode_commands(data)
+    assert [ (command.command, command.dir, command.duration) for command in decoded ] == [ (command.command, command.dir, command.duration) for command in COMMANDS ]
+    # Amounts travel as float32
+    assert [ command.amount for command in decoded ] == pytest.approx([ command.amount for command in COMMANDS ], rel=1e-6)
+
+def test_empty():
+    assert decode_commands(encode_commands([])) == []
+
+def test_json_is_not_encoded():
+    assert not is_encoded(b'{"commands": []}')
+
+@pytest.mark.parametrize("data", [
+    b"SP",                                                  # truncated header
+    b"XYZ" + encode_commands(COMMANDS)[3:],                 # bad magic
+    b"SPC\x02" + encode_commands(COMMANDS)[4:],             # unknown version
+    encode_commands(COMMANDS)[:-1],                         # truncated record
+    encode_commands(COMMANDS) + b"\x00",                    # trailing bytes
+    HEADER.pack(b"SPC", 1, 1) + RECORD.pack(200, 0, 1.0, 0.0),   # unknown command code
+    HEADER.pack(b"SPC", 1, 1) + RECORD.pack(0, 200, 1.0, 0.0),   # unknown direction code
+])
+def test_rejects_malformed_payloads(data: bytes):
+    with pytest.raises(ValueError):
+        decode_commands(data)
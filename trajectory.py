@@ -0,0 +1,82 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from server.models import CommandType, Direction, SpotCommand
+
+
+MAX_WALK_DISTANCE = 3.0         # meters, per command
+LINEAR_SPEED = 0.5              # m/s, used to time trajectory points
+ANGULAR_SPEED = 0.8             # rad/s, used to time trajectory points
+MAX_WALK_SECONDS = 10.0         # per duration-only command
+MAX_ACCELERATION = 0.5          # m/s^2, for streamed velocity setpoints
+
+
+####################################################################################################
+# Planning
+####################################################################################################
+
+def command_displacements(commands: List[SpotCommand]) -> Tuple[np.ndarray, np.ndarray]:
+    # Per-command signed forward distance (m) and heading change (rad). Commands that do not move the
+    # body contribute zeros.
+    distances = np.zeros(len(commands))
+    turns = np.zeros(len(commands))
+    for i, command in enumerate(commands):
+        if command.command == CommandType.WALK:
+            dir = -1.0 if command.dir == Direction.BACKWARD else 1.0
+            distances[i] = dir * min(command.amount, MAX_WALK_DISTANCE)
+        elif command.command == CommandType.TURN:
+            dir = -1.0 if command.dir == Direction.RIGHT else 1.0
+            turns[i] = dir * np.radians(abs(command.amount))
+    return distances, turns
+
+def plan_trajectory(commands: List[SpotCommand]) -> Tuple[np.ndarray, np.ndarray]:
+    # Folds WALK/TURN commands into waypoints relative to the starting body pose. Returns (poses, times):
+    # poses is (N, 3) of [x, y, heading] with x forward and y left, one per motion command, and times
+    # is the (N,) time from start at which each should be reached.
+    distances, turns = command_displacements(commands)
+    moving = (distances != 0) | (turns != 0)
+    distances, turns = distances[moving], turns[moving]
+    headings = np.cumsum(turns)
+    # Each walk proceeds along the heading accumulated from all preceding turns
+    x = np.cumsum(distances * np.cos(headings))
+    y = np.cumsum(distances * np.sin(headings))
+    times = np.cumsum(np.abs(distances) / LINEAR_SPEED + np.abs(turns) / ANGULAR_SPEED)
+    return np.stack([ x, y, headings ], axis=1), times
+
+def is_timed_walk(command: SpotCommand) -> bool:
+    # "Walk forward for 5 seconds": no distance to plan a trajectory for, executed by velocity control
+    return command.command == CommandType.WALK and command.amount <= 0 and command.duration > 0
+
+def ramped_velocity(elapsed, speed: float, duration: float, max_acceleration: float = MAX_ACCELERATION):
+    # Trapezoidal velocity profile: ramps up to speed, holds, and ramps back down to zero at duration.
+    # Short durations never reach full speed. Works on scalars and arrays of elapsed times.
+    ramp_seconds = min(abs(speed) / max_acceleration, duration / 2)
+    if ramp_seconds <= 0:
+        return np.zeros_like(elapsed, dtype=float)
+    scale = np.clip(np.minimum(elapsed, duration - np.asarray(elapsed)) / ramp_seconds, 0.0, 1.0)
+    return speed * scale
+
+def compose(origin: np.ndarray, poses: np.ndarray) -> np.ndarray:
+    # Transforms (N, 3) poses expressed relative to origin [x, y, heading] into origin's parent frame
+    c, s = np.cos(origin[2]), np.sin(origin[2])
+    output = np.empty_like(poses)
+    output[:, 0] = origin[0] + c * poses[:, 0] - s * poses[:, 1]
+    output[:, 1] = origin[1] + s * poses[:, 0] + c * poses[:, 1]
+    output[:, 2] = np.arctan2(np.sin(origin[2] + poses[:, 2]), np.cos(origin[2] + poses[:, 2]))
+    return output
+
+def compute_trajectory(commands: List[SpotCommand], current_pos: np.ndarray, forward: np.ndarray) -> Tuple[List[np.ndarray], np.ndarray, np.ndarray]:
+    # Position-only view of plan_trajectory for callers tracking a 2D position and forward vector.
+    # Returns the position after each walk, and the final position and forward vector.
+    poses, _ = plan_trajectory(commands)
+    if len(poses) == 0:
+        return ([], current_pos, forward)
+    start_heading = np.arctan2(forward[1], forward[0])
+    world = compose(np.array([ current_pos[0], current_pos[1], start_heading ]), poses)
+    distances, turns = command_displacements(commands)
+    is_walk = (distances != 0)[(distances != 0) | (turns != 0)]
+    points = [ point.copy() for point in world[is_walk, :2] ]
+    final_heading = world[-1, 2]
+    current_pos[:] = world[-1, :2]
+    return (points, current_pos, np.array([ np.cos(final_heading), np.sin(final_heading) ]) * np.linalg.norm(forward))